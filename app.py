@@ -1,24 +1,175 @@
-from flask import Flask, render_template, session, redirect, request, jsonify
-from openai import OpenAI
+import time
+STARTUP_STARTED_AT = time.perf_counter()
+
+from flask import Flask, render_template, session, redirect, request, jsonify, Response
 import csv
 import os
 import random
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import requests
-import time
 from werkzeug.middleware.proxy_fix import ProxyFix
-from threading import Thread
+from threading import Lock
 import uuid
 import json
 import re
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import click
+from session_store import ServerSideSessionInterface, SessionStore
+from telemetry import (current_route, debug_access_required, get_last_run_datetime, increment_counter, init_tracing,
+                       job_gauges, observe_histogram, recent_traces, record_usage_event, render_metrics,
+                       start_background_thread, summarise_usage, trace_span, trace_waterfall, traced, traces_lock,
+                       usage_db)
+from story_vocabulary import StoryVocabulary
+from llm_gateway import LLMGateway, ModelUnavailableError, response_output_text
+from conversation import ConversationHistory, ConversationTurns
+from startup import Startup
 
 app = Flask(__name__)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 app.secret_key = os.environ.get('FLASK_SESSION_SECRET_KEY')
-
-openai_client = None
+# Sessions are stored server-side (session_store.py, shared with the German app): the cookie holds only a
+# signed session id instead of selected_words and the whole conversation, and unchanged sessions are not
+# written back. SESSION_DB_PATH='' keeps sessions in memory only.
+SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH', 'sessions.db')
+SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', str(7 * 24 * 60 * 60)))
+session_store = SessionStore(SESSION_DB_PATH, ttl_seconds=SESSION_TTL_SECONDS)
+app.session_interface = ServerSideSessionInterface(session_store)
+# Each request gets a trace (telemetry.py); recent ones are listed at /debug/traces
+init_tracing(app)
+
+wanikani_session = requests.Session()
 burned_story_jobs = {}
+# Derived artefacts for each conversation turn, computed speculatively once the reply is known (conversation.py)
+conversation_turns = ConversationTurns()
+STORY_FOCUS_WORD_COUNT = 8
+
+# Story prompts use a bounded subset of the burned words (story_vocabulary.py): a daily rotating list,
+# then words named in the scenario and words from the categories below that it mentions.
+# Scenario keywords (English or Japanese) and the kanji that mark a burned word as belonging to a category
+VOCABULARY_CATEGORIES = {
+    'food': (
+        ('food', 'eat', 'restaurant', 'cafe', 'café', 'cook', 'breakfast', 'lunch', 'dinner', 'meal', 'drink',
+         'kitchen', 'sushi', 'ramen', 'tea', 'coffee', 'izakaya', '食', '料理', 'レストラン', 'カフェ'),
+        '食飯料菜肉魚米酒茶味飲麺豆卵塩甘辛焼野果',
+    ),
+    'travel': (
+        ('travel', 'trip', 'station', 'train', 'airport', 'plane', 'bus', 'hotel', 'tour', 'holiday', 'vacation',
+         'drive', 'car', 'ticket', '旅', '駅', '電車', 'ホテル'),
+        '旅駅車電道港空乗船線券泊観光地図',
+    ),
+    'school_work': (
+        ('school', 'class', 'teacher', 'student', 'study', 'exam', 'test', 'university', 'work', 'office', 'job',
+         'meeting', 'boss', 'colleague', 'company', '学校', '仕事', '会社'),
+        '学校先生勉教試験授業仕事会社働社員議職',
+    ),
+    'people': (
+        ('family', 'friend', 'mother', 'father', 'parent', 'brother', 'sister', 'child', 'kid', 'wife', 'husband',
+         'party', 'date', 'wedding', '家族', '友', '子供'),
+        '家族父母兄弟姉妹子友人男女夫妻親彼恋',
+    ),
+    'nature': (
+        ('nature', 'weather', 'rain', 'snow', 'wind', 'mountain', 'river', 'sea', 'beach', 'forest', 'park',
+         'garden', 'flower', 'hike', 'season', '天気', '山', '海'),
+        '天気雨雪風山川海森林木花空晴雲春夏秋冬島池',
+    ),
+    'health': (
+        ('health', 'doctor', 'hospital', 'sick', 'ill', 'medicine', 'pain', 'gym', 'sport', 'exercise', 'run',
+         '病院', '医者'),
+        '体病医薬手足目口耳頭心痛健運動',
+    ),
+    'shopping': (
+        ('shop', 'shopping', 'store', 'buy', 'sell', 'money', 'price', 'market', 'mall', 'cheap', 'expensive',
+         '買い物', '店'),
+        '買売店金円値安高払品',
+    ),
+    'home': (
+        ('home', 'house', 'room', 'apartment', 'move', 'clean', 'neighbor', 'neighbour', 'bed', '家', '部屋'),
+        '家屋部室庭窓戸住寝床掃',
+    ),
+    'feelings': (
+        ('feel', 'happy', 'sad', 'angry', 'love', 'afraid', 'lonely', 'worry', 'surprise', '気持ち'),
+        '好嫌楽悲怒喜幸愛怖寂驚心配',
+    ),
+}
+
+# Model routing: each task lists acceptable (model, reasoning effort) options in order of preference (cheapest
+# acceptable first, then faster fallbacks) and a latency budget. The first option whose recent p90 latency fits
+# the budget is used; options without enough samples are assumed to fit. If the call is still running after
+# hedge_after_seconds, the next option is raced against it and the first answer wins.
+# MODEL_ROUTING=static always uses the first option and never hedges (see llm_gateway.py).
+MODEL_ROUTES = {
+    'burned_story': {'budget_seconds': 60, 'hedge_after_seconds': 45,
+                     'options': [('gpt-5', 'medium'), ('gpt-5', 'low'), ('gpt-5-mini', 'low')]},
+    'furigana': {'budget_seconds': 30, 'hedge_after_seconds': 20,
+                 'options': [('gpt-5', 'medium'), ('gpt-5', 'low'), ('gpt-5-mini', 'low')]},
+    'story': {'budget_seconds': 10, 'hedge_after_seconds': 8,
+              'options': [('gpt-5', 'minimal'), ('gpt-5-mini', 'minimal')]},
+    'spell_grammar': {'budget_seconds': 8, 'hedge_after_seconds': 6,
+                      'options': [('gpt-5', 'minimal'), ('gpt-5-mini', 'minimal')]},
+    'translation': {'budget_seconds': 10, 'options': [('gpt-5-nano', 'minimal')]},
+    'word_detail': {'budget_seconds': 5, 'options': [('gpt-5-nano', 'minimal')]},
+    'kanji_word': {'budget_seconds': 5, 'options': [('gpt-5-nano', 'minimal')]},
+    'pregenerate': {'budget_seconds': 120, 'options': [('gpt-5-mini', 'minimal'), ('gpt-5-nano', 'minimal')]},
+}
+
+# Model calls go through the gateway shared with the German app (llm_gateway.py): one pooled client, retries,
+# circuit breakers, single-flight, routing and metrics. The openai SDK is the slowest import and is not needed
+# to serve '/', so the gateway imports it on first use, or the warm-up thread does before /ready reports ready.
+# Per-task timeouts in seconds; retry and circuit breaker settings live in the gateway.
+LLM_TIMEOUT_SECONDS = {
+    'burned_story': 240,
+    'furigana': 180,
+    'story': 60,
+    'spell_grammar': 45,
+    'translation': 60,
+    'word_detail': 30,
+    'kanji_word': 30,
+    'conversation': 45,
+    'conversation_summary': 60,
+    'pregenerate': 300,
+    'reasoning': 240,
+}
 BURNED_WORDS_CSV_PATH = os.path.join('templates', 'burnedWords.csv')
+# Process-wide burned word index shared by every burned story job. Snapshots are immutable and replaced
+# whole: the CSV is only re-parsed when its (mtime, size) changes, and writes publish a new version directly.
+# { 'version': int, 'stamp': (mtime_ns, size) or None, 'words': sorted tuple of interned str, 'members': frozenset }
+burned_word_index = {'version': 0, 'stamp': None, 'words': (), 'members': frozenset()}
+burned_word_index_lock = Lock()
+EMPTY_BURNED_WORD_INDEX = burned_word_index
+# Example word (word, hiragana, meaning) per kanji for kanji reviews, cached as CSV rows kanji,word,hiragana,meaning.
+# Filled on demand and ahead of time by `flask --app app pregenerate` for the kanji that come up for review soon.
+KANJI_WORDS_CSV_PATH = os.path.join('templates', 'kanjiWords.csv')
+kanji_word_cache = {'stamp': None, 'words': {}}
+kanji_word_cache_lock = Lock()
+PREGENERATE_PROGRESS_PATH = 'pregenerate_progress.json'
+KANJI_WORDS_FORMAT = {
+    'type': 'json_schema',
+    'name': 'kanji_words',
+    'strict': True,
+    'schema': {
+        'type': 'object',
+        'properties': {
+            'items': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'kanji': {'type': 'string'},
+                        'word': {'type': 'string'},
+                        'hiragana': {'type': 'string'},
+                        'meaning': {'type': 'string'},
+                    },
+                    'required': ['kanji', 'word', 'hiragana', 'meaning'],
+                    'additionalProperties': False,
+                },
+            },
+        },
+        'required': ['items'],
+        'additionalProperties': False,
+    },
+}
+WANIKANI_API_URL = os.environ.get('WANIKANI_API_URL', 'https://api.wanikani.com/v2/')
 
 BURNED_STORY_WAITING_MESSAGE = "Deep breaths — I am brewing your story."
 
@@ -31,42 +182,32 @@ ENGLISH_WAITING_MESSAGE = (
 )
 
 
-def ensure_openai_client():
-    """Lazily initialize the OpenAI client so failure surfaces early with a clear error."""
-    global openai_client
-    if openai_client is None:
-        api_key = os.environ.get('OPENAI_API_KEY')
-        if not api_key:
-            raise RuntimeError('OPENAI_API_KEY environment variable is not set.')
-        try:
-            openai_client = OpenAI(api_key=api_key)
-        except Exception as exc:
-            print(f"Failed to initialize OpenAI client: {exc}")
-            raise
-    return openai_client
-
-
-def get_completion_from_messages(messages, model="gpt-5-nano", max_tokens=2000, reasoning_effort="minimal"):
-    """Wrapper around OpenAI Responses API"""
-    client = ensure_openai_client()
-
-    create_args = {
-        "model": model,
-        "input": messages,
-        "reasoning": {"effort": reasoning_effort},
-        "max_output_tokens": max_tokens,
-    }
-    response = client.responses.create(**create_args)
+llm = LLMGateway(MODEL_ROUTES, LLM_TIMEOUT_SECONDS, increment_counter=increment_counter,
+                 observe_histogram=observe_histogram, trace_span=trace_span, current_route=current_route)
+
+
+def create_response(messages, model="gpt-5-nano", max_tokens=2000, reasoning_effort="minimal", previous_response_id=None,
+                    prompt_cache_key=None, feature=None, text_format=None):
+    """Call the Responses API through the gateway and return the raw response so callers can read usage and id."""
+    return llm.create(messages, model=model, max_tokens=max_tokens, reasoning_effort=reasoning_effort,
+                      previous_response_id=previous_response_id, prompt_cache_key=prompt_cache_key, feature=feature,
+                      text_format=text_format)
+
+
+# Conversation history windowing, rolling summaries and response chaining (conversation.py)
+conversation = ConversationHistory(llm, create_response)
+
+
+def create_routed_response(messages, task, **create_args):
+    """Call the Responses API with the model and effort chosen by MODEL_ROUTES[task], hedging slow calls."""
+    return llm.create_routed(messages, task, **create_args)
 
-    if hasattr(response, 'output_text') and response.output_text:
-        return response.output_text
-    raise RuntimeError('No text returned from Responses API call.')
 
 def get_response_from_wanikani(url_end = ""):
     if url_end.startswith("http"):
         api_url = url_end
     else:
-        api_url = "https://api.wanikani.com/v2/" + url_end
+        api_url = WANIKANI_API_URL + url_end
     # print("WANIKANI API request:" + api_url )
 
     wanikani_api_key = os.environ.get('WANIKANI_API_KEY')
@@ -75,7 +216,19 @@ def get_response_from_wanikani(url_end = ""):
         "Authorization": f"Bearer {wanikani_api_key}"
     }
     # print(custom_headers)
-    response = requests.get(api_url, headers=custom_headers)
+    resource = api_url.split("/v2/", 1)[-1].split("?", 1)[0].split("/", 1)[0] or 'root'
+    labels = {'route': current_route(), 'resource': resource}
+    start_time = time.time()
+    try:
+        with trace_span(f"wanikani {resource}", 'wanikani'):
+            response = wanikani_session.get(api_url, headers=custom_headers)
+    except Exception as exc:
+        observe_histogram('wanikani_request_duration_seconds', time.time() - start_time, **labels)
+        increment_counter('wanikani_requests_total', error=type(exc).__name__, **labels)
+        raise
+    observe_histogram('wanikani_request_duration_seconds', time.time() - start_time, **labels)
+    increment_counter('wanikani_requests_total',
+                      error='none' if response.status_code == 200 else f'HTTP{response.status_code}', **labels)
 
     if response.status_code == 200:
         data = response.json()
@@ -89,19 +242,13 @@ def get_response_from_wanikani(url_end = ""):
 
 def get_reasoning_completion(messages, model="gpt-5"):
     """Call the OpenAI GPT-5 reasoning model following the German app pattern."""
-    client = ensure_openai_client()
     start_time = time.time()
-    response = client.responses.create(
-        model=model or "gpt-5",
-        input=messages,
-        reasoning={"effort": "medium"},
-    )
+    response = create_response(messages, model=model or "gpt-5", max_tokens=None, reasoning_effort="medium",
+                               feature='reasoning')
     elapsed = time.time() - start_time
     #print(messages)
     print(f"Reasoning model response time: {elapsed:.2f} seconds.")
-    if hasattr(response, 'output_text') and response.output_text:
-        return response.output_text.strip()
-    raise RuntimeError('No text returned from reasoning model response.')
+    return response_output_text(response).strip()
 
 
 def fetch_wanikani_assignments(subject_types, srs_stages):
@@ -149,6 +296,7 @@ def gather_burned_word_lists():
     return burned_words
 
 
+@traced('file')
 def load_cached_burned_words(path=BURNED_WORDS_CSV_PATH):
     words = []
     try:
@@ -167,6 +315,7 @@ def load_cached_burned_words(path=BURNED_WORDS_CSV_PATH):
     return words
 
 
+@traced('file')
 def write_cached_burned_words(words, path=BURNED_WORDS_CSV_PATH):
     tmp_path = f"{path}.tmp"
     directory = os.path.dirname(path)
@@ -177,6 +326,7 @@ def write_cached_burned_words(words, path=BURNED_WORDS_CSV_PATH):
             writer = csv.writer(handle)
             writer.writerow(words)
         os.replace(tmp_path, path)
+        publish_burned_word_index(words, file_stamp(path))
     except Exception:
         app.logger.exception('Failed to update burned words cache.')
         try:
@@ -185,6 +335,45 @@ def write_cached_burned_words(words, path=BURNED_WORDS_CSV_PATH):
             pass
 
 
+def file_stamp(path):
+    """(mtime, size) of a file, or None if it is missing; caches compare it to spot changes on disk."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def publish_burned_word_index(words, stamp=None):
+    """Install a new index snapshot built from `words` (sorted, deduplicated, interned) and return it."""
+    global burned_word_index
+    unique_words = tuple(sys.intern(word) for word in sorted(set(words)))
+    with burned_word_index_lock:
+        burned_word_index = {
+            'version': burned_word_index['version'] + 1,
+            'stamp': stamp,
+            'words': unique_words,
+            'members': frozenset(unique_words),
+        }
+        return burned_word_index
+
+
+def get_burned_word_index(path=BURNED_WORDS_CSV_PATH):
+    """Current burned word snapshot, re-reading the cached CSV only when the file has changed on disk."""
+    stamp = file_stamp(path)
+    index = burned_word_index
+    if stamp is None or stamp == index['stamp']:
+        return index
+    with burned_word_index_lock:
+        index = burned_word_index
+        if stamp == index['stamp']:
+            return index
+        words = load_cached_burned_words(path)
+        if not words and index['words']:
+            return index
+    return publish_burned_word_index(words, stamp)
+
+
 def refresh_burned_words_cache_async():
     def _refresh():
         try:
@@ -194,7 +383,7 @@ def refresh_burned_words_cache_async():
         except Exception:
             app.logger.exception('Background refresh of burned words failed.')
 
-    Thread(target=_refresh, daemon=True).start()
+    start_background_thread(_refresh)
 
 
 def generate_burned_story_text(burned_words, scenario_text):
@@ -202,8 +391,52 @@ def generate_burned_story_text(burned_words, scenario_text):
     if not burned_words:
         raise RuntimeError('No burned vocabulary found in WaniKani data.')
 
-    randomized_words = burned_words[:]
-    random.shuffle(randomized_words)
+    story_words, scenario_words = story_vocabulary.select(burned_words, scenario_text)
+    messages = build_burned_story_messages(story_words, scenario_text, scenario_words)
+    response = create_routed_response(messages, 'burned_story', max_tokens=20000, prompt_cache_key='burned-story')
+    story_text = response_output_text(response)
+    return story_text.strip()
+
+
+class JapaneseStoryVocabulary(StoryVocabulary):
+    """Words are indexed by character and found anywhere in the scenario; a category's markers are kanji."""
+
+    def lexical_keys(self, word):
+        return set(word)
+
+    def scenario_keys(self, scenario, tokens):
+        return set(scenario)
+
+    def mentions_word(self, word, scenario, tokens):
+        return word in scenario
+
+    def in_category(self, word, markers):
+        return any(character in markers for character in word)
+
+    def tokens(self, scenario):
+        return set(re.findall(r"[a-zé']+", scenario))
+
+    def mentions_keyword(self, keyword, scenario, tokens):
+        # English keywords match whole words (or simple plurals); Japanese keywords match anywhere
+        if keyword.isascii():
+            return super().mentions_keyword(keyword, scenario, tokens)
+        return keyword in scenario
+
+
+story_vocabulary = JapaneseStoryVocabulary(VOCABULARY_CATEGORIES)
+
+
+def build_burned_story_messages(burned_words, scenario_text, scenario_words=()):
+    """Build the story prompt with the large stable content first so provider prompt caching can hit.
+
+    Order: fixed system instructions, then the canonical (sorted, de-duplicated) word list, then the
+    per-request scenario words and scenario. Variety comes from a random set of focus words in the final
+    instruction.
+    """
+    canonical_words = sorted(set(burned_words))
+    extra_words = sorted(set(scenario_words) - set(canonical_words))
+    focus_words = random.sample(canonical_words + extra_words,
+                                min(STORY_FOCUS_WORD_COUNT, len(canonical_words) + len(extra_words)))
 
     scenario_text = (scenario_text or '').strip()
     scenario_instruction = (
@@ -213,23 +446,29 @@ def generate_burned_story_text(burned_words, scenario_text):
         else "The learner did not specify a scenario. Craft a supportive, everyday-life story suitable for study."
     )
 
-    user_prompt = f"""
+    system_prompt = """
+You are a helpful language teacher.
 Write an interesting Japanese story tailored to a language learner.
-{scenario_instruction}
 Ensure the narrative clearly follows the scenario details and feels personal to the learner.
 Can use any Proper Nouns including those that are in the Scenario text.
-Write the story primarily using Nouns, Verbs and Adjectives that are in this list: {', '.join(randomized_words)}.
+Write the story primarily using Nouns, Verbs and Adjectives that are in the learner's vocabulary list.
 Keep the story constrained to 3 paragraphs.
 Respond with only the story text.
 """
 
-    messages = [
-        {'role': 'system', 'content': 'You are a helpful language teacher.'},
-        {'role': 'user', 'content': user_prompt.strip()}
-    ]
+    vocabulary_prompt = f"Learner's vocabulary list: {', '.join(canonical_words)}."
 
-    story_text = get_completion_from_messages(messages=messages,model="gpt-5",reasoning_effort="medium", max_tokens=20000)
-    return story_text.strip()
+    extra_prompt = f"More words from the learner's vocabulary list: {', '.join(extra_words)}.\n" if extra_words else ''
+    scenario_prompt = f"""
+{extra_prompt}{scenario_instruction}
+For variety, try to feature these words from the list: {', '.join(focus_words)}.
+"""
+
+    return [
+        {'role': 'system', 'content': system_prompt.strip()},
+        {'role': 'user', 'content': vocabulary_prompt},
+        {'role': 'user', 'content': scenario_prompt.strip()}
+    ]
 
 
 def extract_json_object(text):
@@ -257,12 +496,7 @@ def generate_word_detail_via_model(word):
             "Use hiragana characters (no romaji) and keep the English to a short phrase."
         )}
     ]
-    response_text = get_completion_from_messages(
-        messages,
-        model='gpt-5-nano',
-        max_tokens=200,
-        reasoning_effort='minimal',
-    )
+    response_text = llm.complete(messages, task='word_detail', max_tokens=200)
     if not response_text:
         raise RuntimeError('No output text returned for word detail.')
     data = extract_json_object(response_text.strip())
@@ -330,20 +564,23 @@ def _run_burned_story_job(job_id):
         return
 
     try:
-        cached_words = load_cached_burned_words()
-        if cached_words:
-            job['words'] = cached_words
+        # Jobs hold a reference to the shared snapshot, never a copy of the word list
+        word_index = get_burned_word_index()
+        if word_index['words']:
+            job['word_index'] = word_index
             job['words_status'] = 'done'
             refresh_burned_words_cache_async()
-            words = cached_words
         else:
-            job['words'] = []
             job['words_status'] = 'in_progress'
-            words = gather_burned_word_lists()
-            if words:
-                job['words'] = words
+            gathered = gather_burned_word_lists()
+            if gathered:
+                write_cached_burned_words(gathered)
+                word_index = burned_word_index
+                if not word_index['words']:
+                    word_index = publish_burned_word_index(gathered)
+                job['word_index'] = word_index
                 job['words_status'] = 'done'
-                write_cached_burned_words(words)
+        words = word_index['words']
 
         if not words:
             job['words_status'] = 'error'
@@ -365,10 +602,10 @@ def _run_burned_story_job(job_id):
 
         # Kick off furigana and English translations in background threads
         job['furigana_status'] = 'in_progress'
-        Thread(target=_generate_furigana_for_job, args=(job_id,), daemon=True).start()
+        start_background_thread(_generate_furigana_for_job, (job_id,))
 
         job['english_status'] = 'in_progress'
-        Thread(target=_generate_english_for_job, args=(job_id,), daemon=True).start()
+        start_background_thread(_generate_english_for_job, (job_id,))
     except Exception as exc:
         app.logger.exception('Burned story generation failed.')
         job['status'] = 'error'
@@ -385,7 +622,7 @@ def start_burned_story_job(scenario_text=''):
     burned_story_jobs[job_id] = {
         'status': 'in_progress',
         'words_status': 'in_progress',
-        'words': [],
+        'word_index': EMPTY_BURNED_WORD_INDEX,
         'word_details': {},
         'story_status': 'pending',
         'story': '',
@@ -398,10 +635,155 @@ def start_burned_story_job(scenario_text=''):
         'error': None,
         'scenario': scenario_text,
     }
-    Thread(target=_run_burned_story_job, args=(job_id,), daemon=True).start()
+    start_background_thread(_run_burned_story_job, (job_id,))
     return job_id
 
 
+@traced('file')
+def get_kanji_word_cache(path=KANJI_WORDS_CSV_PATH):
+    """{kanji: (word, hiragana, meaning)}, re-reading the CSV only when the file has changed on disk."""
+    stamp = file_stamp(path)
+    with kanji_word_cache_lock:
+        if stamp == kanji_word_cache['stamp']:
+            return kanji_word_cache['words']
+        words = {}
+        try:
+            with open(path, 'r', encoding='utf-8', newline='') as handle:
+                for row in csv.reader(handle):
+                    if len(row) == 4 and row[0].strip():
+                        words[row[0].strip()] = tuple(row[1:])
+        except FileNotFoundError:
+            pass
+        except Exception:
+            app.logger.exception('Failed to load cached kanji words.')
+        kanji_word_cache.update(stamp=stamp, words=words)
+        return words
+
+
+@traced('file')
+def store_kanji_words(entries, path=KANJI_WORDS_CSV_PATH):
+    """Merge {kanji: (word, hiragana, meaning)} into the cache file, replacing it atomically."""
+    get_kanji_word_cache(path)
+    tmp_path = f"{path}.tmp"
+    directory = os.path.dirname(path)
+    with kanji_word_cache_lock:
+        words = dict(kanji_word_cache['words'])
+        words.update(entries)
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8', newline='') as handle:
+                writer = csv.writer(handle)
+                for kanji, (word, hiragana, meaning) in sorted(words.items()):
+                    writer.writerow([kanji, word, hiragana, meaning])
+            os.replace(tmp_path, path)
+            kanji_word_cache.update(stamp=file_stamp(path), words=words)
+        except Exception:
+            app.logger.exception('Failed to update kanji words cache.')
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+
+
+def upcoming_review_kanji(days):
+    """Kanji of the user's current level that come up for review within the next days days."""
+    user_json_dict = get_response_from_wanikani(url_end="user")
+    if user_json_dict is None:
+        return []
+    user_level = user_json_dict['data']['level']
+    available_before = (datetime.now(timezone.utc) + timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    next_url = f"assignments?levels={user_level}&subject_types=kanji&available_before={available_before}"
+    subject_ids = []
+    while next_url:
+        response_json = get_response_from_wanikani(next_url)
+        if not response_json:
+            break
+        subject_ids.extend(item['data']['subject_id'] for item in response_json.get('data', []))
+        next_url = response_json.get('pages', {}).get('next_url')
+    subjects = fetch_wanikani_subjects(sorted(set(subject_ids)))
+    return [subject['data']['characters'] for subject in subjects if subject.get('data', {}).get('characters')]
+
+
+def pregenerate_kanji_words(kanji_batch):
+    """One structured request for an example word of each kanji in the batch; returns the kanji cached."""
+    messages = [
+        {'role': 'system',
+         'content': """
+            For each kanji, provide 1 simple commonly used word that has this Kanji,
+            the Hiragana reading of this word and the meaning of this word in English.
+            """
+         },
+        {'role': 'user',
+         'content': f"For each of these words (kanji): {', '.join(kanji_batch)}.\n"
+         }
+    ]
+    response = create_routed_response(messages, 'pregenerate', max_tokens=4000, text_format=KANJI_WORDS_FORMAT)
+    entries = {}
+    for item in json.loads(response_output_text(response)).get('items', []):
+        kanji = str(item.get('kanji', '')).strip()
+        word = str(item.get('word', '')).strip()
+        if kanji in kanji_batch and kanji in word and item.get('hiragana') and item.get('meaning'):
+            entries[kanji] = (word, item['hiragana'].strip(), item['meaning'].strip())
+    if entries:
+        store_kanji_words(entries)
+    return list(entries)
+
+
+def load_pregenerate_progress(path, run_key):
+    try:
+        with open(path, encoding='utf-8') as handle:
+            progress = json.load(handle)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return set()
+    return set(progress.get('done', [])) if progress.get('run') == run_key else set()
+
+
+def save_pregenerate_progress(path, run_key, done):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as handle:
+        json.dump({'run': run_key, 'done': sorted(done)}, handle, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+@app.cli.command('pregenerate')
+@click.option('--days', default=7, show_default=True, help='Pre-generate for kanji due for review within this many days.')
+@click.option('--batch-size', default=25, show_default=True, help='Kanji per model request.')
+@click.option('--concurrency', default=3, show_default=True, help='Model requests in flight at once.')
+@click.option('--progress-file', default=PREGENERATE_PROGRESS_PATH, show_default=True)
+@click.option('--restart', is_flag=True, help='Ignore the progress of an earlier, interrupted run.')
+def pregenerate_command(days, batch_size, concurrency, progress_file, restart):
+    """Pre-generate example words for the kanji that come up for review in the next DAYS days.
+
+    Meant to run off-peak, e.g. from cron: 0 4 * * * cd /srv/japanesefriend && flask --app app pregenerate
+    """
+    run_key = f"{datetime.now().date()}:{days}"
+    done = set() if restart else load_pregenerate_progress(progress_file, run_key)
+    cached = get_kanji_word_cache()
+    kanji_list = [kanji for kanji in dict.fromkeys(upcoming_review_kanji(days)) if kanji not in cached and kanji not in done]
+    click.echo(f"{len(kanji_list)} upcoming review kanji need an example word.")
+    batches = [kanji_list[start:start + batch_size] for start in range(0, len(kanji_list), batch_size)]
+
+    cached_total = 0
+    failed_batches = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='pregenerate') as executor:
+        futures = {executor.submit(pregenerate_kanji_words, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                cached_total += len(future.result())
+            except Exception as exc:
+                failed_batches += 1
+                click.echo(f"Batch of {len(batch)} kanji failed: {exc}")
+                continue
+            # Kanji the model skipped or got wrong count as done too, so a rerun does not retry them forever
+            done.update(batch)
+            save_pregenerate_progress(progress_file, run_key, done)
+    click.echo(f"Cached {cached_total} kanji words in {len(batches) - failed_batches}/{len(batches)} batches.")
+    if failed_batches:
+        sys.exit(1)
+
+
 # Get assignments where levels=(1 to current level) and immediately available for review and subject_types=vocubulary
 # This is a recursive function that goes up to Level 60, which is the max user level
 def addVocabsInAscendingOrder(user_level, current_level_position, vocab_ids, max_words, num_levels_per_query):
@@ -456,6 +838,11 @@ def chooseSelectedWords(subject_types="vocabulary", max_words=5):
                     if kanji_subject_json_dict != None:
                         # For each kanji, ask ChatGPT to provide 1 simple comonly used word that has this Kanji, the hiragana reading, the meaning
                         kanji = kanji_subject_json_dict['data']['characters']
+                        cached = get_kanji_word_cache().get(kanji)
+                        increment_counter('kanji_word_cache_lookups_total', outcome='hit' if cached else 'miss')
+                        if cached:
+                            selected_words.append(list(cached))
+                            continue
                         messages = [
                             {'role': 'system',
                              'content': """
@@ -475,7 +862,7 @@ def chooseSelectedWords(subject_types="vocabulary", max_words=5):
                              'content': f"{kanji}"
                              }
                         ]
-                        response = get_completion_from_messages(messages = messages, max_tokens=100)
+                        response = llm.complete(messages, task='kanji_word', max_tokens=100)
                         # print ("Kanji ChatGPT response:" + response)
                         kanji_components = response.split(',')
                         if len(kanji_components) == 3:
@@ -483,6 +870,7 @@ def chooseSelectedWords(subject_types="vocabulary", max_words=5):
                             hiragana = kanji_components[1]
                             meaning = kanji_components[2]
                             selected_words.append([word, hiragana, meaning])
+                            store_kanji_words({kanji: (word, hiragana, meaning)})
 
         elif subject_types == "vocabulary":
             # Get assignments where levels=(1 to current level) and immediately available for review and subject_types=vocubulary
@@ -523,7 +911,7 @@ def create_story(selected_words, max_sentences):
          },
     ]
 
-    response = get_completion_from_messages(messages, model="gpt-5", max_tokens=100)
+    response = llm.complete(messages, task='story', max_tokens=100)
     response = response.strip('"')
     # print("Japanese Story:")
     # print(response)
@@ -537,26 +925,85 @@ def create_story(selected_words, max_sentences):
     return messages, response
 
 
-@app.route('/')
-def index():
+def collect_job_gauges():
+    """Background job, session store, model gateway and startup gauges for /metrics."""
+    job_states = []
+    for job in list(burned_story_jobs.values()):
+        job_states.append(('burned_story', job.get('status')))
+        for stage in ('words', 'story', 'furigana', 'english'):
+            job_states.append((f'burned_story_{stage}', job.get(f'{stage}_status')))
+        for details in list(job.get('word_details', {}).values()):
+            job_states.append(('burned_story_word_detail', details.get('status')))
+    gauges = job_gauges(job_states + conversation_turns.job_states() + conversation.job_states())
+    gauges.update(session_store.gauges())
+    gauges.update(llm.gauges())
+    gauges.update(startup.gauges())
+    return gauges
+
+
+@app.errorhandler(ModelUnavailableError)
+def model_unavailable(error):
+    """Fail fast with 503 while a model's circuit is open so pages can show the message and retry."""
+    if request.is_json or request.accept_mimetypes.best == 'application/json':
+        response = jsonify({'status': 'error', 'error': str(error)})
+    else:
+        response = Response(str(error), mimetype='text/plain')
+    response.status_code = 503
+    response.headers['Retry-After'] = str(int(error.retry_after) + 1)
+    return response
 
-    return render_template('index.html')
 
-def log_datetime():
-    now = datetime.now()
-    with open('datetime_log.txt', 'a') as log_file:
-        log_file.write(now.strftime("%Y-%m-%d %H:%M:%S") + "\n")
+def warm_wanikani_connection():
+    wanikani_session.head(WANIKANI_API_URL, timeout=5)
 
 
-def get_last_run_datetime():
-    try:
-        with open('datetime_log.txt', 'r') as log_file:
-            lines = log_file.readlines()
-            if lines:
-                last_run_datetime = lines[-1].strip()
-                return last_run_datetime
-    except FileNotFoundError:
-        return "No run history available."
+def warm_burned_words():
+    words = get_burned_word_index()['words']
+    if words:
+        story_vocabulary.index(words)
+
+
+def warm_templates():
+    for name in app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html')):
+        app.jinja_env.get_template(name)
+
+
+# Startup (startup.py): after import, a warm-up thread loads local caches and opens pooled connections
+# before /ready answers 200
+startup = Startup(STARTUP_STARTED_AT, 'app.py', [
+    ('templates', warm_templates),
+    ('usage_db', usage_db),
+    ('burned_words', warm_burned_words),
+    ('openai', llm.warm),
+    ('wanikani', warm_wanikani_connection),
+])
+startup.init_app(app)
+
+
+@app.route('/debug/traces')
+@debug_access_required
+def debug_traces():
+    with traces_lock:
+        traces = list(recent_traces)
+    return render_template('debugTraces.html', traces=[trace_waterfall(trace) for trace in reversed(traces)])
+
+
+@app.route('/debug/usage')
+@debug_access_required
+def debug_usage():
+    return jsonify(summarise_usage(request.args.get('days', 30, type=int)))
+
+
+@app.route('/metrics')
+@debug_access_required
+def metrics():
+    return Response(render_metrics(collect_job_gauges()), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/')
+def index():
+
+    return render_template('index.html')
 
 @app.route('/japaneseStory', methods=['POST'])
 def japaneseStory():
@@ -576,7 +1023,7 @@ def japaneseStory():
     session['messages'] = messages
     session['japaneseStory'] = response
 
-    # Get the last run datetime from the log file
+    # Get the last run datetime from the usage store
     last_run_datetime = get_last_run_datetime()
 
     result_data = {
@@ -584,8 +1031,8 @@ def japaneseStory():
         'lastRunDateTime': last_run_datetime
     }
 
-    # Save current run datetime in log file
-    log_datetime()
+    # Save current run in the usage store
+    record_usage_event('story', {'category': request.form.get('category')})
 
     return render_template('japaneseStory.html', result = result_data)
 
@@ -599,6 +1046,7 @@ def burned_story_scenario():
 def burned_story():
     scenario_text = request.form.get('scenarioText', '').strip()
     job_id = start_burned_story_job(scenario_text=scenario_text)
+    record_usage_event('burned_story', {'scenario': bool(scenario_text)})
     return render_template(
         'burnedStory.html',
         job_id=job_id,
@@ -618,7 +1066,7 @@ def burned_story_status(job_id):
     payload = {
         'status': job.get('status', 'in_progress'),
         'words_status': job.get('words_status'),
-        'words': job.get('words', []),
+        'words': job['word_index']['words'],
         'word_details': job.get('word_details', {}),
         'story_status': job.get('story_status'),
         'story': job.get('story', ''),
@@ -644,7 +1092,7 @@ def burned_story_word_detail(job_id):
     if not word:
         return jsonify({'status': 'error', 'error': 'Missing word parameter.'}), 400
 
-    if job.get('words_status') != 'done' or word not in job.get('words', []):
+    if job.get('words_status') != 'done' or word not in job['word_index']['members']:
         return jsonify({'status': 'pending'}), 202
 
     details = job['word_details'].get(word)
@@ -657,13 +1105,13 @@ def burned_story_word_detail(job_id):
             'thread_started': True
         }
         job['word_details'][word] = details
-        Thread(target=_generate_word_detail, args=(job_id, word), daemon=True).start()
+        start_background_thread(_generate_word_detail, (job_id, word))
     else:
         if details.get('status') == 'pending':
             details['status'] = 'in_progress'
         if details.get('status') == 'in_progress' and not details.get('thread_started'):
             details['thread_started'] = True
-            Thread(target=_generate_word_detail, args=(job_id, word), daemon=True).start()
+            start_background_thread(_generate_word_detail, (job_id, word))
 
     response_payload = {
         'status': details.get('status'),
@@ -750,7 +1198,7 @@ def withFuriganaHTMLParagraph(japaneseStory):
          },
     '''
 
-    furiganaVersion = get_completion_from_messages(messages, model="gpt-5", reasoning_effort="medium", max_tokens=20000)
+    furiganaVersion = llm.complete(messages, task='furigana', max_tokens=20000)
     # print(furiganaVersion)
     return furiganaVersion
 
@@ -766,7 +1214,7 @@ def translateToEnglish(japaneseStory):
          }
     ]
 
-    englishVersion = get_completion_from_messages(messages, model="gpt-5-nano")
+    englishVersion = llm.complete(messages, task='translation')
 
     return englishVersion
 
@@ -784,7 +1232,7 @@ def correctSpellingGrammar(japaneseStory):
     ]
     # print("correctSpellingGrammar:")
     # print(messages)
-    correctSpellingGrammarVersion = get_completion_from_messages(messages, model="gpt-5", max_tokens=500)
+    correctSpellingGrammarVersion = llm.complete(messages, task='spell_grammar', max_tokens=500)
     # print(correctSpellingGrammarVersion)
 
     return correctSpellingGrammarVersion
@@ -859,8 +1307,8 @@ def ankiRecord():
 
 @app.route('/japaneseConversation', methods=['POST'])
 def japaneseConversation():
-    # Save current run datetime in log file
-    log_datetime()
+    # Save current run in the usage store
+    record_usage_event('conversation')
     return render_template('japaneseConversation.html')
 
 @app.route('/japaneseScenario', methods=['POST'])
@@ -872,34 +1320,44 @@ def japaneseScenario():
     scenarioText = scenarioText + ". You will always respond in simple Japanese that a child can understand."
 
     # Start a CharGPT conversation with the scenarioText as the system message
-    conversationMessages = [
-        {'role': 'system',
-         'content': scenarioText
-         }
-    ]
-
-    session['conversationMessages'] = conversationMessages
+    conversation.begin(scenarioText)
 
     return render_template('iSay.html', result=result_data)
 
+def start_conversation_turn_precompute(iSayText, youSayText):
+    """Start translation, furigana and correction for a turn as soon as its reply is known."""
+    return conversation_turns.start({
+        'english': lambda: translateToEnglish(youSayText),
+        'furigana': lambda: withFuriganaHTMLParagraph(youSayText),
+        'spell_grammar': lambda: withFuriganaHTMLParagraph(correctSpellingGrammar(iSayText)),
+    })
+
+
+def get_conversation_turn_result(name, fallback):
+    """Return the precomputed (or in-flight) artefact for the current turn, computing inline if absent."""
+    return conversation_turns.result(session.get('conversationTurnId'), name, fallback)
+
 @app.route('/iSayDynamic', methods=['POST'])
 def iSayDynamic():
     session['iSayText'] = request.form['iSayText']
     iSayText = request.form['iSayText']
     conversationMessages = session['conversationMessages']
+    conversationId = conversation.current_id()
     conversationMessages.append(
         {'role': 'user',
          'content': iSayText
          }
     )
-    youSayText = get_completion_from_messages(conversationMessages, max_tokens=100)
+    response = conversation.respond(conversationId, conversationMessages, max_tokens=100, feature='conversation')
+    youSayText = response_output_text(response)
     session['youSayText'] = youSayText
     conversationMessages.append(
         {'role': 'assistant',
          'content': youSayText
          }
     )
-    session['conversationMessages'] = conversationMessages
+    session['conversationMessages'] = conversation.window(conversationId, conversationMessages)
+    session['conversationTurnId'] = start_conversation_turn_precompute(iSayText, youSayText)
 
     result_data = {
         'youSayText': youSayText,
@@ -911,19 +1369,21 @@ def iSayDynamic():
 @app.route('/conversationEnglishTranslation')
 def conversationEnglishTranslation():
     youSayText = session['youSayText']
-    youSayTextEnglish = translateToEnglish(youSayText)
+    youSayTextEnglish = get_conversation_turn_result('english', lambda: translateToEnglish(youSayText))
     return youSayTextEnglish
 
 @app.route('/conversationSpellGrammarCheck')
 def conversationSpellGrammarCheck():
     iSayText = session['iSayText']
-    iSayTextReviewed = withFuriganaHTMLParagraph(correctSpellingGrammar(iSayText))
+    iSayTextReviewed = get_conversation_turn_result(
+        'spell_grammar', lambda: withFuriganaHTMLParagraph(correctSpellingGrammar(iSayText))
+    )
     return iSayTextReviewed
 
 @app.route('/conversationFuriganaResponse')
 def conversationFuriganaResponse():
     youSayText = session['youSayText']
-    youSayTextFurigana = withFuriganaHTMLParagraph(youSayText)
+    youSayTextFurigana = get_conversation_turn_result('furigana', lambda: withFuriganaHTMLParagraph(youSayText))
     return youSayTextFurigana
 
 @app.route('/iSay', methods=['POST'])
@@ -932,6 +1392,7 @@ def iSay():
 
     iSayText = request.form['iSayText']
     conversationMessages = session['conversationMessages']
+    conversationId = conversation.current_id()
     # print(conversationMessages)
 
     correctedText = correctSpellingGrammar(iSayText)
@@ -942,7 +1403,8 @@ def iSay():
          }
     )
 
-    youSayText = get_completion_from_messages(conversationMessages, max_tokens=100)
+    response = conversation.respond(conversationId, conversationMessages, max_tokens=100, feature='conversation')
+    youSayText = response_output_text(response)
     youSayTextFuriganaHTML = withFuriganaHTMLParagraph(youSayText)
 
     youSayTextEnglish = translateToEnglish(youSayText)
@@ -960,7 +1422,7 @@ def iSay():
          'content': youSayText
          }
     )
-    session['conversationMessages'] = conversationMessages
+    session['conversationMessages'] = conversation.window(conversationId, conversationMessages)
 
     return render_template('youSay.html', result=result_data)
 
@@ -969,4 +1431,5 @@ def youSay():
     return render_template('iSay.html')
 
 if __name__ == '__main__':
+    startup.begin()
     app.run(debug=False, port=5001)
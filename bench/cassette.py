@@ -0,0 +1,273 @@
+"""Record and replay OpenAI and WaniKani traffic through a local proxy.
+
+Point the apps at the proxy instead of the real services:
+
+    OPENAI_BASE_URL=http://127.0.0.1:8803/openai/v1
+    WANIKANI_API_URL=http://127.0.0.1:8803/wanikani/v2/
+
+In record mode every request is forwarded upstream with the caller's credentials and the
+exchange is appended to a JSON-lines cassette: request body, status, response body (or the
+streamed chunks with their offsets), time to first byte and total time. Credentials are
+never written. In replay mode the cassette is served without network access: an exact
+request match is preferred, otherwise a request of the same shape (same endpoint, model,
+effort and system prompt), so prompts containing random word choices still replay.
+Responses are delayed by their recorded timings multiplied by --speed (0 serves instantly).
+
+    python -m bench.cassette record traffic.jsonl --port 8803
+    python -m bench.cassette replay traffic.jsonl --port 8803 --speed 1
+"""
+import argparse
+import codecs
+import hashlib
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+
+UPSTREAMS = {
+    'openai': 'https://api.openai.com',
+    'wanikani': 'https://api.wanikani.com',
+}
+# Request headers passed through to the upstream service when recording
+FORWARDED_HEADERS = ('Authorization', 'Content-Type', 'Accept', 'Wanikani-Revision', 'OpenAI-Beta',
+                     'OpenAI-Organization', 'OpenAI-Project')
+# Response headers kept in the cassette and sent back on replay
+RECORDED_HEADERS = ('Content-Type', 'RateLimit-Limit', 'RateLimit-Remaining', 'RateLimit-Reset', 'Retry-After',
+                    'x-request-id', 'openai-processing-ms')
+
+
+def exact_key(service, method, path, body):
+    return hashlib.sha256(json.dumps([service, method, path, body], sort_keys=True, ensure_ascii=False)
+                          .encode('utf-8')).hexdigest()
+
+
+def shape_key(service, method, path, body):
+    """Looser match: endpoint plus, for model calls, model, effort, streaming and the system prompt."""
+    if service == 'wanikani':
+        return json.dumps([service, method, urlsplit(path).path.rstrip('/').split('/')[:3]])
+    body = body if isinstance(body, dict) else {}
+    input_value = body.get('input')
+    system = ''
+    if isinstance(input_value, list):
+        system = next((str(item.get('content')) for item in input_value
+                       if isinstance(item, dict) and item.get('role') in ('system', 'developer')), '')
+    return json.dumps([service, method, urlsplit(path).path, body.get('model'),
+                       (body.get('reasoning') or {}).get('effort'), bool(body.get('stream')),
+                       hashlib.sha256(system.encode('utf-8')).hexdigest()])
+
+
+class Cassette:
+    """Appends exchanges when recording; indexes them by exact and shape key when replaying."""
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.exact = {}
+        self.shapes = {}
+        self.stats = {'requests': 0, 'exact_hits': 0, 'shape_hits': 0, 'misses': 0}
+        if mode == 'replay':
+            with open(path, encoding='utf-8') as handle:
+                for line in handle:
+                    if line.strip():
+                        self._index(json.loads(line))
+            self.exact = {key: itertools.cycle(entries) for key, entries in self.exact.items()}
+            self.shapes = {key: itertools.cycle(entries) for key, entries in self.shapes.items()}
+
+    def _index(self, entry):
+        request = entry['request']
+        args = (request['service'], request['method'], request['path'], request['body'])
+        self.exact.setdefault(exact_key(*args), []).append(entry)
+        self.shapes.setdefault(shape_key(*args), []).append(entry)
+
+    def append(self, entry):
+        with self.lock, open(self.path, 'a', encoding='utf-8') as handle:
+            handle.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def lookup(self, service, method, path, body):
+        """Next recorded exchange for this request; identical requests cycle through their recordings."""
+        args = (service, method, path, body)
+        with self.lock:
+            self.stats['requests'] += 1
+            entries = self.exact.get(exact_key(*args))
+            if entries is not None:
+                self.stats['exact_hits'] += 1
+                return next(entries)
+            entries = self.shapes.get(shape_key(*args))
+            if entries is not None:
+                self.stats['shape_hits'] += 1
+                return next(entries)
+            self.stats['misses'] += 1
+            return None
+
+
+class CassetteHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    cassette = None
+    speed = 1.0
+    upstreams = UPSTREAMS
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_DELETE(self):
+        self._handle()
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if not raw:
+            return None, raw
+        try:
+            return json.loads(raw), raw
+        except ValueError:
+            return raw.decode('utf-8', 'replace'), raw
+
+    def _handle(self):
+        service, _, rest = self.path.lstrip('/').partition('/')
+        path = '/' + rest
+        if service not in self.upstreams:
+            service = None
+        body, raw = self._read_body()
+        if service is None:
+            self._send(404, {'Content-Type': 'application/json'},
+                       json.dumps({'error': f"Unknown service prefix in {self.path}"}).encode('utf-8'))
+            return
+        if self.cassette.mode == 'record':
+            self._record(service, path, body, raw)
+        else:
+            self._replay(service, path, body)
+
+    def _send(self, status, headers, data):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _local_urls(self, service, text):
+        """Point absolute upstream URLs (e.g. WaniKani pages.next_url) back at this proxy."""
+        return text.replace(self.upstreams[service], f"http://{self.headers.get('Host')}/{service}")
+
+    def _record(self, service, path, body, raw):
+        headers = {name: self.headers[name] for name in FORWARDED_HEADERS if self.headers.get(name)}
+        headers['Accept-Encoding'] = 'identity'
+        start = time.perf_counter()
+        upstream = requests.request(self.command, self.upstreams[service] + path, headers=headers, data=raw or None,
+                                    stream=True, timeout=600)
+        response_headers = {name: upstream.headers[name] for name in RECORDED_HEADERS if upstream.headers.get(name)}
+        streamed = 'text/event-stream' in upstream.headers.get('Content-Type', '')
+        chunks = []
+        raw_chunks = []
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        first_byte = None
+        if streamed:
+            self.send_response(upstream.status_code)
+            for name, value in response_headers.items():
+                self.send_header(name, value)
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+        for chunk in upstream.iter_content(chunk_size=None):
+            offset = time.perf_counter() - start
+            first_byte = offset if first_byte is None else first_byte
+            chunks.append([round(offset, 4), decoder.decode(chunk)])
+            raw_chunks.append(chunk)
+            if streamed:
+                self.wfile.write(self._local_urls(service, chunks[-1][1]).encode('utf-8'))
+                self.wfile.flush()
+        total = time.perf_counter() - start
+        if not streamed:
+            body_text = b''.join(raw_chunks).decode('utf-8', 'replace')
+            self._send(upstream.status_code, response_headers, self._local_urls(service, body_text).encode('utf-8'))
+        self.cassette.append({
+            'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'request': {'service': service, 'method': self.command, 'path': path, 'body': body},
+            'response': {
+                'status': upstream.status_code,
+                'headers': response_headers,
+                'streamed': streamed,
+                'body': None if streamed else body_text,
+                'chunks': chunks if streamed else None,
+            },
+            'timing': {'ttfb_seconds': round(first_byte or total, 4), 'total_seconds': round(total, 4)},
+        })
+
+    def _replay(self, service, path, body):
+        entry = self.cassette.lookup(service, self.command, path, body)
+        if entry is None:
+            self._send(404, {'Content-Type': 'application/json'}, json.dumps({'error': {
+                'message': f"No recording for {self.command} {service}{path}", 'type': 'cassette_miss'}}).encode('utf-8'))
+            return
+        response = entry['response']
+        start = time.perf_counter()
+        if not response['streamed']:
+            time.sleep(entry['timing']['total_seconds'] * self.speed)
+            self._send(response['status'], response['headers'],
+                       self._local_urls(service, response['body']).encode('utf-8'))
+            return
+        self.send_response(response['status'])
+        for name, value in response['headers'].items():
+            self.send_header(name, value)
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        for offset, chunk in response['chunks']:
+            delay = offset * self.speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+            self.wfile.write(self._local_urls(service, chunk).encode('utf-8'))
+            self.wfile.flush()
+
+
+def start_cassette_proxy(cassette_path, mode, port=0, speed=1.0, upstreams=None):
+    """Start the proxy on a background thread; returns (server, openai_base_url, wanikani_base_url)."""
+    handler = type('ConfiguredCassetteHandler', (CassetteHandler,), {
+        'cassette': Cassette(cassette_path, mode),
+        'speed': speed,
+        'upstreams': dict(UPSTREAMS, **(upstreams or {})),
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    return server, f"{base}/openai/v1", f"{base}/wanikani/v2/"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('cassette')
+    parser.add_argument('--port', type=int, default=8803)
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay delay multiplier: 1 reproduces recorded timings, 0 serves instantly.')
+    parser.add_argument('--openai-upstream', default=UPSTREAMS['openai'], help='Origin recorded for /openai/...')
+    parser.add_argument('--wanikani-upstream', default=UPSTREAMS['wanikani'], help='Origin recorded for /wanikani/...')
+    args = parser.parse_args()
+    upstreams = {'openai': args.openai_upstream.rstrip('/'), 'wanikani': args.wanikani_upstream.rstrip('/')}
+    server, openai_url, wanikani_url = start_cassette_proxy(args.cassette, args.mode, args.port, args.speed, upstreams)
+    print(f"{args.mode.capitalize()}ing {args.cassette}")
+    print(f"  OPENAI_BASE_URL={openai_url}")
+    print(f"  WANIKANI_API_URL={wanikani_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        stats = server.RequestHandlerClass.cassette.stats
+        if args.mode == 'replay':
+            print(', '.join(f"{name}={value}" for name, value in stats.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+"""Local stand-in for the OpenAI Responses API used by the benchmark harness.
+
+Serves POST /v1/responses (plain JSON or server-sent events when "stream" is true) with a
+configurable latency model: a per-effort base delay, a prefill rate for input tokens and a
+per-model output token rate. Responses are deterministic for a given request so that runs
+can be compared; a simple prefix cache reports usage.input_tokens_details.cached_tokens.
+
+    python -m bench.fake_openai --port 8801 --latency-scale 0.1
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CONFIG = {
+    # Seconds before the first token for each reasoning effort (reasoning time)
+    'effort_latency': {'minimal': 0.3, 'low': 1.0, 'medium': 4.0, 'high': 10.0},
+    # Output tokens per second for each model
+    'output_tokens_per_second': {'gpt-5': 50.0, 'gpt-5-mini': 90.0, 'gpt-5-nano': 160.0},
+    'default_output_tokens_per_second': 80.0,
+    # Input tokens processed per second before the first token (uncached input only)
+    'prefill_tokens_per_second': 20000.0,
+    # Multiplier applied to every delay; 0 disables sleeping entirely
+    'latency_scale': 1.0,
+    # Output length when the prompt does not determine it
+    'default_output_tokens': 120,
+    # Chunk size (tokens) of streamed output_text deltas
+    'stream_chunk_tokens': 4,
+    # Prefix cache granularity in characters of serialized input
+    'cache_block_chars': 512,
+}
+
+SAMPLE_JAPANESE = "今日は友達と駅の近くの店で新しい本を買いました。"
+SAMPLE_GERMAN = "Heute trinke ich mit meinem Freund einen Kaffee im Café."
+
+
+def estimate_tokens(text):
+    # Roughly 4 characters per token for Latin text and 1 per character for Japanese
+    text = text or ''
+    wide = sum(1 for character in text if ord(character) > 0x2E80)
+    return max(1, wide + (len(text) - wide) // 4)
+
+
+def flatten_input(input_value):
+    if isinstance(input_value, str):
+        return input_value
+    parts = []
+    for item in input_value or []:
+        content = item.get('content', '') if isinstance(item, dict) else item
+        if isinstance(content, list):
+            content = ' '.join(str(part.get('text', '')) if isinstance(part, dict) else str(part) for part in content)
+        parts.append(f"{item.get('role', '') if isinstance(item, dict) else ''}: {content}")
+    return '\n'.join(parts)
+
+
+def last_user_text(input_value):
+    if isinstance(input_value, str):
+        return input_value
+    for item in reversed(input_value or []):
+        if isinstance(item, dict) and item.get('role') == 'user':
+            return str(item.get('content', ''))
+    return ''
+
+
+def example_for_schema(schema, words, path=()):
+    """Produce a value matching a JSON schema; arrays of objects get one entry per prompt word."""
+    schema_type = schema.get('type')
+    if schema_type == 'object':
+        value = {}
+        for name, child in schema.get('properties', {}).items():
+            value[name] = example_for_schema(child, words, path + (name,))
+        return value
+    if schema_type == 'array':
+        item_schema = schema.get('items', {})
+        count = len(words) if words else 3
+        items = []
+        for position in range(count):
+            item = example_for_schema(item_schema, words, path + (position,))
+            if isinstance(item, dict) and words:
+                for key in item:
+                    if key in ('word', 'wort', 'kanji'):
+                        item[key] = words[position]
+                    elif key == 'sentence':
+                        item[key] = f"{item[key]} ({words[position]})"
+            items.append(item)
+        return items
+    if schema_type in ('integer', 'number'):
+        return 1
+    if schema_type == 'boolean':
+        return True
+    name = path[-1] if path else ''
+    if 'translation' in str(name) or 'english' in str(name):
+        return "Today I drink a coffee with my friend."
+    if 'sentence' in str(name):
+        return SAMPLE_GERMAN
+    return f"{name or 'value'}"
+
+
+def prompt_words(prompt):
+    match = re.search(r"(?:these words|diese Wörter)[^:]*:\s*(.+?)(?:\.\s*\n|\n)", prompt)
+    if not match:
+        return []
+    return [word.strip() for word in match.group(1).split(',') if word.strip()]
+
+
+def generate_text(body, config):
+    """Deterministic output text shaped like what each app call site expects."""
+    prompt = last_user_text(body.get('input'))
+    full_prompt = flatten_input(body.get('input'))
+    text_format = (body.get('text') or {}).get('format') or {}
+    if text_format.get('type') == 'json_schema':
+        return json.dumps(example_for_schema(text_format.get('schema', {}), prompt_words(full_prompt)), ensure_ascii=False)
+    if "'hiragana' and 'english'" in prompt:
+        return json.dumps({'hiragana': 'ともだち', 'english': 'friend'}, ensure_ascii=False)
+    if 'pure JSON' in full_prompt:
+        words = prompt_words(full_prompt)
+        return json.dumps({word: f"{SAMPLE_GERMAN} ({word})" for word in words}, ensure_ascii=False)
+    if 'comma separated format' in full_prompt:
+        return "友達,ともだち,Friend"
+    if 'One Word English translation' in full_prompt or 'single English word' in full_prompt:
+        return "Friend"
+    sample = SAMPLE_JAPANESE if ('Japanese' in full_prompt or re.search(r'[぀-ヿ]', prompt)) else SAMPLE_GERMAN
+    target_tokens = min(body.get('max_output_tokens') or config['default_output_tokens'], config['default_output_tokens'])
+    repeats = max(1, target_tokens // estimate_tokens(sample))
+    return (sample * repeats).strip()
+
+
+class FakeOpenAIState:
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.response_ids = set()
+        self.cached_prefixes = set()
+        self.request_count = 0
+
+    def cached_tokens(self, serialized_input):
+        """Longest previously seen block-aligned prefix, in tokens; records this input's prefixes."""
+        block = self.config['cache_block_chars']
+        cached_chars = 0
+        hashes = []
+        for end in range(block, len(serialized_input) + 1, block):
+            digest = hashlib.sha1(serialized_input[:end].encode('utf-8')).hexdigest()
+            hashes.append(digest)
+        with self.lock:
+            for position, digest in enumerate(hashes):
+                if digest not in self.cached_prefixes:
+                    break
+                cached_chars = (position + 1) * block
+            self.cached_prefixes.update(hashes)
+        return estimate_tokens(serialized_input[:cached_chars]) if cached_chars else 0
+
+
+def build_response(body, response_id, text, usage):
+    message_id = f"msg_{response_id[5:]}"
+    return {
+        'id': response_id,
+        'object': 'response',
+        'created_at': int(time.time()),
+        'status': 'completed',
+        'model': body.get('model'),
+        'previous_response_id': body.get('previous_response_id'),
+        'output': [{
+            'type': 'message',
+            'id': message_id,
+            'status': 'completed',
+            'role': 'assistant',
+            'content': [{'type': 'output_text', 'text': text, 'annotations': []}],
+        }],
+        'parallel_tool_calls': True,
+        'tool_choice': 'auto',
+        'tools': [],
+        'usage': usage,
+    }
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        # The apps list models during warm-up to open a pooled connection
+        if self.path.rstrip('/').endswith('/models'):
+            models = sorted(self.state.config['output_tokens_per_second'])
+            self._send_json(200, {'object': 'list', 'data': [
+                {'id': model, 'object': 'model', 'created': 0, 'owned_by': 'bench'} for model in models]})
+            return
+        self._send_json(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/responses'):
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        state = self.state
+        config = state.config
+
+        previous_id = body.get('previous_response_id')
+        with state.lock:
+            state.request_count += 1
+            known_previous = previous_id in state.response_ids
+        if previous_id and not known_previous:
+            self._send_json(404, {'error': {
+                'message': f"Previous response with id '{previous_id}' not found.",
+                'type': 'invalid_request_error',
+                'code': 'previous_response_not_found',
+            }})
+            return
+
+        serialized_input = json.dumps(body.get('input'), ensure_ascii=False, sort_keys=True)
+        input_tokens = estimate_tokens(serialized_input)
+        cached_tokens = min(state.cached_tokens(serialized_input), input_tokens)
+        text = generate_text(body, config)
+        output_tokens = estimate_tokens(text)
+        effort = (body.get('reasoning') or {}).get('effort') or 'medium'
+        output_rate = config['output_tokens_per_second'].get(body.get('model'), config['default_output_tokens_per_second'])
+        scale = config['latency_scale']
+        first_token_delay = (config['effort_latency'].get(effort, 1.0)
+                             + (input_tokens - cached_tokens) / config['prefill_tokens_per_second']) * scale
+        usage = {
+            'input_tokens': input_tokens,
+            'input_tokens_details': {'cached_tokens': cached_tokens},
+            'output_tokens': output_tokens,
+            'output_tokens_details': {'reasoning_tokens': 0},
+            'total_tokens': input_tokens + output_tokens,
+        }
+        response_id = f"resp_{uuid.uuid4().hex}"
+        with state.lock:
+            state.response_ids.add(response_id)
+        response = build_response(body, response_id, text, usage)
+
+        if not body.get('stream'):
+            time.sleep(first_token_delay + output_tokens / output_rate * scale)
+            self._send_json(200, response)
+            return
+        self._stream(response, text, first_token_delay, output_rate * (1 / scale if scale else 0), config)
+
+    def _stream(self, response, text, first_token_delay, output_rate, config):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        sequence = 0
+
+        def emit(event):
+            nonlocal sequence
+            event['sequence_number'] = sequence
+            sequence += 1
+            payload = json.dumps(event, ensure_ascii=False)
+            self.wfile.write(f"event: {event['type']}\ndata: {payload}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        in_progress = dict(response, status='in_progress', output=[], usage=None)
+        emit({'type': 'response.created', 'response': in_progress})
+        time.sleep(first_token_delay)
+        item_id = response['output'][0]['id']
+        emit({'type': 'response.output_item.added', 'output_index': 0,
+              'item': {'type': 'message', 'id': item_id, 'status': 'in_progress', 'role': 'assistant', 'content': []}})
+        chunk_chars = max(1, config['stream_chunk_tokens'] * 3)
+        for start in range(0, len(text), chunk_chars):
+            delta = text[start:start + chunk_chars]
+            if output_rate:
+                time.sleep(estimate_tokens(delta) / output_rate)
+            emit({'type': 'response.output_text.delta', 'item_id': item_id, 'output_index': 0,
+                  'content_index': 0, 'delta': delta, 'logprobs': []})
+        emit({'type': 'response.output_text.done', 'item_id': item_id, 'output_index': 0,
+              'content_index': 0, 'text': text, 'logprobs': []})
+        emit({'type': 'response.completed', 'response': response})
+
+
+def start_fake_openai(port=0, **overrides):
+    """Start the fake server on a background thread; returns (server, base_url)."""
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    for key, value in overrides.items():
+        if isinstance(config.get(key), dict) and isinstance(value, dict):
+            config[key].update(value)
+        else:
+            config[key] = value
+    handler = type('ConfiguredFakeOpenAIHandler', (FakeOpenAIHandler,), {'state': FakeOpenAIState(config)})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8801)
+    parser.add_argument('--latency-scale', type=float, default=DEFAULT_CONFIG['latency_scale'])
+    args = parser.parse_args()
+    server, base_url = start_fake_openai(args.port, latency_scale=args.latency_scale)
+    print(f"Fake Responses API listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
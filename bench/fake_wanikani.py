@@ -0,0 +1,293 @@
+"""Local stand-in for the WaniKani v2 API used by the benchmark harness.
+
+Serves /v2/user, /v2/assignments and /v2/subjects for synthetic users at levels 1-60. The
+bearer token selects the user: "level-12" is a level 12 user (any other token is level 10).
+Subjects and assignments are generated deterministically from the level, collections are
+paginated like the real API (pages.next_url, 500 assignments or 1000 subjects per page) and
+each token is rate limited (60 requests per minute by default, 429 with RateLimit-Reset).
+
+    python -m bench.fake_wanikani --port 8802 --rate-limit 60
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+MAX_LEVEL = 60
+KANJI_PER_LEVEL = 30
+VOCABULARY_PER_LEVEL = 90
+ASSIGNMENTS_PER_PAGE = 500
+SUBJECTS_PER_PAGE = 1000
+DEFAULT_LEVEL = 10
+
+KANJI_POOL = (
+    "一二三四五六七八九十人口日月火水木金土山川田上下中大小本学生先年時分今何行来見話語書読聞食飲買"
+    "出入休立言名気天雨電車駅店家社会員友母父子女男前後左右外東西南北白赤青高安新古長多少早朝昼夜"
+    "週曜毎半国外語英文字町村市県都道府区花草林森石糸虫貝犬牛馬鳥魚肉米茶飯春夏秋冬朝晩今昨明病医"
+)
+HIRAGANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわん"
+SUBJECT_TYPES = ('radical', 'kanji', 'vocabulary', 'kana_vocabulary')
+
+
+def subject_id_for(level, subject_type, position):
+    type_offset = {'kanji': 0, 'vocabulary': 1000, 'kana_vocabulary': 2000, 'radical': 3000}[subject_type]
+    return level * 10000 + type_offset + position + 1
+
+
+def build_subject(subject_id):
+    """Deterministic subject record for an id produced by subject_id_for, or None."""
+    level, remainder = divmod(subject_id - 1, 10000)
+    if not 1 <= level <= MAX_LEVEL:
+        return None
+    type_offset, position = divmod(remainder, 1000)
+    subject_type = {0: 'kanji', 1: 'vocabulary', 2: 'kana_vocabulary', 3: 'radical'}.get(type_offset)
+    limit = KANJI_PER_LEVEL if subject_type in ('kanji', 'radical') else VOCABULARY_PER_LEVEL
+    if subject_type is None or position >= limit:
+        return None
+    rng = random.Random(subject_id)
+    if subject_type in ('kanji', 'radical'):
+        characters = KANJI_POOL[(level * KANJI_PER_LEVEL + position) % len(KANJI_POOL)]
+    elif subject_type == 'vocabulary':
+        characters = ''.join(rng.choice(KANJI_POOL) for _ in range(rng.randint(1, 3)))
+    else:
+        characters = ''.join(rng.choice(HIRAGANA) for _ in range(rng.randint(2, 4)))
+    reading = ''.join(rng.choice(HIRAGANA) for _ in range(rng.randint(2, 5)))
+    return {
+        'id': subject_id,
+        'object': subject_type,
+        'url': f"/v2/subjects/{subject_id}",
+        'data_updated_at': '2024-01-01T00:00:00.000000Z',
+        'data': {
+            'level': level,
+            'slug': characters,
+            'characters': characters,
+            'meanings': [{'meaning': f"{subject_type} {level}-{position + 1}", 'primary': True, 'accepted_answer': True}],
+            'readings': [] if subject_type in ('radical', 'kana_vocabulary')
+            else [{'reading': reading, 'primary': True, 'accepted_answer': True}],
+            'lesson_position': position,
+        },
+    }
+
+
+def build_assignments(user_level):
+    """All assignments of a user, ordered by id; lower levels are further along the SRS."""
+    assignments = []
+    now = datetime.now(timezone.utc)
+    for level in range(1, user_level + 1):
+        for subject_type in SUBJECT_TYPES:
+            count = KANJI_PER_LEVEL if subject_type in ('kanji', 'radical') else VOCABULARY_PER_LEVEL
+            if subject_type == 'kana_vocabulary':
+                count //= 6
+            for position in range(count):
+                subject_id = subject_id_for(level, subject_type, position)
+                rng = random.Random(subject_id * 7 + user_level)
+                levels_behind = user_level - level
+                if levels_behind >= 8:
+                    srs_stage = 9 if rng.random() < 0.85 else 8
+                elif levels_behind >= 3:
+                    srs_stage = rng.randint(5, 9)
+                else:
+                    srs_stage = rng.randint(1, 6)
+                available_at = None if srs_stage == 9 else now + timedelta(hours=rng.randint(-48, 24 * 30))
+                assignments.append({
+                    'id': subject_id + 500000,
+                    'object': 'assignment',
+                    'data': {
+                        'subject_id': subject_id,
+                        'subject_type': subject_type,
+                        'level': level,
+                        'srs_stage': srs_stage,
+                        'available_at': available_at.strftime('%Y-%m-%dT%H:%M:%S.000000Z') if available_at else None,
+                        'burned_at': '2023-06-01T00:00:00.000000Z' if srs_stage == 9 else None,
+                        'hidden': False,
+                    },
+                    '_available_at': available_at,
+                })
+    return assignments
+
+
+class FakeWaniKaniState:
+    def __init__(self, rate_limit, latency):
+        self.rate_limit = rate_limit
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.request_times = {}
+        self.assignments = {}
+        self.request_count = 0
+        self.rate_limited_count = 0
+
+    def user_level(self, token):
+        match = re.fullmatch(r'level-(\d+)', token or '')
+        level = int(match.group(1)) if match else DEFAULT_LEVEL
+        return min(max(level, 1), MAX_LEVEL)
+
+    def assignments_for(self, level):
+        with self.lock:
+            if level not in self.assignments:
+                self.assignments[level] = build_assignments(level)
+            return self.assignments[level]
+
+    def take_rate_limit_slot(self, token):
+        """Sliding one-minute window per token; returns seconds until reset when exhausted."""
+        now = time.time()
+        with self.lock:
+            self.request_count += 1
+            if not self.rate_limit:
+                return 0
+            window = self.request_times.setdefault(token, deque())
+            while window and window[0] <= now - 60:
+                window.popleft()
+            if len(window) >= self.rate_limit:
+                self.rate_limited_count += 1
+                return window[0] + 60 - now
+            window.append(now)
+            return 0
+
+
+class FakeWaniKaniHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _collection(self, url, items, per_page, query):
+        page_after_id = int(query.get('page_after_id', ['0'])[0] or 0)
+        remaining = [item for item in items if item['id'] > page_after_id]
+        page = remaining[:per_page]
+        next_url = None
+        if len(remaining) > per_page:
+            next_query = {name: values[0] for name, values in query.items() if name != 'page_after_id'}
+            next_query['page_after_id'] = page[-1]['id']
+            next_url = f"{self._base_url()}{url}?{urlencode(next_query)}"
+        return {
+            'object': 'collection',
+            'url': f"{self._base_url()}{url}",
+            'pages': {'per_page': per_page, 'next_url': next_url, 'previous_url': None},
+            'total_count': len(items),
+            'data_updated_at': '2024-01-01T00:00:00.000000Z',
+            'data': [{key: value for key, value in item.items() if not key.startswith('_')} for item in page],
+        }
+
+    def _base_url(self):
+        host = self.headers.get('Host') or f"127.0.0.1:{self.server.server_address[1]}"
+        return f"http://{host}"
+
+    def do_GET(self):
+        state = self.state
+        token = (self.headers.get('Authorization') or '').removeprefix('Bearer ').strip()
+        retry_after = state.take_rate_limit_slot(token)
+        if retry_after:
+            reset = int(time.time() + retry_after) + 1
+            self._send_json(429, {'error': 'Rate limit exceeded', 'code': 429},
+                            {'RateLimit-Limit': str(state.rate_limit), 'RateLimit-Remaining': '0',
+                             'RateLimit-Reset': str(reset), 'Retry-After': str(int(retry_after) + 1)})
+            return
+        if state.latency:
+            time.sleep(state.latency)
+
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query, keep_blank_values=True)
+        path = parts.path.rstrip('/')
+        level = state.user_level(token)
+
+        if path == '/v2/user':
+            self._send_json(200, {'object': 'user', 'url': f"{self._base_url()}/v2/user", 'data': {
+                'id': f"user-{level}", 'username': f"bench_level_{level}", 'level': level,
+                'subscription': {'active': True, 'type': 'recurring', 'max_level_granted': MAX_LEVEL},
+                'started_at': '2022-01-01T00:00:00.000000Z',
+            }})
+        elif path == '/v2/assignments':
+            self._send_json(200, self._collection('/v2/assignments', self._filter_assignments(level, query),
+                                                  ASSIGNMENTS_PER_PAGE, query))
+        elif path == '/v2/subjects':
+            if 'ids' in query:
+                ids = [int(value) for value in query['ids'][0].split(',') if value.strip().isdigit()]
+            else:
+                levels = self._int_list(query, 'levels') or range(1, MAX_LEVEL + 1)
+                ids = [subject_id_for(subject_level, subject_type, position)
+                       for subject_level in levels for subject_type in SUBJECT_TYPES
+                       for position in range(VOCABULARY_PER_LEVEL)]
+            types = self._str_list(query, 'types')
+            subjects = [subject for subject in map(build_subject, sorted(set(ids)))
+                        if subject and (not types or subject['object'] in types)]
+            self._send_json(200, self._collection('/v2/subjects', subjects, SUBJECTS_PER_PAGE, query))
+        elif path.startswith('/v2/subjects/') and path.rsplit('/', 1)[-1].isdigit():
+            subject = build_subject(int(path.rsplit('/', 1)[-1]))
+            if subject:
+                self._send_json(200, subject)
+            else:
+                self._send_json(404, {'error': 'Not found', 'code': 404})
+        else:
+            self._send_json(404, {'error': 'Not found', 'code': 404})
+
+    @staticmethod
+    def _int_list(query, name):
+        return [int(value) for value in ','.join(query.get(name, [])).split(',') if value.strip().isdigit()]
+
+    @staticmethod
+    def _str_list(query, name):
+        return {value for value in ','.join(query.get(name, [])).split(',') if value}
+
+    def _filter_assignments(self, level, query):
+        levels = set(self._int_list(query, 'levels'))
+        stages = set(self._int_list(query, 'srs_stages'))
+        types = self._str_list(query, 'subject_types')
+        available_now = 'immediately_available_for_review' in query
+        now = datetime.now(timezone.utc)
+        available_before = query.get('available_before', [None])[0]
+        if available_before:
+            available_before = datetime.fromisoformat(available_before.replace('Z', '+00:00'))
+        return [
+            assignment for assignment in self.state.assignments_for(level)
+            if (not levels or assignment['data']['level'] in levels)
+            and (not stages or assignment['data']['srs_stage'] in stages)
+            and (not types or assignment['data']['subject_type'] in types)
+            and (not available_now or (assignment['_available_at'] is not None and assignment['_available_at'] <= now))
+            and (not available_before
+                 or (assignment['_available_at'] is not None and assignment['_available_at'] <= available_before))
+        ]
+
+
+def start_fake_wanikani(port=0, rate_limit=60, latency=0.0):
+    """Start the fake server on a background thread; returns (server, base_url ending in /v2/)."""
+    handler = type('ConfiguredFakeWaniKaniHandler', (FakeWaniKaniHandler,),
+                   {'state': FakeWaniKaniState(rate_limit, latency)})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v2/"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8802)
+    parser.add_argument('--rate-limit', type=int, default=60, help='Requests per minute per token (0 disables).')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every response.')
+    args = parser.parse_args()
+    server, base_url = start_fake_wanikani(args.port, args.rate_limit, args.latency)
+    print(f"Fake WaniKani API listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
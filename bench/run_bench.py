@@ -0,0 +1,458 @@
+"""End-to-end benchmark of both apps against local OpenAI and WaniKani stand-ins.
+
+Starts the fake Responses API and fake WaniKani in-process, launches each app in its own
+process (bench/serve_app.py) with a fresh scratch directory, and drives the real user flows
+with a pool of virtual users, each with its own cookie session:
+
+    burned_story      POST /burnedStory, then poll /burnedStory/status/<id> until finished
+    japanese_story    POST /japaneseStory, then /anki -> /ankiTranslate -> /ankiRecord per word
+    japanese_chat     /japaneseScenario followed by --turns x (/iSayDynamic + derived endpoints)
+    german_anki       /stats_and_start_anki, then /anki -> /ankiSentence -> /ankiTranslate -> /ankiRecord
+    german_chat       /germanScenario followed by --turns x (/iSayDynamic + derived endpoints)
+
+Reports p50/p95/p99 latency per endpoint and per flow, throughput, request and error
+counts, peak resident memory of each app process and the LLM call counts from /metrics.
+Inputs are seeded so two runs with the same options are comparable; --replay serves a
+cassette recorded from real traffic (bench/cassette.py) instead of the synthetic servers:
+
+    python -m bench.run_bench --concurrency 4 --iterations 3 --latency-scale 0.1 --output before.json
+    python -m bench.run_bench --concurrency 4 --iterations 3 --latency-scale 0.1 --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from bench.cassette import start_cassette_proxy  # noqa: E402
+from bench.fake_openai import start_fake_openai  # noqa: E402
+from bench.fake_wanikani import start_fake_wanikani  # noqa: E402
+
+FLOWS = {
+    'burned_story': 'japanese',
+    'japanese_story': 'japanese',
+    'japanese_chat': 'japanese',
+    'german_anki': 'german',
+    'german_chat': 'german',
+}
+SCENARIOS = (
+    'Ordering breakfast at a cafe near the station',
+    'Asking for directions to the airport',
+    'Meeting a friend after school to study',
+    'Buying vegetables at the market',
+)
+CHAT_LINES = {
+    'japanese': ('こんにちは、元気ですか？', '駅はどこですか？', 'コーヒーを一つください。', 'ありがとうございます。'),
+    'german': ('Hallo, wie geht es dir?', 'Wo ist der Bahnhof?', 'Einen Kaffee, bitte.', 'Vielen Dank!'),
+}
+POLL_INTERVAL_SECONDS = 0.25
+FLOW_TIMEOUT_SECONDS = 300
+# The apps serve /metrics only to clients presenting this token
+DEBUG_ACCESS_TOKEN = 'bench-debug'
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarise(samples):
+    durations = [duration for duration, _ in samples]
+    return {
+        'count': len(samples),
+        'errors': sum(1 for _, ok in samples if not ok),
+        'p50_ms': round(percentile(durations, 0.50) * 1000, 1) if durations else None,
+        'p95_ms': round(percentile(durations, 0.95) * 1000, 1) if durations else None,
+        'p99_ms': round(percentile(durations, 0.99) * 1000, 1) if durations else None,
+        'max_ms': round(max(durations) * 1000, 1) if durations else None,
+    }
+
+
+def write_wortlist(path, words, seed):
+    """Synthetic wortlist: a third unseen, some burned and the rest spread around today."""
+    rng = random.Random(seed)
+    today = datetime.now().date()
+    with open(path, 'w') as handle:
+        handle.write('Wort,Frequency,ReviewDate\n')
+        for position in range(words):
+            frequency = rng.choice(['', '', 'T', 'W', 'M', '3M', 'B'])
+            review_date = '' if not frequency else (today + timedelta(days=rng.randint(-20, 60))).strftime('%Y-%m-%d')
+            handle.write(f"Wort{position},{frequency},{review_date}\n")
+
+
+class AppProcess:
+    """One app served from its own scratch directory by bench/serve_app.py."""
+
+    def __init__(self, name, env, scratch_dir):
+        self.name = name
+        self.scratch_dir = scratch_dir
+        os.makedirs(scratch_dir, exist_ok=True)
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'bench.serve_app', name, '--port', '0'],
+            cwd=scratch_dir, env=dict(env, PYTHONPATH=REPO_ROOT), stdout=subprocess.PIPE,
+            stderr=open(os.path.join(scratch_dir, 'server.log'), 'w'), text=True,
+        )
+        # The app may print its import report before the server announces its port
+        line = self.process.stdout.readline()
+        while line and not line.startswith('listening'):
+            line = self.process.stdout.readline()
+        if not line:
+            self.process.kill()
+            raise RuntimeError(f"{name} app failed to start, see {scratch_dir}/server.log")
+        self.base_url = f"http://127.0.0.1:{int(line.split()[1])}"
+        # Keep draining stdout so print() in the app never blocks on a full pipe
+        threading.Thread(target=self.process.stdout.read, daemon=True).start()
+
+    def wait_ready(self, timeout=60):
+        """Poll /ready until warm-up finishes; returns the app's startup report."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                response = requests.get(f"{self.base_url}/ready", timeout=5)
+                if response.status_code == 200:
+                    return response.json().get('startup')
+            except requests.RequestException:
+                pass
+            time.sleep(0.05)
+        raise RuntimeError(f"{self.name} app was not ready after {timeout}s, see {self.scratch_dir}/server.log")
+
+    def peak_memory_kb(self):
+        """VmHWM (peak resident set size) of the app process, Linux only."""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as handle:
+                for line in handle:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1])
+        except OSError:
+            return None
+        return None
+
+    def metrics_text(self):
+        try:
+            return requests.get(f"{self.base_url}/metrics", timeout=10,
+                                headers={'Authorization': f"Bearer {DEBUG_ACCESS_TOKEN}"}).text
+        except requests.RequestException:
+            return ''
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class VirtualUser:
+    """A browser-like client: one cookie session, every request timed under its endpoint name."""
+
+    def __init__(self, base_url, recorder, rng):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.recorder = recorder
+        self.rng = rng
+
+    def call(self, method, path, endpoint=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, f"{self.base_url}/{path.lstrip('/')}", timeout=FLOW_TIMEOUT_SECONDS,
+                                            allow_redirects=False, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        self.recorder.record('request', endpoint or path, time.perf_counter() - start, ok)
+        if not ok:
+            raise FlowError(f"{method} {path} failed with {response.status_code if response is not None else 'no response'}")
+        return response
+
+
+class FlowError(Exception):
+    pass
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, kind, name, duration, ok):
+        with self.lock:
+            self.samples.setdefault((kind, name), []).append((duration, ok))
+
+    def report(self, kind):
+        with self.lock:
+            return {name: summarise(samples) for (sample_kind, name), samples in sorted(self.samples.items())
+                    if sample_kind == kind}
+
+
+def run_burned_story(user, options):
+    response = user.call('POST', '/burnedStory', data={'scenarioText': user.rng.choice(SCENARIOS)})
+    job_id = re.search(r'const jobId = "([^"]+)"', response.text).group(1)
+    deadline = time.time() + FLOW_TIMEOUT_SECONDS
+    while time.time() < deadline:
+        status = user.call('GET', f"/burnedStory/status/{job_id}", endpoint='/burnedStory/status').json()
+        if status.get('status') == 'error':
+            raise FlowError(status.get('error') or 'burned story failed')
+        if status.get('words_status') == 'done' and status.get('words'):
+            for word in status['words'][:options.word_details]:
+                user.call('POST', f"/burnedStory/word/{job_id}", endpoint='/burnedStory/word', json={'word': word})
+        if all(status.get(key) in ('done', 'error') for key in ('story_status', 'furigana_status', 'english_status')):
+            return
+        time.sleep(POLL_INTERVAL_SECONDS)
+    raise FlowError('burned story timed out')
+
+
+def run_japanese_story(user, options):
+    user.call('POST', '/japaneseStory', data={'category': user.rng.choice(['vocabulary', 'kanji'])})
+    for _ in range(20):
+        user.call('GET', '/anki')
+        user.call('POST', '/ankiTranslate')
+        response = user.call('POST', '/ankiRecord')
+        if 'englishTranslationDynamic' in response.headers.get('Location', ''):
+            break
+    user.call('GET', '/englishTranslationDynamic')
+    user.call('GET', '/ankiEnglishTranslation')
+    user.call('GET', '/ankiFurigana')
+
+
+def run_chat(user, options, language):
+    if language == 'japanese':
+        user.call('POST', '/japaneseConversation')
+        user.call('POST', '/japaneseScenario', data={'scenarioText': user.rng.choice(SCENARIOS)})
+        derived = ('/conversationEnglishTranslation', '/conversationSpellGrammarCheck', '/conversationFuriganaResponse')
+    else:
+        user.call('POST', '/germanConversation', data={'wortlist': 'A1Wortlist.csv'})
+        user.call('POST', '/germanScenario', data={'scenarioText': user.rng.choice(SCENARIOS)})
+        derived = ('/conversationEnglishTranslation', '/conversationSpellGrammarCheck')
+    for turn in range(options.turns):
+        user.call('POST', '/iSayDynamic', data={'iSayText': CHAT_LINES[language][turn % len(CHAT_LINES[language])]})
+        for path in derived:
+            user.call('GET', path)
+
+
+def run_german_anki(user, options):
+    user.call('POST', '/story_scenario', data={'wortlist': 'A1Wortlist.csv'})
+    user.call('POST', '/stats_and_start_anki', data={'scenarioText': user.rng.choice(SCENARIOS)})
+    user.call('GET', '/ankiSentencesResponse')
+    for _ in range(20):
+        response = user.call('GET', '/anki')
+        if response.status_code in (301, 302):
+            raise FlowError('no words due for review')
+        user.call('GET', '/ankiSentence')
+        user.call('POST', '/anki_prefetch')
+        user.call('POST', '/ankiTranslate')
+        user.call('GET', '/anki_poll')
+        response = user.call('POST', '/ankiRecord', data={'frequency': user.rng.choice(['T', 'W', 'M'])})
+        if 'german_story_with_translation' in response.headers.get('Location', ''):
+            break
+    user.call('GET', '/german_story_with_translation')
+
+
+FLOW_RUNNERS = {
+    'burned_story': run_burned_story,
+    'japanese_story': run_japanese_story,
+    'japanese_chat': lambda user, options: run_chat(user, options, 'japanese'),
+    'german_anki': run_german_anki,
+    'german_chat': lambda user, options: run_chat(user, options, 'german'),
+}
+
+
+def parse_metrics(text):
+    """Sum llm_requests_total and token counters from the Prometheus exposition by feature."""
+    totals = {}
+    for line in text.splitlines():
+        match = re.match(r'^(llm_requests_total|llm_input_tokens_total|llm_cached_tokens_total|'
+                         r'llm_output_tokens_total|wanikani_requests_total)\{([^}]*)\} ([0-9.e+]+)$', line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        feature = re.search(r'(?:feature|resource)="([^"]*)"', labels)
+        key = f"{name}[{feature.group(1) if feature else ''}]"
+        totals[key] = totals.get(key, 0) + float(value)
+    return totals
+
+
+def run(options):
+    if options.replay:
+        # Serve recorded upstream traffic instead of the synthetic stand-ins
+        cassette_server, openai_url, wanikani_url = start_cassette_proxy(options.replay, 'replay',
+                                                                         speed=options.replay_speed)
+        servers = [cassette_server]
+    else:
+        openai_server, openai_url = start_fake_openai(latency_scale=options.latency_scale)
+        wanikani_server, wanikani_url = start_fake_wanikani(rate_limit=options.wanikani_rate_limit,
+                                                            latency=options.wanikani_latency)
+        servers = [openai_server, wanikani_server]
+    scratch_root = tempfile.mkdtemp(prefix='bench-')
+    env = dict(os.environ,
+               OPENAI_API_KEY='bench', OPENAI_BASE_URL=openai_url,
+               WANIKANI_API_KEY=f"level-{options.level}", WANIKANI_API_URL=wanikani_url,
+               FLASK_SESSION_SECRET_KEY='bench', DEBUG_ACCESS_TOKEN=DEBUG_ACCESS_TOKEN)
+    flows = options.flows.split(',')
+    apps = {}
+    startup = {}
+    recorder = Recorder()
+    try:
+        for app_name in sorted({FLOWS[flow] for flow in flows}):
+            scratch_dir = os.path.join(scratch_root, app_name)
+            os.makedirs(scratch_dir)
+            if app_name == 'german':
+                write_wortlist(os.path.join(scratch_dir, 'A1Wortlist.csv'), options.wortlist_size, options.seed)
+                write_wortlist(os.path.join(scratch_dir, 'A2Wortlist.csv'), options.wortlist_size, options.seed + 1)
+            apps[app_name] = AppProcess(app_name, env, scratch_dir)
+            # Flows start once the app has warmed up, so cold start is reported separately
+            startup[app_name] = apps[app_name].wait_ready()
+
+        jobs = [(flow, index) for index in range(options.iterations) for flow in flows]
+
+        def run_job(job):
+            flow, index = job
+            user = VirtualUser(apps[FLOWS[flow]].base_url, recorder, random.Random(f"{options.seed}:{flow}:{index}"))
+            start = time.perf_counter()
+            ok = True
+            try:
+                FLOW_RUNNERS[flow](user, options)
+            except (FlowError, AttributeError, ValueError) as exc:
+                ok = False
+                print(f"[{flow} #{index}] {exc}", file=sys.stderr)
+            recorder.record('flow', flow, time.perf_counter() - start, ok)
+
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options.concurrency) as pool:
+            list(pool.map(run_job, jobs))
+        wall_seconds = time.perf_counter() - wall_start
+
+        requests_report = recorder.report('request')
+        flows_report = recorder.report('flow')
+        total_requests = sum(entry['count'] for entry in requests_report.values())
+        totals = {
+            'requests': total_requests,
+            'request_errors': sum(entry['errors'] for entry in requests_report.values()),
+            'flows': len(jobs),
+            'flow_errors': sum(entry['errors'] for entry in flows_report.values()),
+        }
+        if options.replay:
+            totals.update({f"cassette_{name}": value
+                           for name, value in cassette_server.RequestHandlerClass.cassette.stats.items()})
+        else:
+            totals.update({
+                'openai_requests': openai_server.RequestHandlerClass.state.request_count,
+                'wanikani_requests': wanikani_server.RequestHandlerClass.state.request_count,
+                'wanikani_rate_limited': wanikani_server.RequestHandlerClass.state.rate_limited_count,
+            })
+        return {
+            'meta': {
+                'started_at': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'options': vars(options),
+                'git_revision': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                               capture_output=True, text=True).stdout.strip(),
+            },
+            'wall_seconds': round(wall_seconds, 2),
+            'throughput': {
+                'requests_per_second': round(total_requests / wall_seconds, 2),
+                'flows_per_second': round(len(jobs) / wall_seconds, 3),
+            },
+            'totals': totals,
+            'flows': flows_report,
+            'requests': requests_report,
+            'apps': {name: {'peak_rss_kb': app.peak_memory_kb(), 'startup': startup[name],
+                            'metrics': parse_metrics(app.metrics_text())}
+                     for name, app in apps.items()},
+        }
+    finally:
+        for app in apps.values():
+            app.stop()
+        for server in servers:
+            server.shutdown()
+        if options.keep_scratch:
+            print(f"Scratch directories kept in {scratch_root}")
+        else:
+            shutil.rmtree(scratch_root, ignore_errors=True)
+
+
+def print_report(result, baseline=None):
+    def delta(current, previous):
+        if previous in (None, 0) or current is None:
+            return ''
+        return f" ({(current - previous) / previous * 100:+.1f}%)"
+
+    print(f"\nWall time {result['wall_seconds']}s, {result['throughput']['requests_per_second']} req/s, "
+          f"{result['throughput']['flows_per_second']} flows/s")
+    print('Totals: ' + ', '.join(f"{name}={value}" for name, value in result['totals'].items()))
+    for section in ('flows', 'requests'):
+        print(f"\n{section.capitalize():<40} {'count':>6} {'err':>4} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18}")
+        previous_section = (baseline or {}).get(section, {})
+        for name, entry in result[section].items():
+            previous = previous_section.get(name, {})
+            columns = [f"{entry[key]}{delta(entry[key], previous.get(key))}" for key in ('p50_ms', 'p95_ms', 'p99_ms')]
+            print(f"{name:<40} {entry['count']:>6} {entry['errors']:>4} " + ' '.join(f"{column:>18}" for column in columns))
+    print()
+    for name, app in result['apps'].items():
+        previous = ((baseline or {}).get('apps', {}).get(name) or {}).get('peak_rss_kb')
+        print(f"{name} app peak RSS: {app['peak_rss_kb']} kB{delta(app['peak_rss_kb'], previous)}")
+        startup = app.get('startup') or {}
+        if startup:
+            phases = ', '.join(f"{phase}={seconds:.3f}s" for phase, seconds in startup['phases'].items())
+            print(f"  startup: ready in {startup['total_seconds']:.3f}s ({phases})")
+            for phase, error in startup['errors'].items():
+                print(f"  startup error in {phase}: {error}")
+        for metric, value in sorted(app['metrics'].items()):
+            print(f"  {metric} = {value:g}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--flows', default=','.join(FLOWS), help='Comma separated flows to run.')
+    parser.add_argument('--concurrency', type=int, default=4, help='Virtual users running at the same time.')
+    parser.add_argument('--iterations', type=int, default=2, help='Runs of each flow.')
+    parser.add_argument('--turns', type=int, default=4, help='Turns per conversation.')
+    parser.add_argument('--word-details', type=int, default=2, help='Burned story words opened per story.')
+    parser.add_argument('--latency-scale', type=float, default=0.1,
+                        help='Multiplier for the fake model latencies (1.0 is realistic, 0 is instant).')
+    parser.add_argument('--level', type=int, default=30, help='Synthetic WaniKani user level (1-60).')
+    parser.add_argument('--wanikani-rate-limit', type=int, default=0,
+                        help='Fake WaniKani requests per minute (60 matches the real API, 0 disables).')
+    parser.add_argument('--wanikani-latency', type=float, default=0.05)
+    parser.add_argument('--wortlist-size', type=int, default=1500)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--replay', help='Cassette recorded with bench/cassette.py to serve instead of the fakes.')
+    parser.add_argument('--replay-speed', type=float, default=1.0,
+                        help='Multiplier for recorded upstream timings when replaying (0 is instant).')
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    parser.add_argument('--compare', help='Previous JSON result to print deltas against.')
+    parser.add_argument('--keep-scratch', action='store_true', help='Keep app data directories and server logs.')
+    options = parser.parse_args()
+    unknown = set(options.flows.split(',')) - set(FLOWS)
+    if unknown:
+        parser.error(f"unknown flows: {', '.join(sorted(unknown))}")
+
+    result = run(options)
+    baseline = None
+    if options.compare:
+        with open(options.compare) as handle:
+            baseline = json.load(handle)
+    print_report(result, baseline)
+    if options.output:
+        with open(options.output, 'w') as handle:
+            json.dump(result, handle, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
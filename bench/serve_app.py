@@ -0,0 +1,65 @@
+"""Run one of the apps on a threaded development server for the benchmark harness.
+
+The working directory should be a scratch directory: both apps keep their data files
+(usage_events.db, sessions.db, burned word caches, wortlists and wortlists.db) relative to it. The German
+templates are stored with a "german_" prefix and are served under their deployed names.
+
+    python -m bench.serve_app japanese --port 8810
+"""
+import argparse
+import importlib
+import os
+import sys
+
+import jinja2
+from werkzeug.serving import make_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATHS = {
+    'japanese': os.path.join(REPO_ROOT, 'app.py'),
+    'german': os.path.join(REPO_ROOT, 'germanfriendonline', 'german_app.py'),
+}
+
+
+class GermanTemplateLoader(jinja2.BaseLoader):
+    """Serves the German templates under their deployed names (without the "german_" prefix)."""
+
+    def __init__(self, template_dir):
+        self.template_dir = template_dir
+
+    def get_source(self, environment, template):
+        for candidate in (template if template.startswith('german') else f"german_{template}", template):
+            path = os.path.join(self.template_dir, candidate)
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as handle:
+                    return handle.read(), path, lambda: True
+        raise jinja2.TemplateNotFound(template)
+
+    def list_templates(self):
+        return sorted(name.removeprefix('german_') for name in os.listdir(self.template_dir))
+
+
+def load_app(name):
+    """Import the app and start its warm-up, as the app's own entry point does."""
+    path = APP_PATHS[name]
+    sys.path.insert(0, os.path.dirname(path))
+    module = importlib.import_module(os.path.splitext(os.path.basename(path))[0])
+    if name == 'german':
+        module.app.jinja_loader = GermanTemplateLoader(os.path.join(os.path.dirname(path), 'templates'))
+    module.startup.begin()
+    return module.app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('app', choices=sorted(APP_PATHS))
+    parser.add_argument('--port', type=int, default=0)
+    args = parser.parse_args()
+    server = make_server('127.0.0.1', args.port, load_app(args.app), threaded=True)
+    # The harness reads the chosen port from the first line of output
+    print(f"listening {server.server_port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
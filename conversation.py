@@ -0,0 +1,252 @@
+"""Conversation history and per-turn precompute shared by the Japanese and German apps.
+
+Conversation history is resent every turn, so only the last few turns are kept verbatim and older turns are
+folded into a rolling summary off the critical path. In 'chained' mode only the new message is sent, linked to
+the previous turn with previous_response_id (server-side state); 'replay' resends the history every turn, and
+chained mode falls back to replay if the chain is missing. The server replays a whole chain as input, so after
+chain_turns chained turns the chain is re-based on system prompt + rolling summary + recent turns. The
+conversation itself lives in the Flask session (conversationMessages, conversationSummary, conversationId,
+conversationResponseId, conversationChainTurns), so any worker can carry it on:
+
+    conversation = ConversationHistory(llm, create_response)
+    conversation.begin(system_prompt)
+    response = conversation.respond(conversation_id, messages, max_tokens=100, feature='conversation')
+
+Summaries are computed in the background by the worker that saw the overflow, and a re-base waits for the
+summary (starting it if this process has none) so that the new chain starts from it. Turns leave
+conversationMessages only when a finished summary that covers them is folded into conversationSummary, so a
+worker without that summary (another process, or after a restart, or when the summary is late) sends the
+unsummarised turns instead of losing them.
+
+ConversationTurns computes the derived artefacts of a turn (translation, correction, ...) speculatively once
+the reply is known, so the pages that show them find them ready.
+"""
+import os
+import time
+import uuid
+from threading import Event, Lock
+
+from flask import session
+
+from llm_gateway import openai_error_types
+from telemetry import increment_counter, start_background_thread
+
+CONVERSATION_WINDOW_TURNS = 6
+CONVERSATION_SUMMARY_TTL_SECONDS = 24 * 60 * 60
+CONVERSATION_SUMMARY_WAIT_SECONDS = 20
+CONVERSATION_MODE = os.environ.get('CONVERSATION_MODE', 'chained')
+# Older turns are only summarised ahead of a re-base
+CONVERSATION_CHAIN_TURNS = CONVERSATION_WINDOW_TURNS
+CONVERSATION_TURN_JOB_TTL_SECONDS = 60 * 60
+CONVERSATION_TURN_WAIT_SECONDS = 120
+
+SUMMARY_INSTRUCTIONS = ("You maintain a compact running summary of a language practice conversation. "
+                        "Keep names, facts, plans and open questions. Use at most 120 words, "
+                        "in the language of the conversation. Respond with only the summary.")
+
+
+class ConversationHistory:
+    """Windowed, summarised conversation history sent through create_response(messages, previous_response_id=..., **args)."""
+
+    def __init__(self, llm, create_response, mode=CONVERSATION_MODE, window_turns=CONVERSATION_WINDOW_TURNS,
+                 chain_turns=CONVERSATION_CHAIN_TURNS, summary_ttl_seconds=CONVERSATION_SUMMARY_TTL_SECONDS,
+                 summary_wait_seconds=CONVERSATION_SUMMARY_WAIT_SECONDS):
+        self.llm = llm
+        self.create_response = create_response
+        self.mode = mode
+        self.window_turns = window_turns
+        self.chain_turns = chain_turns
+        self.summary_ttl_seconds = summary_ttl_seconds
+        self.summary_wait_seconds = summary_wait_seconds
+        # Summaries in progress or not yet folded into their session, at most one per conversation:
+        # { conversation_id: {'base': str, 'folded': [messages], 'summary': str, 'status': str, 'event': Event, 'started_at': float} }
+        self.summaries = {}
+        self.lock = Lock()
+
+    def start(self):
+        """Return the id of a new conversation."""
+        return str(uuid.uuid4())
+
+    def begin(self, system_prompt):
+        """Start the session's conversation with system_prompt as its system message."""
+        session['conversationMessages'] = [{'role': 'system', 'content': system_prompt}]
+        session['conversationSummary'] = ''
+        session['conversationId'] = self.start()
+        session['conversationResponseId'] = None
+        session['conversationChainTurns'] = 0
+
+    def current_id(self):
+        """The session's conversation id, starting a new conversation if it has none."""
+        conversation_id = session.get('conversationId') or self.start()
+        session['conversationId'] = conversation_id
+        return conversation_id
+
+    def build_input(self, conversation_id, messages):
+        """System prompt, then the rolling summary of folded turns, then the verbatim turns since."""
+        self.fold_summary(conversation_id, messages)
+        summary = session.get('conversationSummary', '')
+        if not summary:
+            return list(messages)
+        summary_message = {'role': 'system', 'content': f"Summary of the earlier conversation: {summary}"}
+        return messages[:1] + [summary_message] + messages[1:]
+
+    def fold_summary(self, conversation_id, messages):
+        """If this process finished a summary of the session's oldest turns, move those turns out of messages
+        (in place) and into the session's summary. Summaries of a different history are discarded."""
+        with self.lock:
+            job = self.summaries.get(conversation_id)
+            if not job or job['status'] == 'in_progress':
+                return
+            del self.summaries[conversation_id]
+        folded = job['folded']
+        if (job['status'] == 'done' and job['base'] == session.get('conversationSummary', '')
+                and messages[1:1 + len(folded)] == folded):
+            del messages[1:1 + len(folded)]
+            session['conversationSummary'] = job['summary']
+
+    def _summarise(self, job):
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in job['folded'])
+        messages = [
+            {'role': 'system', 'content': SUMMARY_INSTRUCTIONS},
+            {'role': 'user',
+             'content': f"Current summary:\n{job['base'] or '(none)'}\n\nNew turns to fold in:\n{transcript}"},
+        ]
+        try:
+            job['summary'] = (self.llm.complete(messages, model="gpt-5-nano", max_tokens=400,
+                                                feature='conversation_summary') or '').strip()
+            job['status'] = 'done'
+        except Exception as exc:
+            print(f"Conversation summarisation failed: {exc}")
+            job['status'] = 'error'
+        finally:
+            job['event'].set()
+
+    def window(self, conversation_id, messages):
+        """Fold in a finished summary, then start summarising the turns beyond the last window_turns in the
+        background. While chained, the older turns are still in the server-side chain, so they are only
+        summarised ahead of the turn that re-bases the chain. Returns messages, which keeps every turn not yet
+        covered by the session's summary.
+        """
+        self.fold_summary(conversation_id, messages)
+        turns = messages[1:]
+        overflow = len(turns) - 2 * self.window_turns
+        rebase_due = (self.mode != 'chained' or not session.get('conversationResponseId')
+                      or session.get('conversationChainTurns', 0) >= self.chain_turns)
+        if overflow > 0 and rebase_due:
+            self._start_summary(conversation_id, turns[:overflow])
+        return messages
+
+    def await_summary(self, conversation_id, messages):
+        """Before a re-base: summarise the turns before the new message that are beyond the last window_turns,
+        unless this process already has a summary under way, and wait up to summary_wait_seconds for it."""
+        earlier_turns = messages[1:-1]
+        overflow = len(earlier_turns) - 2 * self.window_turns
+        if overflow > 0:
+            self._start_summary(conversation_id, earlier_turns[:overflow])
+        with self.lock:
+            job = self.summaries.get(conversation_id)
+        if job and not job['event'].wait(self.summary_wait_seconds):
+            increment_counter('conversation_summary_late_total')
+
+    def _start_summary(self, conversation_id, folded):
+        now = time.time()
+        job = {'base': session.get('conversationSummary', ''), 'folded': folded, 'summary': '',
+               'status': 'in_progress', 'event': Event(), 'started_at': now}
+        with self.lock:
+            for stale_id in [summary_id for summary_id, summary in self.summaries.items()
+                             if now - summary['started_at'] > self.summary_ttl_seconds]:
+                self.summaries.pop(stale_id, None)
+            if conversation_id in self.summaries:
+                return
+            self.summaries[conversation_id] = job
+        start_background_thread(self._summarise, (job,))
+
+    def respond(self, conversation_id, messages, **create_args):
+        """Send the latest turn, chaining on the stored response id and replaying the history if that fails.
+        Every chain_turns turns the chain is re-based on the summary and the turns since; turns that the summary
+        does not cover yet are sent verbatim.
+        """
+        previous_response_id = session.get('conversationResponseId') if self.mode == 'chained' else None
+        chain_turns = session.get('conversationChainTurns', 0)
+        if chain_turns >= self.chain_turns:
+            previous_response_id = None
+        response = None
+        if previous_response_id:
+            try:
+                response = self.create_response(messages[-1:], previous_response_id=previous_response_id, **create_args)
+            except Exception as exc:
+                if not isinstance(exc, openai_error_types('NotFoundError', 'BadRequestError')):
+                    raise
+                print(f"Conversation chain {previous_response_id} unavailable, replaying history: {exc}")
+        if response is None:
+            if self.mode == 'chained':
+                self.await_summary(conversation_id, messages)
+            response = self.create_response(self.build_input(conversation_id, messages), **create_args)
+            chain_turns = 0
+        else:
+            chain_turns += 1
+        session['conversationResponseId'] = getattr(response, 'id', None)
+        session['conversationChainTurns'] = chain_turns
+        self.record_input_tokens('replay' if chain_turns == 0 else 'chained', response)
+        return response
+
+    def record_input_tokens(self, mode, response):
+        """Count turns and their input tokens by how they were sent, so /metrics shows the average input per turn."""
+        usage = getattr(response, 'usage', None)
+        increment_counter('conversation_turns_total', mode=mode)
+        increment_counter('conversation_input_tokens_total', getattr(usage, 'input_tokens', 0) or 0, mode=mode)
+
+    def job_states(self):
+        """(queue, state) of each conversation's summary, for the apps' job gauges."""
+        return [('conversation_summary', job['status']) for job in list(self.summaries.values())]
+
+
+class ConversationTurns:
+    """Artefacts of each conversation turn, computed in the background and collected by name."""
+
+    def __init__(self, ttl_seconds=CONVERSATION_TURN_JOB_TTL_SECONDS, wait_seconds=CONVERSATION_TURN_WAIT_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.wait_seconds = wait_seconds
+        # { turn_id: {'created_at': float, 'tasks': {name: {status, result, error, event}}} }
+        self.jobs = {}
+
+    def _run(self, task):
+        try:
+            task['result'] = task['compute']()
+            task['status'] = 'done'
+        except Exception as exc:
+            print(f"Conversation turn precompute failed: {exc}")
+            task['status'] = 'error'
+            task['error'] = str(exc)
+        finally:
+            task['event'].set()
+
+    def start(self, computations):
+        """Start each of {name: compute} for a new turn and return the turn id."""
+        now = time.time()
+        for stale_id in [turn_id for turn_id, job in list(self.jobs.items())
+                         if now - job['created_at'] > self.ttl_seconds]:
+            self.jobs.pop(stale_id, None)
+
+        turn_id = str(uuid.uuid4())
+        tasks = {
+            name: {'status': 'in_progress', 'result': '', 'error': None, 'event': Event(), 'compute': compute}
+            for name, compute in computations.items()
+        }
+        self.jobs[turn_id] = {'created_at': now, 'tasks': tasks}
+        for task in tasks.values():
+            start_background_thread(self._run, (task,))
+        return turn_id
+
+    def result(self, turn_id, name, fallback):
+        """Return the precomputed (or in-flight) artefact of the turn, computing inline if absent."""
+        job = self.jobs.get(turn_id)
+        task = job['tasks'].get(name) if job else None
+        if task and task['event'].wait(self.wait_seconds) and task['status'] == 'done':
+            return task['result']
+        return fallback()
+
+    def job_states(self):
+        """(queue, state) of each precompute task, for the apps' job gauges."""
+        return [(f'conversation_{name}', task['status'])
+                for job in list(self.jobs.values()) for name, task in list(job['tasks'].items())]
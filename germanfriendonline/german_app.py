@@ -1,44 +1,270 @@
-from flask import Flask, render_template, request, session, redirect, url_for, jsonify, flash, has_request_context
-from flask_session import Session
-from openai import OpenAI
+import time
+STARTUP_STARTED_AT = time.perf_counter()
+
+from flask import Flask, render_template, request, session, redirect, url_for, jsonify, flash, has_request_context, Response
 import os
 import random
 from datetime import datetime, timedelta
 import json
+import fcntl
+import sqlite3
 import unicodedata
-from threading import Thread
-import time
+from threading import Lock, Condition
+import re
+import sys
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import click
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 app = Flask(__name__)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 app.secret_key = os.getenv('FLASK_SESSION_SECRET_KEY')
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-# Use server-side session storage
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['SESSION_FILE_DIR'] = os.path.join(os.getcwd(), 'flask_session_data')
+# Use server-side session storage shared with the Japanese app (session_store.py in the repository root):
+# the cookie holds only a signed session id, and unchanged sessions are not written back.
+# SESSION_DB_PATH='' keeps sessions in memory only.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from session_store import ServerSideSessionInterface, SessionStore
+# Metrics, request tracing and usage events shared with the Japanese app (telemetry.py); the debug endpoints
+# need DEBUG_ACCESS_TOKEN (or DEBUG_ALLOW_LOCAL=1 for local requests)
+from telemetry import (current_route, debug_access_required, get_last_run_datetime, increment_counter, init_tracing,
+                       job_gauges, observe_histogram, recent_traces, record_usage_event, render_metrics,
+                       start_background_thread, summarise_usage, trace_span, trace_waterfall, traced, traces_lock,
+                       usage_db)
+# Story vocabulary selection shared with the Japanese app (story_vocabulary.py)
+from story_vocabulary import StoryVocabulary
+# Conversation windowing, rolling summaries, response chaining and per-turn precompute shared with the
+# Japanese app (conversation.py)
+from conversation import ConversationHistory, ConversationTurns
+# Startup warm-up and readiness shared with the Japanese app (startup.py)
+from startup import Startup
+# Model calls go through the gateway shared with the Japanese app (llm_gateway.py): one pooled client,
+# retries, circuit breakers, single-flight, routing and metrics. It imports the openai SDK on first use,
+# or the warm-up thread does before /ready reports ready.
+from llm_gateway import LLMGateway, ModelUnavailableError, response_output_text
 app.config['SESSION_PERMANENT'] = False
-app.config['SESSION_USE_SIGNER'] = True
-Session(app)
+SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH', 'sessions.db')
+SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', str(7 * 24 * 60 * 60)))
+session_store = SessionStore(SESSION_DB_PATH, ttl_seconds=SESSION_TTL_SECONDS)
+app.session_interface = ServerSideSessionInterface(session_store)
+# Each request gets a trace (telemetry.py); recent ones are listed at /debug/traces
+init_tracing(app)
 
 # Store background results (use Redis or DB in production)
 story_results = {}  # Dict to hold story by session ID or custom token
 # Background sentences generation for Anki (Responses API)
-anki_sentences_jobs = {}  # { session_id: {status: 'in_progress'|'done'|'error', response: str, error: str} }
+anki_sentences_jobs = {}  # { session_id: {status: 'in_progress'|'done'|'error', response: str, error: str, sentences: dict} }
+# The sentences are streamed; each word's sentence is published to job['sentences'] (keyed by NFC word)
+# as soon as its key/value pair is complete, and waiters on anki_sentences_changed are woken.
+anki_sentences_changed = Condition()
+ANKI_SENTENCE_WAIT_SECONDS = 120
 
 # Background prefetch state for Anki translations
 # Keyed by f"{session_id}:{card_number}" and stores statuses/results
 anki_translation_jobs = {}
+# Once a deck's sentences exist, one structured call translates every card's word and sentence into
+# anki_translation_jobs; cards it misses fall back to the per-card prefetch.
+ANKI_DECK_TRANSLATION_FORMAT = {
+    'type': 'json_schema',
+    'name': 'anki_deck_translations',
+    'strict': True,
+    'schema': {
+        'type': 'object',
+        'properties': {
+            'cards': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'word': {'type': 'string'},
+                        'word_translation': {'type': 'string'},
+                        'sentence_translation': {'type': 'string'},
+                    },
+                    'required': ['word', 'word_translation', 'sentence_translation'],
+                    'additionalProperties': False,
+                },
+            },
+        },
+        'required': ['cards'],
+        'additionalProperties': False,
+    },
+}
+
+# Derived artefacts for each conversation turn, computed speculatively once the reply is known
+conversation_turns = ConversationTurns()
+
+STORY_FOCUS_WORD_COUNT = 8
+
+# Story prompts use a bounded subset of the burned words (story_vocabulary.py): a daily rotating list,
+# then words named in the scenario and words from the categories below that it mentions.
+# Scenario keywords (English or German) and the German stems that put a burned word in a category
+VOCABULARY_CATEGORIES = {
+    'food': (
+        ('food', 'eat', 'restaurant', 'cafe', 'café', 'cook', 'breakfast', 'lunch', 'dinner', 'meal', 'drink',
+         'kitchen', 'bakery', 'coffee', 'tea', 'essen', 'trinken', 'kochen', 'bäckerei', 'frühstück'),
+        ('brot', 'kaffee', 'tee', 'trink', 'koch', 'restaurant', 'kuchen', 'fleisch', 'obst', 'gemüse', 'milch',
+         'wasser', 'bier', 'wein', 'frühstück', 'mittagessen', 'abendessen', 'käse', 'suppe', 'salat', 'apfel',
+         'zucker', 'salz', 'hunger', 'durst', 'bäck', 'speise', 'teller', 'flasche', 'lecker', 'kellner'),
+    ),
+    'travel': (
+        ('travel', 'trip', 'station', 'train', 'airport', 'plane', 'flight', 'bus', 'hotel', 'holiday',
+         'vacation', 'drive', 'car', 'ticket', 'reise', 'urlaub', 'bahnhof', 'zug', 'flughafen'),
+        ('reise', 'urlaub', 'bahn', 'zug', 'flug', 'hotel', 'fahr', 'auto', 'bus', 'ticket', 'koffer', 'gepäck',
+         'straße', 'karte', 'abfahrt', 'ankunft', 'halte', 'gleis', 'pass', 'grenze'),
+    ),
+    'school_work': (
+        ('school', 'class', 'teacher', 'student', 'study', 'exam', 'test', 'university', 'course', 'work',
+         'office', 'job', 'meeting', 'boss', 'colleague', 'company', 'schule', 'arbeit', 'büro', 'kurs'),
+        ('schul', 'lehrer', 'student', 'studi', 'prüfung', 'kurs', 'klasse', 'lern', 'arbeit', 'büro', 'beruf',
+         'chef', 'kolleg', 'firma', 'termin', 'besprechung', 'gehalt', 'stelle', 'bewerb'),
+    ),
+    'people': (
+        ('family', 'friend', 'mother', 'father', 'parent', 'brother', 'sister', 'child', 'kid', 'wife',
+         'husband', 'party', 'birthday', 'wedding', 'familie', 'freund', 'geburtstag'),
+        ('familie', 'mutter', 'vater', 'eltern', 'bruder', 'schwester', 'kind', 'sohn', 'tochter', 'frau', 'mann',
+         'freund', 'geburtstag', 'hochzeit', 'party', 'fest', 'gast', 'nachbar', 'oma', 'opa'),
+    ),
+    'nature': (
+        ('nature', 'weather', 'rain', 'snow', 'wind', 'mountain', 'river', 'sea', 'lake', 'beach', 'forest',
+         'park', 'garden', 'flower', 'hike', 'season', 'wetter', 'wald', 'berg'),
+        ('wetter', 'regen', 'schnee', 'wind', 'sonne', 'berg', 'fluss', 'meer', 'see', 'strand', 'wald', 'park',
+         'garten', 'blume', 'baum', 'wander', 'himmel', 'frühling', 'sommer', 'herbst', 'winter', 'tier'),
+    ),
+    'health': (
+        ('health', 'doctor', 'hospital', 'sick', 'ill', 'medicine', 'pain', 'gym', 'sport', 'exercise',
+         'arzt', 'krank', 'krankenhaus', 'apotheke'),
+        ('arzt', 'ärzt', 'krank', 'medikament', 'apotheke', 'schmerz', 'kopf', 'bauch', 'fieber', 'gesund',
+         'sport', 'termin', 'zahn', 'körper', 'müde', 'schlaf'),
+    ),
+    'shopping': (
+        ('shop', 'shopping', 'store', 'buy', 'sell', 'money', 'price', 'market', 'supermarket', 'cheap',
+         'expensive', 'einkaufen', 'geschäft', 'markt'),
+        ('kauf', 'geschäft', 'laden', 'markt', 'geld', 'preis', 'euro', 'bezahl', 'kasse', 'billig', 'teuer',
+         'kleid', 'hose', 'schuh', 'größe', 'angebot', 'rechnung'),
+    ),
+    'home': (
+        ('home', 'house', 'room', 'apartment', 'flat', 'move', 'clean', 'neighbor', 'neighbour', 'bed',
+         'wohnung', 'haus', 'zimmer', 'umzug'),
+        ('haus', 'wohnung', 'zimmer', 'küche', 'bad', 'garten', 'fenster', 'tür', 'bett', 'tisch', 'stuhl',
+         'miete', 'umzug', 'putz', 'nachbar', 'möbel', 'schlüssel'),
+    ),
+    'feelings': (
+        ('feel', 'happy', 'sad', 'angry', 'love', 'afraid', 'lonely', 'worry', 'surprise', 'gefühl'),
+        ('glücklich', 'traurig', 'ärger', 'liebe', 'angst', 'sorge', 'freude', 'froh', 'überrasch', 'gefühl',
+         'lieb', 'hoffen', 'wünsch'),
+    ),
+}
+
+# Model routing: each task lists acceptable (model, reasoning effort) options in order of preference and a
+# latency budget. The first option whose recent p90 latency fits the budget is used (unmeasured options are
+# assumed to fit); a call still running after hedge_after_seconds is raced against the next option.
+# MODEL_ROUTING=static always uses the first option and never hedges (see llm_gateway.py).
+MODEL_ROUTES = {
+    'story': {'budget_seconds': 60, 'hedge_after_seconds': 45,
+              'options': [('gpt-5', 'medium'), ('gpt-5', 'low'), ('gpt-5-mini', 'low')]},
+    'story_translation': {'budget_seconds': 20, 'hedge_after_seconds': 15,
+                          'options': [('gpt-5-mini', 'minimal'), ('gpt-5-nano', 'minimal')]},
+    'anki_sentences': {'budget_seconds': 20, 'hedge_after_seconds': 15,
+                       'options': [('gpt-5-mini', 'minimal'), ('gpt-5-nano', 'minimal')]},
+    'spell_grammar': {'budget_seconds': 8, 'hedge_after_seconds': 6,
+                      'options': [('gpt-5-mini', 'minimal'), ('gpt-5-nano', 'minimal')]},
+    'anki_deck_translation': {'budget_seconds': 15, 'hedge_after_seconds': 10,
+                              'options': [('gpt-5-mini', 'minimal'), ('gpt-5-nano', 'minimal')]},
+    'anki_word_translation': {'budget_seconds': 5, 'options': [('gpt-5-nano', 'minimal')]},
+    'translation': {'budget_seconds': 10, 'options': [('gpt-5-nano', 'minimal')]},
+    'pregenerate': {'budget_seconds': 120, 'options': [('gpt-5-mini', 'minimal'), ('gpt-5-nano', 'minimal')]},
+}
+
+# Per-task timeouts for model calls; retries, backoff and circuit breaker settings live in llm_gateway.py
+LLM_TIMEOUT_SECONDS = {
+    'story': 240,
+    'story_translation': 120,
+    'anki_sentences': 90,
+    'anki_deck_translation': 60,
+    'anki_word_translation': 30,
+    'translation': 30,
+    'spell_grammar': 45,
+    'conversation': 45,
+    'conversation_summary': 60,
+    'pregenerate': 300,
+}
 
 # ------------------------------------------------------------------------------
 # 1) constants and helper
 # ------------------------------------------------------------------------------
 DEFAULT_WORTLIST_FILE = "A1Wortlist.csv"
 
+# Wortlist review state lives in SQLite so due-card selection, unreviewed sampling and bucket counts are
+# indexed queries. Each CSV is imported once (again only if it is edited by hand) and exported after saves.
+SRS_DB_PATH = os.environ.get('SRS_DB_PATH', 'wortlists.db')
+SRS_CARDS_PER_SESSION = 10
+srs_db_local = threading.local()
+srs_db_lock = Lock()
+srs_db_state = {'ready': False, 'replayed': set()}
+# Columnar copy of each wortlist for the stats page: one NumPy array per field, row i = word i in file order.
+# { wortlist_file: {'version': int, 'words': [str], 'lines': int32[], 'frequency': int8[], 'review_day': int32[],
+#                   'position': {line: row}} }  review_day is days since 1970-01-01, -1 when never reviewed
+wortlist_columns = {}
+wortlist_columns_lock = Lock()
+FREQUENCY_CODES = {'T': 1, 'W': 2, 'M': 3, '3M': 4, 'B': 5}  # anything else is 0
+# Burned words per wortlist, tagged with the store version they were taken from, so a review write or a
+# re-imported CSV invalidates them; merged level lists (A1 + A2) are tagged with the versions of both.
+# { wortlist_file: {'version': int, 'words': tuple} }, { (file, ...): {'versions': (int, ...), 'words': tuple} }
+burned_word_indexes = {}
+burned_word_merges = {}
+burned_word_indexes_lock = Lock()
+REVIEW_FORECAST_DAYS = 90
+# Finishing a deck appends its results to <wortlist>.journal (fsynced) and applies them to the store by
+# (line, word); a background compaction patches the changed rows into the CSV atomically, leaving line
+# numbers as they are. Journals are replayed on import.
+# { wortlist_file: {'running': bool, 'dirty': bool} }
+wortlist_compactions = {}
+wortlist_compactions_lock = Lock()
+# Example sentences (with their translations once known) are banked per (normalised word, level) in the SRS
+# store and rotated across sessions, so only words without a usable sentence need a generation call.
+SENTENCE_BANK_SIZE = 3  # sentences kept per word and level
+SENTENCE_BANK_MAX_AGE_DAYS = 180  # older sentences are stale: no longer served, replaced by new ones
+# While a word has fewer than SENTENCE_BANK_SIZE sentences, one served within this many days is not
+# repeated; a new sentence is generated instead (e.g. for a word reviewed again tomorrow)
+SENTENCE_BANK_REUSE_AFTER_DAYS = 2
+SENTENCE_BANK_MAX_CHARS = 300
+# `flask --app german_app pregenerate` fills the bank (sentences and translations) for the words due in the next
+# few days ahead of time, in batched requests; progress is saved after each batch so an interrupted run resumes.
+PREGENERATE_PROGRESS_PATH = 'pregenerate_progress.json'
+PREGENERATED_CARDS_FORMAT = {
+    'type': 'json_schema',
+    'name': 'pregenerated_cards',
+    'strict': True,
+    'schema': {
+        'type': 'object',
+        'properties': {
+            'cards': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'word': {'type': 'string'},
+                        'sentence': {'type': 'string'},
+                        'word_translation': {'type': 'string'},
+                        'sentence_translation': {'type': 'string'},
+                    },
+                    'required': ['word', 'sentence', 'word_translation', 'sentence_translation'],
+                    'additionalProperties': False,
+                },
+            },
+        },
+        'required': ['cards'],
+        'additionalProperties': False,
+    },
+}
+
 # Assistant IDs no longer used after migration to Responses API
 
+llm = LLMGateway(MODEL_ROUTES, LLM_TIMEOUT_SECONDS, increment_counter=increment_counter,
+                 observe_histogram=observe_histogram, trace_span=trace_span, current_route=current_route)
+
 def get_current_wortlist_file():
     # fall back to default if none selected
     if has_request_context():
@@ -64,31 +290,66 @@ def generate_story_background(session_key, wortlist_file, scenario_text):
         }
         return
 
-    # Build a concise prompt for faster response
-    prompt = f"""
-            Write an interesting German story for this scenario: {scenario_text}.
-            Can use any Proper Nouns including those that are in the Scenario text such as 'Raj'. 
-            Write the story primarily using Nouns, Verbs and Adjectives that are in this list: {', '.join(burned_words)}.
-            """
-    messages = [
-        {'role': 'system', 'content': 'You are a helpful language teacher.'},
-        {'role': 'user', 'content': prompt}
-    ]
+    story_words, scenario_words = story_vocabulary.select(burned_words, scenario_text)
+    messages = build_story_messages(story_words, scenario_text, scenario_words)
 
     try:
         # Use a lighter model and lower reasoning to speed up German story
-        german_story = get_completion_from_messages(messages, model="gpt-5", max_tokens=None, reasoning_effort="medium")
-        german_story = german_story.strip()
+        resp = create_routed_response(messages, 'story', max_tokens=None, prompt_cache_key='german-story')
+        german_story = response_output_text(resp).strip()
         story_results[session_key]['german'] = german_story
         story_results[session_key]['german_status'] = 'done'
 
         # Kick off English translation in a separate thread so the page can update later
-        Thread(target=generate_english_translation, args=(session_key,), daemon=True).start()
+        start_background_thread(generate_english_translation, (session_key,))
     except Exception as e:
         story_results[session_key]['german'] = f"Error generating story: {e}"
         story_results[session_key]['german_status'] = 'error'
 
 
+class GermanStoryVocabulary(StoryVocabulary):
+    """Words are indexed by their first four letters and count as mentioned when a scenario token starts with
+    them (covers inflections like Kaffees); a category's markers are German stems."""
+
+    def lexical_keys(self, word):
+        return (word.lower()[:4],)
+
+    def scenario_keys(self, scenario, tokens):
+        return {token[:4] for token in tokens}
+
+    def mentions_word(self, word, scenario, tokens):
+        lowered = word.lower()
+        return any(token.startswith(lowered) for token in tokens)
+
+    def in_category(self, word, markers):
+        lowered = word.lower()
+        return any(stem in lowered for stem in markers)
+
+story_vocabulary = GermanStoryVocabulary(VOCABULARY_CATEGORIES)
+
+def build_story_messages(burned_words, scenario_text, scenario_words=()):
+    """Stable content first so provider prompt caching can hit: system text, sorted word list, then the
+    scenario words and scenario. Variety comes from a random set of focus words in the final instruction,
+    not from the list order.
+    """
+    canonical_words = sorted(set(burned_words))
+    extra_words = sorted(set(scenario_words) - set(canonical_words))
+    focus_words = random.sample(canonical_words + extra_words,
+                                min(STORY_FOCUS_WORD_COUNT, len(canonical_words) + len(extra_words)))
+    extra_prompt = f"More words from the learner's vocabulary list: {', '.join(extra_words)}.\n" if extra_words else ''
+
+    system_prompt = """
+            You are a helpful language teacher.
+            Write an interesting German story for the learner's scenario.
+            Can use any Proper Nouns including those that are in the Scenario text such as 'Raj'.
+            Write the story primarily using Nouns, Verbs and Adjectives that are in the learner's vocabulary list.
+            """
+    return [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': f"Learner's vocabulary list: {', '.join(canonical_words)}."},
+        {'role': 'user', 'content': f"{extra_prompt}Scenario: {scenario_text}.\nFor variety, try to feature these words from the list: {', '.join(focus_words)}."}
+    ]
+
 def generate_english_translation(session_key: str):
     # Translate the generated German story to English
     result = story_results.get(session_key)
@@ -101,7 +362,7 @@ def generate_english_translation(session_key: str):
             {'role': 'user', 'content': 'Translate this German story to English.'},
             {'role': 'assistant', 'content': result['german']}
         ]
-        english_story = get_completion_from_messages(messages, model="gpt-5-mini", max_tokens=None)
+        english_story = llm.complete(messages, task='story_translation', max_tokens=None)
         story_results[session_key]['english'] = english_story.strip()
         story_results[session_key]['english_status'] = 'done'
     except Exception as e:
@@ -113,71 +374,156 @@ def generate_english_translation(session_key: str):
 # If reviewing A1Wortlist, the burned worts are from A1 list
 # If reviewing A2Wortlist, then burned worts are from A1 and A2 list.
 # Once A2 bunred wort list is large enough (>1000 words) can consider switching to exclusively A2 list.
-def get_burned_words(wortlist_file):
-    burned_words = []
-
-    file_path = wortlist_file
-
-    files_to_read = []
-    if file_path == "A2Wortlist.csv":
-        files_to_read = ["A1Wortlist.csv", "A2Wortlist.csv"]
-    else:
-        files_to_read = [file_path]
-
-    for path in files_to_read:
-        try:
-            with open(path, 'r') as file:
-                for lineNumber, line in enumerate(file):
-                    if lineNumber == 0:
-                        continue  # Skip header
-                    line = line.strip()
-                    elements = line.split(',')
-                    if len(elements) >= 2:
-                        word, frequency = elements[0], elements[1]
-                        if frequency == "B":
-                            burned_words.append(word)
-        except FileNotFoundError:
-            print(f"File not found: {path}")
+def story_wortlist_files(wortlist_file):
+    if wortlist_file == "A2Wortlist.csv":
+        return ["A1Wortlist.csv", "A2Wortlist.csv"]
+    return [wortlist_file]
 
-    # Shuffle to ensure random order each time
-    random.shuffle(burned_words)
-
-    return burned_words
+def get_file_burned_words(path):
+    """(store version, sorted tuple of burned words) for one wortlist, re-extracted only after it changes."""
+    try:
+        columns = get_wortlist_columns(ensure_wortlist_loaded(path), path)
+    except FileNotFoundError:
+        print(f"File not found: {path}")
+        return None, ()
+    with burned_word_indexes_lock:
+        index = burned_word_indexes.get(path)
+        if index is not None and index['version'] == columns['version']:
+            return index['version'], index['words']
+    import numpy as np
+    with wortlist_columns_lock:
+        version = columns['version']
+        positions = np.flatnonzero(columns['frequency'] == FREQUENCY_CODES['B']).tolist()
+        words = tuple(sorted({columns['words'][position] for position in positions}))
+    with burned_word_indexes_lock:
+        burned_word_indexes[path] = {'version': version, 'words': words}
+    return version, words
+
+@traced('db')
+def get_burned_words(wortlist_file):
+    """Sorted tuple of burned words for a story, shared between callers; use random.sample() to pick from it."""
+    files = story_wortlist_files(wortlist_file)
+    parts = [get_file_burned_words(path) for path in files]
+    if len(parts) == 1:
+        return parts[0][1]
+    # Merged level lists are cached against the versions of the files they were built from
+    key = tuple(files)
+    versions = tuple(version for version, _ in parts)
+    with burned_word_indexes_lock:
+        merged = burned_word_merges.get(key)
+        if merged is not None and merged['versions'] == versions:
+            return merged['words']
+    words = tuple(sorted(set().union(*(part_words for _, part_words in parts))))
+    with burned_word_indexes_lock:
+        burned_word_merges[key] = {'versions': versions, 'words': words}
+    # No shuffling: a stable order keeps the story prompt prefix cacheable
+    return words
+
+
+
+def create_response(messages, model="gpt-5-nano", max_tokens=2000, reasoning_effort="minimal", verbosity=None, previous_response_id=None,
+                    prompt_cache_key=None, feature=None, text_format=None, on_text_delta=None):
+    """Call the Responses API through the gateway and return the raw response so callers can read usage and id.
+    With on_text_delta the response is streamed and each output_text delta is passed to it as it arrives.
+    """
+    return llm.create(messages, model=model, max_tokens=max_tokens, reasoning_effort=reasoning_effort, verbosity=verbosity,
+                      previous_response_id=previous_response_id, prompt_cache_key=prompt_cache_key, feature=feature,
+                      text_format=text_format, on_text_delta=on_text_delta)
 
+conversation = ConversationHistory(llm, create_response)
 
+def create_routed_response(messages, task, **create_args):
+    """Call the Responses API with the model and effort chosen by MODEL_ROUTES[task], hedging slow calls."""
+    return llm.create_routed(messages, task, **create_args)
 
-def get_completion_from_messages(messages, model="gpt-5-nano", max_tokens=2000, reasoning_effort="minimal", verbosity=None):
-    """
-    messages: [{'role':'system','content':'...'}, {'role':'user','content':'...'}, ...]
-    reasoning_effort: "low", "medium", or "high"
+class StreamingJsonObjectParser:
+    """Incremental parser for a flat JSON object with string values, e.g. {"Wort": "Satz", ...}.
+    feed() takes the next chunk of text and returns the (key, value) pairs it completed. Text before
+    the opening brace (a code fence or a leading 'json') is skipped; parsing stops at the closing brace
+    or at anything that is not a string pair, leaving the rest to a full json.loads of the final text.
     """
-    create_args = {
-        "model": model,
-        "input": messages,
-        "reasoning": {"effort": reasoning_effort},
-    }
-    if max_tokens is not None:
-        create_args["max_output_tokens"] = max_tokens
-    if verbosity is not None:
-        create_args["text"] = {"verbosity": verbosity}
-    resp = client.responses.create(**create_args)
-
-    return resp.output_text
+    def __init__(self):
+        self.buffer = ''
+        self.position = 0
+        self.state = 'start'  # start -> key -> colon -> value -> next -> key ... -> end
+        self.key = None
+
+    def _string_end(self, start):
+        """Index of the closing quote of the string starting at start, or None if it has not arrived yet."""
+        index = start
+        while True:
+            index = self.buffer.find('"', index)
+            if index == -1:
+                return None
+            backslashes = 0
+            while self.buffer[index - 1 - backslashes] == '\\':
+                backslashes += 1
+            if backslashes % 2 == 0:
+                return index
+            index += 1
+
+    def feed(self, text):
+        self.buffer += text
+        pairs = []
+        while self.position < len(self.buffer) and self.state != 'end':
+            character = self.buffer[self.position]
+            if character == '"' and self.state in ('key', 'value'):
+                end = self._string_end(self.position + 1)
+                if end is None:
+                    break
+                try:
+                    value = json.loads(self.buffer[self.position:end + 1])
+                except ValueError:
+                    self.state = 'end'
+                    break
+                self.position = end + 1
+                if self.state == 'key':
+                    self.key, self.state = value, 'colon'
+                else:
+                    pairs.append((self.key, value))
+                    self.state = 'next'
+                continue
+            if self.state == 'start' and character == '{':
+                self.state = 'key'
+            elif self.state == 'colon' and character == ':':
+                self.state = 'value'
+            elif self.state == 'next' and character == ',':
+                self.state = 'key'
+            elif self.state != 'start' and not character.isspace():
+                # Closing brace, or a value that is not a string
+                self.state = 'end'
+            self.position += 1
+        self.buffer = self.buffer[self.position:]
+        self.position = 0
+        return pairs
+
+def wait_for_anki_sentence(session_key, wort, timeout=ANKI_SENTENCE_WAIT_SECONDS):
+    """Block until wort's sentence has been streamed in or the sentences job has ended; returns the job."""
+    wort = unicodedata.normalize('NFC', wort or '')
+    deadline = time.monotonic() + timeout
+    with anki_sentences_changed:
+        while True:
+            job = anki_sentences_jobs.get(session_key)
+            if not job or job['status'] != 'in_progress' or wort in job['sentences']:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            anki_sentences_changed.wait(remaining)
 
 def get_selected_level():
     """Return 'A1' or 'A2' based on the user's wortlist choice."""
-    file_path = get_current_wortlist_file()
-    return 'A2' if file_path == 'A2Wortlist.csv' else 'A1'
+    return wortlist_level(get_current_wortlist_file())
 
 def _get_session_id():
     try:
         return session.sid
     except Exception:
-        # Fallback if Flask-Session sid is unavailable
-        return request.cookies.get(app.session_cookie_name, "unknown")
+        # Fallback if the session has no server-side sid
+        return request.cookies.get(app.config['SESSION_COOKIE_NAME'], "unknown")
 
-def _anki_job_key(card_number: int, wort: str = None):
-    base = f"{_get_session_id()}:{card_number}"
+def _anki_job_key(card_number: int, wort: str = None, session_id: str = None):
+    base = f"{session_id or _get_session_id()}:{card_number}"
     if wort:
         try:
             w = unicodedata.normalize('NFC', str(wort)).lower()
@@ -188,14 +534,14 @@ def _anki_job_key(card_number: int, wort: str = None):
 
 ## Removed JSON parse fallback for sentence resolution; rely on session['anki_sentence']
 
-def _start_anki_prefetch(card_number: int, wort: str, german_sentence: str):
+def _start_anki_prefetch(card_number: int, wort: str, german_sentence: str, session_id: str = None):
     """Start background tasks to fetch: (1) one-word translation, (2) English sentence translation.
     Stores progress/results in anki_translation_jobs.
     """
     if card_number is None or not wort:
         return False
 
-    key = _anki_job_key(card_number, wort)
+    key = _anki_job_key(card_number, wort, session_id)
     # If an existing job for this card exists and is in progress or done, don't restart
     existing = anki_translation_jobs.get(key)
     if existing:
@@ -224,7 +570,7 @@ def _start_anki_prefetch(card_number: int, wort: str, german_sentence: str):
                 {'role': 'user', 'content': f'One Word English translation for: {wort}'},
             ]
             # Remove max_output_tokens (use model default) and set verbosity low for concise output
-            resp = get_completion_from_messages(messages, model="gpt-5-nano", max_tokens=None, verbosity="low")
+            resp = llm.complete(messages, task='anki_word_translation', max_tokens=None, verbosity="low")
             anki_translation_jobs[key]['word_translation'] = resp.strip()
             anki_translation_jobs[key]['word_status'] = 'done'
         except Exception as e:
@@ -245,106 +591,671 @@ def _start_anki_prefetch(card_number: int, wort: str, german_sentence: str):
             anki_translation_jobs[key]['sentence_status'] = 'error'
 
     # Run in background threads
-    Thread(target=compute_word, daemon=True).start()
-    Thread(target=compute_sentence, daemon=True).start()
+    start_background_thread(compute_word)
+    start_background_thread(compute_sentence)
     return True
 
-## Removed: Assistants API helpers (migrated to Responses API)
-
+def prefetch_deck_translations(session_id, card_words, anki_sentences, level=None, banked=None):
+    """Translate every card's word and German sentence with one structured call.
+    Cards served from the sentence bank with known translations ({word: (sentence, word_translation,
+    sentence_translation)}) need no call; new translations are banked for the given level.
+    Cards missing from the reply (or all of them, if the call fails) use the per-card prefetch instead.
+    """
+    banked = banked or {}
+    try:
+        sentences_data = json.loads(anki_sentences)
+    except json.JSONDecodeError:
+        return
+    if not isinstance(sentences_data, dict):
+        return
+    sentences_data = {unicodedata.normalize('NFC', k): v for k, v in sentences_data.items()}
+
+    cards = []
+    for number, wort in enumerate(card_words, start=1):
+        german_sentence = sentences_data.get(unicodedata.normalize('NFC', wort))
+        key = _anki_job_key(number, wort, session_id)
+        # Leave cards alone whose per-card prefetch has already started
+        if not isinstance(german_sentence, str) or not german_sentence or key in anki_translation_jobs:
+            continue
+        banked_sentence, word_translation, sentence_translation = banked.get(wort, (None, '', ''))
+        if banked_sentence == german_sentence and word_translation and sentence_translation:
+            anki_translation_jobs[key] = {
+                'word': wort,
+                'german_sentence': german_sentence,
+                'word_translation': word_translation,
+                'word_status': 'done',
+                'sentence_translation': sentence_translation,
+                'sentence_status': 'done',
+                'source': 'bank',
+                'created_at': datetime.utcnow().isoformat()
+            }
+            continue
+        anki_translation_jobs[key] = {
+            'word': wort,
+            'german_sentence': german_sentence,
+            'word_translation': None,
+            'word_status': 'in_progress',
+            'sentence_translation': None,
+            'sentence_status': 'in_progress',
+            'source': 'deck',
+            'created_at': datetime.utcnow().isoformat()
+        }
+        cards.append((number, wort, german_sentence, key))
+    if not cards:
+        return
 
-def chooseSelectedWords():
-    # Go through the file
-    # Add 10 words with today's date or earlier to selected words as array: [word, line number in wortLines]
-    # Also in the case that 10 words are not found, keep an array of [word,line number] that do not have reviewData
-    # Then check for the number of not found words,
-    # and choose that number from the array in random and add to the selected words array
+    card_lines = '\n'.join(f"- {wort}: {german_sentence}" for _, wort, german_sentence, _ in cards)
+    messages = [
+        {'role': 'system', 'content': 'You are a helpful language teacher. Translate German vocabulary cards to English.'},
+        {'role': 'user', 'content': f"For each of these words: {', '.join(wort for _, wort, _, _ in cards)}.\n"
+                                    f"Give a single English word translation of the word and an English translation of its sentence.\n"
+                                    f"{card_lines}"},
+    ]
+    results = {}
+    try:
+        resp = create_routed_response(messages, 'anki_deck_translation', max_tokens=None, verbosity='low',
+                                      text_format=ANKI_DECK_TRANSLATION_FORMAT)
+        for item in json.loads(response_output_text(resp)).get('cards', []):
+            results[unicodedata.normalize('NFC', str(item.get('word', ''))).lower()] = item
+    except Exception as e:
+        print(f"Deck translation failed, falling back to per-card translations: {e}")
 
-    # Format [Word, LineNumber, ReviewFrequency, ReviewDateString]
-    selected_words_lineNumber = []
+    translated = []
+    for number, wort, german_sentence, key in cards:
+        item = results.get(unicodedata.normalize('NFC', wort).lower())
+        if item and item.get('word_translation') and item.get('sentence_translation'):
+            anki_translation_jobs[key]['word_translation'] = item['word_translation'].strip()
+            anki_translation_jobs[key]['word_status'] = 'done'
+            anki_translation_jobs[key]['sentence_translation'] = item['sentence_translation'].strip()
+            anki_translation_jobs[key]['sentence_status'] = 'done'
+            translated.append((wort, german_sentence, item['word_translation'].strip(), item['sentence_translation'].strip()))
+        else:
+            anki_translation_jobs.pop(key, None)
+            _start_anki_prefetch(number, wort, german_sentence, session_id)
+    if level and translated:
+        try:
+            bank_sentence_translations(level, translated)
+        except sqlite3.Error as e:
+            print(f"Could not bank deck translations: {e}")
 
+## Removed: Assistants API helpers (migrated to Responses API)
 
-    not_reviewed_words = []
-    number_burned = 0
-    number_week = 0
-    number_month = 0
-    number_3_month = 0
-    number_pending = 0
-    number_tomorrow = 0
-    total_lines = 0
 
-    file_path = get_current_wortlist_file()
+def srs_db():
+    """Per-thread SQLite connection to the wortlist SRS store, creating the schema on first use."""
+    connection = getattr(srs_db_local, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(SRS_DB_PATH, timeout=5)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        srs_db_local.connection = connection
+    if not srs_db_state['ready']:
+        with srs_db_lock:
+            if not srs_db_state['ready']:
+                init_srs_db(connection)
+                srs_db_state['ready'] = True
+    return connection
+
+def init_srs_db(connection):
+    # line is the word's line number in the CSV (the header is line 0) and doubles as file order.
+    # wortlists.version is bumped by every import and review write so cached columns can tell they are stale.
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS wortlists (
+            name TEXT PRIMARY KEY,
+            header TEXT NOT NULL,
+            csv_stamp TEXT,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS words (
+            wortlist TEXT NOT NULL,
+            line INTEGER NOT NULL,
+            word TEXT NOT NULL,
+            frequency TEXT NOT NULL,
+            review_date TEXT NOT NULL,
+            PRIMARY KEY (wortlist, line)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_words_due ON words (wortlist, review_date, line, word, frequency)
+            WHERE frequency != 'B' AND review_date != '';
+        CREATE INDEX IF NOT EXISTS idx_words_unreviewed ON words (wortlist, review_date, line, word, frequency)
+            WHERE review_date = '';
+        CREATE TABLE IF NOT EXISTS sentence_bank (
+            word_key TEXT NOT NULL,
+            level TEXT NOT NULL,
+            sentence TEXT NOT NULL,
+            word_translation TEXT NOT NULL DEFAULT '',
+            sentence_translation TEXT NOT NULL DEFAULT '',
+            created_at REAL NOT NULL,
+            last_served_at REAL NOT NULL DEFAULT 0,
+            served_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (word_key, level, sentence)
+        ) WITHOUT ROWID;
+    """)
+    if 'version' not in {row[1] for row in connection.execute('PRAGMA table_info(wortlists)')}:
+        connection.execute('ALTER TABLE wortlists ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+
+def wortlist_file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+@traced('file')
+def import_wortlist_csv(connection, wortlist_file, stamp):
+    """Replace the stored rows of a wortlist with the contents of its CSV (Wort,Frequency,ReviewDate)."""
+    with open(wortlist_file, 'r') as file:
+        lines = file.read().splitlines()
+    rows = []
+    for lineNumber, line in enumerate(lines[1:], start=1):
+        lineElements = line.strip().split(',')
+        if not lineElements[0]:
+            continue
+        lineElements += [''] * (3 - len(lineElements))
+        rows.append((wortlist_file, lineNumber, lineElements[0], lineElements[1], lineElements[2]))
+    with connection:
+        connection.execute('DELETE FROM words WHERE wortlist = ?', (wortlist_file,))
+        connection.executemany('INSERT INTO words (wortlist, line, word, frequency, review_date) VALUES (?, ?, ?, ?, ?)', rows)
+        connection.execute('INSERT INTO wortlists (name, header, csv_stamp) VALUES (?, ?, ?) '
+                           'ON CONFLICT(name) DO UPDATE SET header = excluded.header, csv_stamp = excluded.csv_stamp, '
+                           'version = version + 1',
+                           (wortlist_file, lines[0] if lines else 'Wort,Frequency,ReviewDate', stamp))
+    with wortlist_columns_lock:
+        wortlist_columns.pop(wortlist_file, None)
+
+def ensure_wortlist_loaded(wortlist_file):
+    """SRS connection with the wortlist imported, re-importing it if the CSV changed outside the app."""
+    connection = srs_db()
+    stamp = wortlist_file_stamp(wortlist_file)
+    row = connection.execute('SELECT csv_stamp FROM wortlists WHERE name = ?', (wortlist_file,)).fetchone()
+    if row is None or (stamp is not None and row[0] != stamp) or wortlist_file not in srs_db_state['replayed']:
+        # The journal lock keeps other workers' review writes and compactions out until the replay is done,
+        # so an older journalled review cannot be re-applied over a newer one
+        with srs_db_lock, wortlist_file_lock(wortlist_file):
+            row = connection.execute('SELECT csv_stamp FROM wortlists WHERE name = ?', (wortlist_file,)).fetchone()
+            stamp = wortlist_file_stamp(wortlist_file)
+            if row is None or (stamp is not None and row[0] != stamp):
+                import_wortlist_csv(connection, wortlist_file, stamp)
+            elif wortlist_file in srs_db_state['replayed']:
+                return connection
+            # Journalled reviews are newer than the CSV, and may be missing from the store after a crash
+            srs_db_state['replayed'].add(wortlist_file)
+            if replay_review_journals(connection, wortlist_file):
+                schedule_wortlist_compaction(wortlist_file)
+    return connection
+
+def review_journal_paths(wortlist_file):
+    # (journal being compacted, live journal), oldest first
+    return f"{wortlist_file}.journal.compacting", f"{wortlist_file}.journal"
+
+@contextmanager
+def wortlist_file_lock(wortlist_file, purpose='journal'):
+    """Exclusive flock shared by all threads and worker processes using this wortlist."""
+    with open(f"{wortlist_file}.{purpose}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def apply_review_updates(connection, wortlist_file, updates):
+    # Rows are matched on line and word, so a CSV re-imported mid-session cannot update the wrong word
+    with connection:
+        connection.executemany(
+            'UPDATE words SET frequency = ?, review_date = ? WHERE wortlist = ? AND line = ? AND word = ?',
+            [(frequency, reviewDate, wortlist_file, lineNumber, word) for word, lineNumber, frequency, reviewDate in updates])
+        connection.execute('UPDATE wortlists SET version = version + 1 WHERE name = ?', (wortlist_file,))
+        version = connection.execute('SELECT version FROM wortlists WHERE name = ?', (wortlist_file,)).fetchone()[0]
+    update_wortlist_columns(wortlist_file, version, updates)
+
+def replay_review_journals(connection, wortlist_file):
+    """Re-apply journalled reviews in order (idempotent: they set absolute values); returns the number of entries.
+
+    Callers hold wortlist_file_lock, so no review is appended while the journals are replayed.
+    """
+    entries = 0
+    for path in review_journal_paths(wortlist_file):
+        try:
+            with open(path, 'r') as journal:
+                lines = journal.readlines()
+        except FileNotFoundError:
+            continue
+        for line in lines:
+            try:
+                updates = json.loads(line)['updates']
+            except (ValueError, KeyError):
+                continue  # torn final line from a crash mid-append
+            apply_review_updates(connection, wortlist_file, updates)
+            entries += 1
+    return entries
+
+@traced('file')
+def record_review_results(wortlist_file, updates):
+    """Durably record a finished deck: one fsynced journal append plus an O(updates) store update."""
+    connection = ensure_wortlist_loaded(wortlist_file)
+    entry = json.dumps({'ts': time.time(), 'updates': updates}, ensure_ascii=False)
+    with wortlist_file_lock(wortlist_file):
+        with open(review_journal_paths(wortlist_file)[1], 'a') as journal:
+            journal.write(entry + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        apply_review_updates(connection, wortlist_file, updates)
+    schedule_wortlist_compaction(wortlist_file)
+
+def schedule_wortlist_compaction(wortlist_file):
+    # At most one compaction per wortlist runs at a time; saves during a run trigger one more run
+    with wortlist_compactions_lock:
+        state = wortlist_compactions.setdefault(wortlist_file, {'running': False, 'dirty': False})
+        if state['running']:
+            state['dirty'] = True
+            return
+        state['running'] = True
+        state['dirty'] = False
+    start_background_thread(_run_wortlist_compaction, (wortlist_file,))
+
+def _run_wortlist_compaction(wortlist_file):
+    while True:
+        try:
+            compact_wortlist(wortlist_file)
+        except Exception as e:
+            print(f"Compacting {wortlist_file} failed: {e}")
+        with wortlist_compactions_lock:
+            state = wortlist_compactions[wortlist_file]
+            if not state['dirty']:
+                state['running'] = False
+                return
+            state['dirty'] = False
+
+def patch_wortlist_lines(lines, stored):
+    """Write the stored Frequency and ReviewDate into the CSV lines whose (line, word) match; returns the count.
+
+    Every other line (header, blank lines, words the store does not know) and any extra columns are left as
+    they are, so line numbers, and the journal entries keyed on them, stay valid.
+    """
+    patched = 0
+    for lineNumber, line in enumerate(lines[1:], start=1):
+        row = stored.get(lineNumber)
+        lineElements = line.strip().split(',')
+        if row is None or lineElements[0] != row[0]:
+            continue
+        lineElements += [''] * (3 - len(lineElements))
+        if lineElements[1:3] != list(row[1:]):
+            lineElements[1:3] = row[1:]
+            lines[lineNumber] = ','.join(lineElements)
+            patched += 1
+    return patched
+
+@traced('file')
+def compact_wortlist(wortlist_file):
+    """Patch the store's review columns into the CSV (temp file, fsync, rename), then drop the journal it now covers."""
+    compacting_path, journal_path = review_journal_paths(wortlist_file)
+    with wortlist_file_lock(wortlist_file, 'compact'):
+        # Rotate under the journal lock: every rotated entry has already been applied to the store
+        with wortlist_file_lock(wortlist_file):
+            if os.path.exists(journal_path) and not os.path.exists(compacting_path):
+                os.replace(journal_path, compacting_path)
+        connection = srs_db()
+        stored = {line: (word, frequency, review_date) for line, word, frequency, review_date in connection.execute(
+            'SELECT line, word, frequency, review_date FROM words WHERE wortlist = ?', (wortlist_file,))}
+        with open(wortlist_file, 'r') as file:
+            lines = file.read().splitlines()
+        if patch_wortlist_lines(lines, stored):
+            tmp_path = f"{wortlist_file}.tmp"
+            with open(tmp_path, 'w') as file:
+                file.writelines(line + "\n" for line in lines)
+                file.flush()
+                os.fsync(file.fileno())
+            # Under the journal lock, so no worker sees the new file before its stamp (and re-imports it)
+            with wortlist_file_lock(wortlist_file):
+                os.replace(tmp_path, wortlist_file)
+                with connection:
+                    connection.execute('UPDATE wortlists SET csv_stamp = ? WHERE name = ?',
+                                       (wortlist_file_stamp(wortlist_file), wortlist_file))
+        try:
+            os.remove(compacting_path)
+        except FileNotFoundError:
+            pass
+
+def review_day_numbers(review_dates):
+    import numpy as np
+    days = np.array(review_dates, dtype='datetime64[D]')
+    return np.where(np.isnat(days), -1, days.astype(np.int64)).astype(np.int32)
+
+@traced('db')
+def get_wortlist_columns(connection, wortlist_file):
+    """Cached columns for a wortlist, rebuilt from the store only when its version has moved on."""
+    import numpy as np
+    version = connection.execute('SELECT version FROM wortlists WHERE name = ?', (wortlist_file,)).fetchone()[0]
+    with wortlist_columns_lock:
+        columns = wortlist_columns.get(wortlist_file)
+        if columns is not None and columns['version'] == version:
+            return columns
+    rows = connection.execute('SELECT line, word, frequency, review_date FROM words WHERE wortlist = ? ORDER BY line',
+                              (wortlist_file,)).fetchall()
+    lines = np.array([row[0] for row in rows], dtype=np.int32)
+    columns = {
+        'version': version,
+        'words': [row[1] for row in rows],
+        'lines': lines,
+        'frequency': np.array([FREQUENCY_CODES.get(row[2], 0) for row in rows], dtype=np.int8),
+        'review_day': review_day_numbers([row[3] or 'NaT' for row in rows]),
+        'position': {line: position for position, line in enumerate(lines.tolist())},
+    }
+    with wortlist_columns_lock:
+        wortlist_columns[wortlist_file] = columns
+    return columns
+
+def update_wortlist_columns(wortlist_file, version, updates):
+    # In place when the cached columns are exactly one write behind, otherwise dropped and rebuilt on next use
+    with wortlist_columns_lock:
+        columns = wortlist_columns.get(wortlist_file)
+        if columns is None:
+            return
+        if columns['version'] != version - 1:
+            wortlist_columns.pop(wortlist_file, None)
+            return
+        positions = [columns['position'].get(lineNumber) for word, lineNumber, frequency, reviewDate in updates]
+        for position, (word, lineNumber, frequency, reviewDate) in zip(positions, updates):
+            if position is not None and columns['words'][position] == word:
+                columns['frequency'][position] = FREQUENCY_CODES.get(frequency, 0)
+                columns['review_day'][position] = review_day_numbers([reviewDate or 'NaT'])[0]
+        columns['version'] = version
+
+def wortlist_stats(columns, today):
+    """Bucket counts and the per-day review load for the next REVIEW_FORECAST_DAYS days in one vectorised pass."""
+    import numpy as np
+    pending_code = len(FREQUENCY_CODES) + 1
+    today_day = review_day_numbers([today])[0]
+    with wortlist_columns_lock:
+        review_day = columns['review_day']
+        # One histogram over (days from today, bucket); overdue words land on day 0 as they are due today
+        key = np.clip(review_day - today_day, 0, REVIEW_FORECAST_DAYS).astype(np.intp)
+        key *= pending_code + 1
+        key += np.where(review_day >= 0, columns['frequency'], pending_code)
+    histogram = np.bincount(key, minlength=(REVIEW_FORECAST_DAYS + 1) * (pending_code + 1))
+    histogram = histogram.reshape(REVIEW_FORECAST_DAYS + 1, pending_code + 1)
+    counts = histogram.sum(axis=0)
+    forecast = histogram[:REVIEW_FORECAST_DAYS, :FREQUENCY_CODES['B']].sum(axis=1)
+    stats = {name: int(counts[code]) for name, code in FREQUENCY_CODES.items()}
+    stats['pending'] = int(counts[pending_code])
+    stats['forecast'] = forecast.tolist()
+    return stats
+
+def sentence_bank_key(word):
+    return unicodedata.normalize('NFC', word).strip().casefold()
+
+def _fold_umlauts(text):
+    return ''.join(c for c in unicodedata.normalize('NFD', text.casefold()) if not unicodedata.combining(c))
+
+def is_valid_bank_sentence(word, sentence):
+    """Cheap check before banking a generated sentence: short, non-empty and mentioning the word's stem."""
+    if not isinstance(sentence, str) or not sentence.strip() or len(sentence) > SENTENCE_BANK_MAX_CHARS:
+        return False
+    # The longest token skips an article ('der Apfel'); three letters still match most inflected forms
+    stem = max(re.findall(r'\w+', _fold_umlauts(word)), key=len, default='')[:3]
+    return bool(stem) and stem in _fold_umlauts(sentence)
 
-    with open(file_path, 'r') as file:
-        # num_lines = sum(1 for line in file)
-        # print(f"num_lines: {num_lines}")
-        for lineNumber, line in enumerate(file, start=0):
-            line = line.strip()
-            lineElements = line.split(',')
-            if lineNumber >= 1:
-                word = lineElements[0]
-                reviewFrequency = lineElements[1]
-                reviewDateString = lineElements[2]
-
-                if reviewDateString == "":
-                    not_reviewed_words.append([word, lineNumber, reviewFrequency, reviewDateString])
-                    number_pending = number_pending + 1
-                elif reviewFrequency != "B":
-                    reviewDateObject = datetime.strptime(reviewDateString, "%Y-%m-%d").date()
-                    today = datetime.now().date()
-                    if reviewDateObject <= today and len(selected_words_lineNumber) < 10:
-                        selected_words_lineNumber.append([word, lineNumber, reviewFrequency, reviewDateString])
-
-                    if reviewFrequency == "W":
-                        number_week = number_week + 1
-                    elif reviewFrequency == "M":
-                        number_month = number_month + 1
-                    elif reviewFrequency == "3M":
-                        number_3_month = number_3_month + 1
-                    elif reviewFrequency == "T":
-                        number_tomorrow = number_tomorrow + 1
-
-                elif reviewFrequency == "B":
-                    number_burned = number_burned + 1
-                total_lines = total_lines + 1
-
-    # print("Number of selected words using reviewDate:", len(selected_words_lineNumber))
-
-    # Check if selected_words has 10 orders or add random words to it
-    num_selected_words = len(selected_words_lineNumber)
-    if num_selected_words < 10:
-        num_missing = 10 - num_selected_words
-        if num_missing <= len(not_reviewed_words):
-            random_word_indices = random.sample(range(0, len(not_reviewed_words)), num_missing)
-        else:
-            random_word_indices = random.sample(range(0, len(not_reviewed_words)), len(not_reviewed_words))
-        for random_index in random_word_indices:
-            selected_words_lineNumber.append(not_reviewed_words[random_index])
+def choose_banked_sentence(connection, key, level, now):
+    """The (sentence, word_translation, sentence_translation) to serve at time now and the lookup outcome:
+    'hit', 'miss' (no fresh sentence) or 'refresh' (the only ones were served too recently).
+    """
+    rows = connection.execute(
+        "SELECT sentence, word_translation, sentence_translation, last_served_at FROM sentence_bank "
+        "WHERE word_key = ? AND level = ? AND created_at >= ? ORDER BY last_served_at, created_at",
+        (key, level, now - SENTENCE_BANK_MAX_AGE_DAYS * 86400)).fetchall()
+    if not rows:
+        return None, 'miss'
+    if len(rows) < SENTENCE_BANK_SIZE and rows[0][3] > now - SENTENCE_BANK_REUSE_AFTER_DAYS * 86400:
+        return None, 'refresh'
+    return rows[0][:3], 'hit'
+
+def take_banked_sentences(words, level):
+    """Serve one banked sentence per word, rotating to the least recently served fresh one.
+    Returns {word: (sentence, word_translation, sentence_translation)} for the words that need no new sentence.
+    """
+    connection = srs_db()
+    now = time.time()
+    banked = {}
+    with connection:
+        for word in words:
+            key = sentence_bank_key(word)
+            choice, outcome = choose_banked_sentence(connection, key, level, now)
+            if choice is None:
+                increment_counter('anki_sentence_bank_lookups_total', level=level, outcome=outcome)
+                continue
+            sentence, word_translation, sentence_translation = choice
+            connection.execute(
+                "UPDATE sentence_bank SET last_served_at = ?, served_count = served_count + 1 "
+                "WHERE word_key = ? AND level = ? AND sentence = ?", (now, key, level, sentence))
+            banked[word] = (sentence, word_translation, sentence_translation)
+            increment_counter('anki_sentence_bank_lookups_total', level=level, outcome='hit')
+    return banked
+
+def bank_sentences(level, sentences, served=True):
+    """Bank newly generated sentences, {word: sentence}, keeping the newest per word.
+    served=False banks pre-generated sentences that have not been shown yet. Returns the words banked.
+    """
+    connection = srs_db()
+    now = time.time()
+    fresh_since = now - SENTENCE_BANK_MAX_AGE_DAYS * 86400
+    banked = []
+    with connection:
+        for word, sentence in sentences.items():
+            if not is_valid_bank_sentence(word, sentence):
+                increment_counter('anki_sentence_bank_rejected_total', level=level)
+                continue
+            key = sentence_bank_key(word)
+            connection.execute(
+                "INSERT INTO sentence_bank (word_key, level, sentence, created_at, last_served_at, served_count) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT DO UPDATE SET last_served_at = excluded.last_served_at, "
+                "served_count = served_count + excluded.served_count",
+                (key, level, sentence.strip(), now, now if served else 0, int(served)))
+            banked.append(word)
+            connection.execute(
+                "DELETE FROM sentence_bank WHERE word_key = ? AND level = ? AND (created_at < ? OR sentence NOT IN "
+                "(SELECT sentence FROM sentence_bank WHERE word_key = ? AND level = ? ORDER BY created_at DESC LIMIT ?))",
+                (key, level, fresh_since, key, level, SENTENCE_BANK_SIZE))
+    return banked
+
+def bank_sentence_translations(level, translations):
+    """Attach translations to banked sentences; translations holds (word, sentence, word_translation, sentence_translation)."""
+    with srs_db() as connection:
+        connection.executemany(
+            "UPDATE sentence_bank SET word_translation = ?, sentence_translation = ? "
+            "WHERE word_key = ? AND level = ? AND sentence = ?",
+            [(word_translation, sentence_translation, sentence_bank_key(word), level, sentence.strip())
+             for word, sentence, word_translation, sentence_translation in translations])
+
+def sentence_bank_sizes():
+    return dict(srs_db().execute("SELECT level, COUNT(*) FROM sentence_bank GROUP BY level").fetchall())
+
+def wortlist_level(wortlist_file):
+    return 'A2' if wortlist_file == 'A2Wortlist.csv' else 'A1'
+
+def upcoming_cards_without_material(wortlist_file, days):
+    """Words due within the next days days whose review would not be served complete from the sentence bank."""
+    connection = ensure_wortlist_loaded(wortlist_file)
+    level = wortlist_level(wortlist_file)
+    today = datetime.now().date()
+    rows = connection.execute(
+        "SELECT word, review_date FROM words WHERE wortlist = ? AND frequency != 'B' AND review_date != '' "
+        "AND review_date <= ? ORDER BY review_date, line",
+        (wortlist_file, (today + timedelta(days=days)).strftime("%Y-%m-%d"))).fetchall()
+    words = []
+    for word, review_date in rows:
+        try:
+            due_at = max(time.time(), datetime.strptime(review_date, "%Y-%m-%d").timestamp())
+        except ValueError:
+            due_at = time.time()
+        choice, _ = choose_banked_sentence(connection, sentence_bank_key(word), level, due_at)
+        if choice is None or not choice[1] or not choice[2]:
+            words.append(word)
+    return list(dict.fromkeys(words))
+
+def pregenerate_cards(level, words):
+    """One structured request for the sentences and translations of a batch of words; banks them unserved.
+    Returns the words that were banked.
+    """
+    prompt = f"""
+        You are creating example sentences for vocabulary review at level {level}.
+        1) For each of these words, write exactly one simple, natural German sentence: {', '.join(words)}.
+        2) Constraint: Use only nouns, verbs and adjectives that are part of the Goethe-Zertifikat {level} vocabulary list. Do not use any noun or verb that is outside this list.
+           Function words (articles, pronouns, prepositions, conjunctions) are allowed as needed.
+        3) Keep grammar and vocabulary appropriate for level {level}.
+        4) For each word also give a single English word translation of the word and an English translation of its sentence.
+    """
+    messages = [
+        {'role': 'system', 'content': 'You are a helpful language teacher.'},
+        {'role': 'user', 'content': prompt}
+    ]
+    resp = create_routed_response(messages, 'pregenerate', max_tokens=None, text_format=PREGENERATED_CARDS_FORMAT)
+    cards = {}
+    for item in json.loads(response_output_text(resp)).get('cards', []):
+        cards[sentence_bank_key(str(item.get('word', '')))] = item
+    sentences = {}
+    translations = []
+    for word in words:
+        item = cards.get(sentence_bank_key(word))
+        if not item or not item.get('word_translation') or not item.get('sentence_translation'):
+            continue
+        sentences[word] = item.get('sentence')
+        translations.append((word, item.get('sentence', ''), item['word_translation'].strip(),
+                             item['sentence_translation'].strip()))
+    banked = bank_sentences(level, sentences, served=False)
+    bank_sentence_translations(level, [translation for translation in translations if translation[0] in banked])
+    return banked
+
+def load_pregenerate_progress(path, run_key):
+    try:
+        with open(path, encoding='utf-8') as handle:
+            progress = json.load(handle)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return set()
+    return set(progress.get('done', [])) if progress.get('run') == run_key else set()
+
+def save_pregenerate_progress(path, run_key, done):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as handle:
+        json.dump({'run': run_key, 'done': sorted(done)}, handle, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+@app.cli.command('pregenerate')
+@click.option('--days', default=7, show_default=True, help='Pre-generate for words due within this many days.')
+@click.option('--wortlist', 'wortlist_files', multiple=True, help='Wortlist CSV to cover (repeatable). Default: A1 and A2.')
+@click.option('--batch-size', default=20, show_default=True, help='Words per model request.')
+@click.option('--concurrency', default=3, show_default=True, help='Model requests in flight at once.')
+@click.option('--progress-file', default=PREGENERATE_PROGRESS_PATH, show_default=True)
+@click.option('--restart', is_flag=True, help='Ignore the progress of an earlier, interrupted run.')
+def pregenerate_command(days, wortlist_files, batch_size, concurrency, progress_file, restart):
+    """Pre-generate sentences and translations for the words due in the next DAYS days.
+
+    Meant to run off-peak, e.g. from cron: 0 4 * * * cd /srv/germanfriend && flask --app german_app pregenerate
+    """
+    wortlist_files = wortlist_files or (DEFAULT_WORTLIST_FILE, 'A2Wortlist.csv')
+    run_key = f"{datetime.now().date()}:{days}:{','.join(wortlist_files)}"
+    done = set() if restart else load_pregenerate_progress(progress_file, run_key)
+    batches = []
+    for wortlist_file in wortlist_files:
+        if not os.path.exists(wortlist_file):
+            click.echo(f"Skipping {wortlist_file}: file not found.")
+            continue
+        level = wortlist_level(wortlist_file)
+        words = [word for word in upcoming_cards_without_material(wortlist_file, days) if f"{level}:{word}" not in done]
+        click.echo(f"{wortlist_file}: {len(words)} due words need material.")
+        batches.extend((level, words[start:start + batch_size]) for start in range(0, len(words), batch_size))
+
+    banked_total = 0
+    failed_batches = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='pregenerate') as executor:
+        futures = {executor.submit(pregenerate_cards, level, words): (level, words) for level, words in batches}
+        for future in as_completed(futures):
+            level, words = futures[future]
+            try:
+                banked = future.result()
+            except Exception as e:
+                failed_batches += 1
+                click.echo(f"Batch of {len(words)} {level} words failed: {e}")
+                continue
+            banked_total += len(banked)
+            # Words the model skipped or got wrong count as done too, so a rerun does not retry them forever
+            done.update(f"{level}:{word}" for word in words)
+            save_pregenerate_progress(progress_file, run_key, done)
+    click.echo(f"Banked {banked_total} new sentences in {len(batches) - failed_batches}/{len(batches)} batches.")
+    if failed_batches:
+        sys.exit(1)
+
+@traced('db')
+def chooseSelectedWords():
+    # Up to 10 words whose review date is today or earlier (not burned), most overdue first.
+    # If fewer than 10 are due, the rest are sampled at random from words that have never been reviewed.
 
-    # print("Number of selected words after adding random:", len(selected_words_lineNumber))
+    # Format [Word, LineNumber, ReviewFrequency, ReviewDateString]
+    file_path = get_current_wortlist_file()
+    connection = ensure_wortlist_loaded(file_path)
+    today = datetime.now().date().strftime("%Y-%m-%d")
+
+    selected_words_lineNumber = [list(row) for row in connection.execute(
+        "SELECT word, line, frequency, review_date FROM words "
+        "WHERE wortlist = ? AND frequency != 'B' AND review_date != '' AND review_date <= ? "
+        "ORDER BY review_date, line LIMIT ?", (file_path, today, SRS_CARDS_PER_SESSION))]
+
+    columns = get_wortlist_columns(connection, file_path)
+    stats = wortlist_stats(columns, today)
+    number_pending = stats['pending']
+
+    # Fill up with a uniform sample of the unreviewed words: the cached columns give their line numbers as a
+    # dense list to sample from, and each sampled word is then a primary-key lookup
+    with wortlist_columns_lock:
+        pending_lines = columns['lines'][columns['review_day'] < 0].tolist()
+    num_missing = min(SRS_CARDS_PER_SESSION - len(selected_words_lineNumber), len(pending_lines))
+    for lineNumber in random.sample(pending_lines, num_missing):
+        row = connection.execute(
+            "SELECT word, line, frequency, review_date FROM words WHERE wortlist = ? AND line = ? AND review_date = ''",
+            (file_path, lineNumber)).fetchone()
+        if row is not None:
+            selected_words_lineNumber.append(list(row))
 
     # Create a list of selected words
-    selected_words = []
-    for selected_word_lineNumber in selected_words_lineNumber:
-        selected_words.append(selected_word_lineNumber[0])
+    selected_words = [selected_word_lineNumber[0] for selected_word_lineNumber in selected_words_lineNumber]
     random.shuffle(selected_words)
 
-    # percentage_burned = number_burned / total_lines
-
-    return selected_words_lineNumber, selected_words, number_burned, number_week, number_month, number_3_month, number_pending, number_tomorrow
+    return (selected_words_lineNumber, selected_words, stats['B'], stats['W'], stats['M'], stats['3M'], number_pending,
+            stats['T'], stats['forecast'])
 
-def create_anki_english_sentences(selected_words):
+def create_anki_english_sentences(selected_words, card_words):
     # Function to get Anki sentences in 1 go in JSON format using Responses API.
-    # Starts a background task and does not wait for completion
+    # Starts a background task and does not wait for completion. Words with a banked sentence are served
+    # from the sentence bank; only the others are generated. The response is streamed and each sentence
+    # is published as soon as it is complete; once all are in, the same task prefetches the translations
+    # for the whole deck (card_words is in card order)
     session_key = session.sid
-    anki_sentences_jobs[session_key] = {'status': 'in_progress'}
+    job = {'status': 'in_progress', 'sentences': {}}
+    anki_sentences_jobs[session_key] = job
 
     # Capture level while inside request context; do not access session in thread
     level = get_selected_level()
 
     def task(level_param):
+        try:
+            banked = take_banked_sentences(card_words, level_param)
+        except sqlite3.Error as e:
+            print(f"Sentence bank unavailable, generating all sentences: {e}")
+            banked = {}
+        sentences = {unicodedata.normalize('NFC', word): sentence for word, (sentence, _, _) in banked.items()}
+        with anki_sentences_changed:
+            job['sentences'].update(sentences)
+            anki_sentences_changed.notify_all()
+        missing_words = [word for word in selected_words if word not in banked]
+        if not missing_words:
+            cleaned = json.dumps(sentences, ensure_ascii=False)
+            with anki_sentences_changed:
+                job.update(status='done', response=cleaned)
+                anki_sentences_changed.notify_all()
+            prefetch_deck_translations(session_key, card_words, cleaned, level_param, banked)
+            return
+
         prompt = f"""
             You are creating example sentences for vocabulary review at level {level_param}.
-            1) For each of these words, write exactly one simple, natural German sentence: {', '.join(selected_words)}.
+            1) For each of these words, write exactly one simple, natural German sentence: {', '.join(missing_words)}.
             2) Constraint: Use only nouns, verbs and adjectives that are part of the Goethe-Zertifikat {level_param} vocabulary list. Do not use any noun or verb that is outside this list.
                Function words (articles, pronouns, prepositions, conjunctions) are allowed as needed.
             3) Keep grammar and vocabulary appropriate for level {level_param}.
@@ -355,47 +1266,51 @@ def create_anki_english_sentences(selected_words):
             {'role': 'system', 'content': 'You are a helpful language teacher.'},
             {'role': 'user', 'content': prompt}
         ]
+        parser = StreamingJsonObjectParser()
+
+        def publish(delta):
+            pairs = [(word, sentence) for word, sentence in parser.feed(delta) if isinstance(sentence, str)]
+            if pairs:
+                with anki_sentences_changed:
+                    for word, sentence in pairs:
+                        job['sentences'][unicodedata.normalize('NFC', word)] = sentence
+                    anki_sentences_changed.notify_all()
+
         try:
-            resp = get_completion_from_messages(messages, model="gpt-5-mini", max_tokens=2000)
+            resp = create_routed_response(messages, 'anki_sentences', max_tokens=2000, on_text_delta=publish)
+            resp = response_output_text(resp)
             cleaned = resp.strip()
             # Clean potential code fences or leading 'json'
             if cleaned.lower().startswith('json'):
                 cleaned = cleaned[4:].strip()
             cleaned = cleaned.strip('`')
-            anki_sentences_jobs[session_key] = {'status': 'done', 'response': cleaned}
+            try:
+                generated = json.loads(cleaned)
+            except json.JSONDecodeError:
+                generated = None
+            if isinstance(generated, dict):
+                sentences.update({unicodedata.normalize('NFC', word): sentence for word, sentence in generated.items()})
+                cleaned = json.dumps(sentences, ensure_ascii=False)
+            with anki_sentences_changed:
+                job.update(status='done', response=cleaned)
+                anki_sentences_changed.notify_all()
         except Exception as e:
-            anki_sentences_jobs[session_key] = {'status': 'error', 'error': str(e)}
-
-    Thread(target=task, args=(level,), daemon=True).start()
+            with anki_sentences_changed:
+                job.update(status='error', error=str(e))
+                anki_sentences_changed.notify_all()
+            return
+        if isinstance(generated, dict):
+            try:
+                bank_sentences(level_param, generated)
+            except sqlite3.Error as e:
+                print(f"Could not bank generated sentences: {e}")
+        prefetch_deck_translations(session_key, card_words, cleaned, level_param, banked)
+
+    start_background_thread(task, (level,))
 
 def save_to_csv():
-
-    updated_content = []
-    file_path = get_current_wortlist_file()
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-
-    # Modify the rows that have updated frequency and review date
-    selected_words_lineNumber = session['selected_words_lineNumber']
-    rows_to_update = []
-    for selected_word_LineNumber in selected_words_lineNumber:
-        rows_to_update.append(selected_word_LineNumber[1])
-
-    for i, line in enumerate(lines, start=0):
-        if i in rows_to_update:
-            updated_line = ""
-            for selected_word_LineNumber in selected_words_lineNumber:
-                if selected_word_LineNumber[1] == i:
-                    updated_line = selected_word_LineNumber[0] + "," + selected_word_LineNumber[2] + ',' + selected_word_LineNumber[3] + "\n"
-            updated_content.append(updated_line)
-            #print(updated_line)
-        else:
-            updated_content.append(line)
-
-    # Write data to CSV file
-    #print(updated_content[0])
-    with open(file_path, 'w') as file:
-        file.writelines(updated_content)
+    # Record the new frequency and review date of this session's words; the CSV is rewritten in the background
+    record_review_results(get_current_wortlist_file(), session['selected_words_lineNumber'])
 
 
 @app.route('/story_scenario', methods=['POST'])
@@ -410,10 +1325,10 @@ def stats_and_start_anki():
 
     scenario_text = request.form.get('scenarioText', None)
 
-    selected_words_lineNumber, selected_words, number_burned, number_week, number_month, number_3_month, number_pending, number_tomorrow = chooseSelectedWords()
+    selected_words_lineNumber, selected_words, number_burned, number_week, number_month, number_3_month, number_pending, number_tomorrow, review_forecast = chooseSelectedWords()
 
 
-    create_anki_english_sentences(selected_words)
+    create_anki_english_sentences(selected_words, [row[0] for row in selected_words_lineNumber])
 
     session['selected_words_position'] = 0
     session['selected_words_lineNumber'] = selected_words_lineNumber
@@ -424,9 +1339,9 @@ def stats_and_start_anki():
     session_key = session.sid
     story_results[session_key] = {'status': 'in_progress'}
     wortlist_file = session.get("wortlist_file", DEFAULT_WORTLIST_FILE)
-    Thread(target=generate_story_background, args=(session_key, wortlist_file, scenario_text)).start()
+    start_background_thread(generate_story_background, (session_key, wortlist_file, scenario_text), daemon=False)
 
-    # Get the last run datetime from the log file
+    # Get the last run datetime from the usage store
     last_run_datetime = get_last_run_datetime()
 
     result_data = {
@@ -436,29 +1351,34 @@ def stats_and_start_anki():
         'number3Month': number_3_month,
         'numberPending': number_pending,
         'numberTomorrow': number_tomorrow,
+        'reviewForecast': review_forecast,
         'lastRunDateTime': last_run_datetime
     }
 
-    # Save current run datetime in log file
-    log_datetime()
+    # Save current run in the usage store
+    record_usage_event('anki', {'wortlist': wortlist_file, 'words': len(selected_words_lineNumber)})
 
     return render_template('stats_and_start_anki.html', result = result_data)
 
 @app.route('/ankiSentencesResponse', methods=['POST','GET'])
 def ankiSentencesResponse():
-    # Block until the background job (Responses API) finishes, then return the JSON string
-    session_key = session.sid
-    # Wait loop similar to previous behavior
-    while True:
-        job = anki_sentences_jobs.get(session_key)
-        if job and job.get('status') == 'done':
-            response = job.get('response', '')
-            session['anki_sentences'] = response
-            return response
-        if job and job.get('status') == 'error':
-            session['anki_sentences'] = 'Error'
-            return 'Error'
-        time.sleep(0.5)
+    # Block until the first card's sentence has been streamed in (or the background job finishes),
+    # then return the sentences available so far as a JSON string. They are kept in the session either
+    # way, so /ankiSentence still has a deck if the job is not on the worker that serves it
+    selected_words_lineNumber = session.get('selected_words_lineNumber') or []
+    first_wort = selected_words_lineNumber[0][0] if selected_words_lineNumber else ''
+    job = wait_for_anki_sentence(session.sid, first_wort)
+    if job and job['status'] == 'done':
+        response = job.get('response', '')
+        session['anki_sentences'] = response
+        return response
+    if job and job['sentences']:
+        with anki_sentences_changed:
+            response = json.dumps(job['sentences'], ensure_ascii=False)
+        session['anki_sentences'] = response
+        return response
+    session['anki_sentences'] = 'Error'
+    return 'Error'
 
 
 @app.route('/anki', methods=['POST','GET'])
@@ -492,7 +1412,16 @@ def ankiSentence():
     # print("anki_word:" + session['anki_word'])
 
     wort = session['anki_word']
-    anki_sentences = session['anki_sentences']
+    # Serve the sentence as soon as it has been streamed in
+    job = wait_for_anki_sentence(session.sid, wort)
+    if job and unicodedata.normalize('NFC', wort) in job['sentences']:
+        anki_sentence_for_wort = job['sentences'][unicodedata.normalize('NFC', wort)]
+        session['anki_sentence'] = anki_sentence_for_wort
+        return anki_sentence_for_wort
+    if job and job['status'] == 'done':
+        session['anki_sentences'] = job['response']
+
+    anki_sentences = session.get('anki_sentences', '')
     anki_sentence_for_wort = "Error"
     sentences_data = ""
 
@@ -506,7 +1435,7 @@ def ankiSentence():
         try:
             wort_normalized = unicodedata.normalize('NFC', wort)
             sentences_data_normalized = {unicodedata.normalize('NFC', k): v for k, v in sentences_data.items()}
-            anki_sentence_for_wort = sentences_data_normalized.get(wort_normalized)
+            anki_sentence_for_wort = sentences_data_normalized.get(wort_normalized, "Error")
         except Exception:
             anki_sentence_for_wort = 'Failed to get word. Please check if word is in the JSON string'
 
@@ -666,7 +1595,7 @@ def translateToEnglish(germanText):
          }
     ]
 
-    englishVersion = get_completion_from_messages(messages, model="gpt-5-nano", max_tokens=100)
+    englishVersion = llm.complete(messages, task='translation')
 
     return englishVersion
 
@@ -684,7 +1613,7 @@ def correctSpellingGrammar(germanText):
     ]
     # print("correctSpellingGrammar:")
     # print(messages)
-    correctSpellingGrammarVersion = get_completion_from_messages(messages, model="gpt-5-mini", max_tokens=500)
+    correctSpellingGrammarVersion = llm.complete(messages, task='spell_grammar', max_tokens=500)
     # print(correctSpellingGrammarVersion)
 
     return correctSpellingGrammarVersion
@@ -781,9 +1710,9 @@ def updateReviewDate():
 
 @app.route('/germanConversation', methods=['POST'])
 def germanConversation():
-    # Save current run datetime in log file
+    # Save current run in the usage store
     session['wortlist_file'] = request.form.get('wortlist', DEFAULT_WORTLIST_FILE)
-    log_datetime()
+    record_usage_event('conversation', {'wortlist': session['wortlist_file']})
     return render_template('germanConversation.html')
 
 @app.route('/germanScenario', methods=['POST'])
@@ -801,36 +1730,46 @@ def germanScenario():
         - Use only nouns, verbs and adjectives that are in the Goethe-Zertifikat {level} vocabulary list.
         - Keep sentences simple and suitable for level {level}.
     """.strip()
-    conversationMessages = [
-        {'role': 'system', 'content': system_prompt}
-    ]
-    session['conversationMessages'] = conversationMessages
+    conversation.begin(system_prompt)
 
     return render_template('iSay.html', result=result_data)
 
+def start_conversation_turn_precompute(iSayText, youSayText):
+    """Start translation and correction for a turn as soon as its reply is known."""
+    return conversation_turns.start({
+        'english': lambda: translateToEnglish(youSayText),
+        'spell_grammar': lambda: correctSpellingGrammar(iSayText),
+    })
+
+def get_conversation_turn_result(name, fallback):
+    """Return the precomputed (or in-flight) artefact for the current turn, computing inline if absent."""
+    return conversation_turns.result(session.get('conversationTurnId'), name, fallback)
+
 @app.route('/iSayDynamic', methods=['POST'])
 def iSayDynamic():
     session['iSayText'] = request.form['iSayText']
     iSayText = request.form['iSayText']
 
-    conversationMessages = session.get('conversationMessages', [])
-    if not conversationMessages:
+    if not session.get('conversationMessages'):
         level = get_selected_level()
-        conversationMessages = [{
-            'role': 'system',
-            'content': f'You are a helpful language teacher. Respond in German and use only nouns, verbs and adjectives from the Goethe-Zertifikat {level} vocabulary list. Keep sentences simple and level-appropriate ({level}).'
-        }]
+        conversation.begin(f'You are a helpful language teacher. Respond in German and use only nouns, verbs and adjectives from the Goethe-Zertifikat {level} vocabulary list. Keep sentences simple and level-appropriate ({level}).')
+    conversationMessages = session['conversationMessages']
+
+    conversationId = conversation.current_id()
 
     # Append the user's message
     conversationMessages.append({'role': 'user', 'content': iSayText})
 
-    # Get assistant reply via Responses API
-    youSayText = get_completion_from_messages(conversationMessages, model="gpt-5-mini", max_tokens=400)
+    # Get assistant reply via Responses API, chained on the previous response when possible
+    response = conversation.respond(conversationId, conversationMessages, model="gpt-5-mini", max_tokens=400,
+                                    feature='conversation')
+    youSayText = response_output_text(response)
 
-    # Update conversation history
+    # Update conversation history, folding turns beyond the window into the rolling summary
     conversationMessages.append({'role': 'assistant', 'content': youSayText})
-    session['conversationMessages'] = conversationMessages
+    session['conversationMessages'] = conversation.window(conversationId, conversationMessages)
     session['youSayText'] = youSayText
+    session['conversationTurnId'] = start_conversation_turn_precompute(iSayText, youSayText)
 
     result_data = {
         'youSayText': youSayText,
@@ -842,13 +1781,13 @@ def iSayDynamic():
 @app.route('/conversationEnglishTranslation')
 def conversationEnglishTranslation():
     youSayText = session['youSayText']
-    youSayTextEnglish = translateToEnglish(youSayText)
+    youSayTextEnglish = get_conversation_turn_result('english', lambda: translateToEnglish(youSayText))
     return youSayTextEnglish
 
 @app.route('/conversationSpellGrammarCheck')
 def conversationSpellGrammarCheck():
     iSayText = session['iSayText']
-    iSayTextReviewed = correctSpellingGrammar(iSayText)
+    iSayTextReviewed = get_conversation_turn_result('spell_grammar', lambda: correctSpellingGrammar(iSayText))
     return iSayTextReviewed
 
 
@@ -857,25 +1796,79 @@ def conversationSpellGrammarCheck():
 def youSay():
     return render_template('iSay.html')
 
-def log_datetime():
-    now = datetime.now()
-    with open('datetime_log.txt', 'a') as log_file:
-        log_file.write(now.strftime("%Y-%m-%d %H:%M:%S") + "\n")
-
-
-def get_last_run_datetime():
+def collect_job_gauges():
+    """Background job, session store, model gateway, sentence bank and startup gauges for /metrics."""
+    job_states = []
+    for result in list(story_results.values()):
+        job_states.append(('story_german', result.get('german_status', result.get('status'))))
+        job_states.append(('story_english', result.get('english_status')))
+    for job in list(anki_sentences_jobs.values()):
+        job_states.append(('anki_sentences', job.get('status')))
+    for job in list(anki_translation_jobs.values()):
+        job_states.append(('anki_word_translation', job.get('word_status')))
+        job_states.append(('anki_sentence_translation', job.get('sentence_status')))
+    gauges = job_gauges(job_states + conversation_turns.job_states() + conversation.job_states())
+    gauges.update(session_store.gauges())
+    gauges.update(llm.gauges())
     try:
-        with open('datetime_log.txt', 'r') as log_file:
-            lines = log_file.readlines()
-            if lines:
-                last_run_datetime = lines[-1].strip()
-                return last_run_datetime
-    except FileNotFoundError:
-        return "No run history available."
+        for level, size in sentence_bank_sizes().items():
+            gauges[('anki_sentence_bank_sentences', (('level', level),))] = size
+    except sqlite3.Error:
+        pass
+    gauges.update(startup.gauges())
+    return gauges
+
+@app.errorhandler(ModelUnavailableError)
+def model_unavailable(error):
+    """Fail fast with 503 while a model's circuit is open so pages can show the message and retry."""
+    if request.is_json or request.accept_mimetypes.best == 'application/json':
+        response = jsonify({'status': 'error', 'error': str(error)})
+    else:
+        response = Response(str(error), mimetype='text/plain')
+    response.status_code = 503
+    response.headers['Retry-After'] = str(int(error.retry_after) + 1)
+    return response
+
+def warm_burned_words():
+    words = get_burned_words(DEFAULT_WORTLIST_FILE)
+    if words:
+        story_vocabulary.index(words)
+
+def warm_templates():
+    for name in app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html')):
+        app.jinja_env.get_template(name)
+
+# After import, a warm-up thread loads local caches and opens pooled connections before /ready answers 200
+startup = Startup(STARTUP_STARTED_AT, 'german_app.py', [
+    ('templates', warm_templates),
+    ('usage_db', usage_db),
+    ('burned_words', warm_burned_words),
+    ('wortlists', lambda: get_wortlist_columns(ensure_wortlist_loaded(DEFAULT_WORTLIST_FILE), DEFAULT_WORTLIST_FILE)),
+    ('openai', llm.warm),
+], lazy_modules=('openai', 'numpy'))
+startup.init_app(app)
+
+@app.route('/debug/traces')
+@debug_access_required
+def debug_traces():
+    with traces_lock:
+        traces = list(recent_traces)
+    return render_template('debugTraces.html', traces=[trace_waterfall(trace) for trace in reversed(traces)])
+
+@app.route('/debug/usage')
+@debug_access_required
+def debug_usage():
+    return jsonify(summarise_usage(request.args.get('days', 30, type=int)))
+
+@app.route('/metrics')
+@debug_access_required
+def metrics():
+    return Response(render_metrics(collect_job_gauges()), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
 if __name__ == '__main__':
+    startup.begin()
     app.run(debug=False, port=5000)
@@ -0,0 +1,495 @@
+"""Shared gateway for model calls from the Japanese and German apps.
+
+One long-lived OpenAI client per process over a tuned connection pool (keep-alive, and HTTP/2 when the
+h2 package is installed), and one call API for every feature:
+
+    llm = LLMGateway(MODEL_ROUTES, LLM_TIMEOUT_SECONDS, increment_counter=increment_counter,
+                     observe_histogram=observe_histogram, trace_span=trace_span, current_route=current_route)
+    response = llm.create(messages, model='gpt-5-nano', reasoning_effort='minimal', max_tokens=200,
+                          verbosity='low', text_format=SCHEMA, feature='translation')
+    text = llm.complete(messages, task='translation')
+
+Every call gets the task's timeout, jittered retries for transient errors, a circuit breaker per model,
+single-flight coalescing of identical requests, metrics and prompt-cache accounting. Routed calls
+(task=...) choose a (model, effort) option from the task's route by recent latency and hedge slow
+calls; streamed calls (on_text_delta=...) pass each output_text delta to the caller as it arrives.
+The openai SDK is imported on first use, so importing this module stays cheap.
+"""
+import hashlib
+import importlib.util
+import json
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import nullcontext
+from contextvars import copy_context
+from threading import Event, Lock
+
+# MODEL_ROUTING=static always uses a task's first option and never hedges
+MODEL_ROUTING = os.environ.get('MODEL_ROUTING', 'adaptive')
+ROUTE_LATENCY_WINDOW = 20
+ROUTE_MIN_SAMPLES = 3
+# Samples expire so that an option marked slow during an upstream incident is tried again later
+ROUTE_SAMPLE_MAX_AGE_SECONDS = 15 * 60
+
+LLM_DEFAULT_TIMEOUT_SECONDS = float(os.environ.get('LLM_TIMEOUT_SECONDS', '60'))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '2'))
+LLM_RETRY_BASE_DELAY_SECONDS = 0.5
+LLM_RETRY_MAX_DELAY_SECONDS = 8
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_COOLDOWN_SECONDS = 30
+
+# Connection pool shared by every call: enough keep-alive connections for the hedged and background calls
+LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', '64'))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('LLM_MAX_KEEPALIVE_CONNECTIONS', '32'))
+LLM_KEEPALIVE_EXPIRY_SECONDS = 120
+LLM_CONNECT_TIMEOUT_SECONDS = 5
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+# Threads for the attempts of hedged routed calls. Work is only handed to a free thread, never queued: a call
+# that finds them all busy runs unhedged on the caller's thread, so slow calls cannot hold up other requests
+LLM_ROUTE_WORKERS = int(os.environ.get('LLM_ROUTE_WORKERS', '32'))
+
+
+class ModelUnavailableError(RuntimeError):
+    """Raised without calling upstream while a model's circuit breaker is open."""
+
+    def __init__(self, model, retry_after):
+        super().__init__(f"{model} is temporarily unavailable after repeated upstream errors. "
+                         f"Please try again in about {int(retry_after) + 1}s.")
+        self.model = model
+        self.retry_after = retry_after
+
+
+def openai_error_types(*names):
+    import openai
+    return tuple(getattr(openai, name) for name in names)
+
+
+def is_transient_llm_error(exc):
+    if isinstance(exc, openai_error_types('APIConnectionError', 'RateLimitError')):
+        return True
+    return isinstance(exc, openai_error_types('APIStatusError')) and exc.status_code >= 500
+
+
+def llm_retry_delay(attempt, exc):
+    """Full-jitter exponential backoff, stretched to the server's Retry-After when it sends one."""
+    delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY_SECONDS, LLM_RETRY_BASE_DELAY_SECONDS * 2 ** attempt))
+    response = getattr(exc, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    try:
+        delay = max(delay, float(retry_after))
+    except (TypeError, ValueError):
+        pass
+    return min(delay, LLM_RETRY_MAX_DELAY_SECONDS)
+
+
+def _normalise_for_key(value):
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, dict):
+        return {key: _normalise_for_key(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalise_for_key(item) for item in value]
+    return value
+
+
+def llm_request_key(create_args):
+    """Hash of the request with whitespace-insensitive text, so re-indented prompts still coalesce."""
+    payload = json.dumps(_normalise_for_key(create_args), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def response_output_text(response):
+    if getattr(response, 'output_text', None):
+        return response.output_text
+    raise RuntimeError('No text returned from Responses API call.')
+
+
+def _no_op(*args, **kwargs):
+    pass
+
+
+class LLMGateway:
+    """Responses API calls with routing, retries, circuit breakers, single-flight and metrics.
+
+    routes: {task: {'budget_seconds', 'hedge_after_seconds' (optional), 'options': [(model, effort), ...]}}
+    timeouts: {feature or task: seconds}. The hooks connect the gateway to the app's metrics and tracing.
+    """
+
+    def __init__(self, routes, timeouts, increment_counter=_no_op, observe_histogram=_no_op, trace_span=None,
+                 current_route=lambda: 'background', routing=MODEL_ROUTING, log=print, route_workers=LLM_ROUTE_WORKERS):
+        self.routes = routes
+        self.timeouts = timeouts
+        self.routing = routing
+        self.increment_counter = increment_counter
+        self.observe_histogram = observe_histogram
+        self.trace_span = trace_span or (lambda name, kind='internal': nullcontext())
+        self.current_route = current_route
+        self.log = log
+        self._client = None
+        self._client_lock = Lock()
+        # { model: {'state': 'closed'|'open'|'half_open', 'failures': int, 'opened_at': float} }
+        self.circuit_breakers = {}
+        self.circuit_breakers_lock = Lock()
+        # { request_key: {'event': Event, 'response': response or None, 'error': exception or None} }
+        self.inflight_requests = {}
+        self.inflight_requests_lock = Lock()
+        # { (task, model, effort): deque of (finished_at, duration in seconds) for recent successful calls }
+        self.route_latencies = {}
+        self.route_latencies_lock = Lock()
+        self.route_workers = route_workers
+        self.route_workers_busy = 0
+        self.route_workers_lock = Lock()
+        self.route_executor = ThreadPoolExecutor(max_workers=route_workers, thread_name_prefix='llm-route')
+        # Per prompt-cache key: calls, input/cached tokens and latency split by cache hit/miss
+        self.prompt_cache_stats = {}
+        self.prompt_cache_stats_lock = Lock()
+
+    # Client and connection pool
+
+    def client(self):
+        """The process-wide OpenAI client, created (and the SDK imported) on first use."""
+        with self._client_lock:
+            if self._client is None:
+                api_key = os.environ.get('OPENAI_API_KEY')
+                if not api_key:
+                    raise RuntimeError('OPENAI_API_KEY environment variable is not set.')
+                from openai import OpenAI
+                # Retries are handled by the gateway (with the circuit breaker) rather than by the SDK
+                self._client = OpenAI(api_key=api_key, max_retries=0, http_client=self._http_client())
+            return self._client
+
+    def _http_client(self):
+        """Tuned keep-alive pool, HTTP/2 if h2 is installed; None keeps the SDK's own pool when httpx is absent."""
+        try:
+            import httpx
+            from openai import DefaultHttpxClient
+        except ImportError:
+            return None
+        return DefaultHttpxClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                                keepalive_expiry=LLM_KEEPALIVE_EXPIRY_SECONDS),
+            timeout=httpx.Timeout(LLM_DEFAULT_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS),
+        )
+
+    def warm(self):
+        """Open a pooled connection ahead of the first call; any response, even an error status, leaves one."""
+        try:
+            self.client().with_options(timeout=5).models.list()
+        except Exception as exc:
+            if not isinstance(exc, openai_error_types('APIStatusError')):
+                raise
+
+    # Circuit breakers
+
+    def circuit_retry_after(self, model):
+        """Seconds until an open breaker lets a trial call through, or 0 if calls are allowed now."""
+        with self.circuit_breakers_lock:
+            breaker = self.circuit_breakers.get(model)
+            if not breaker or breaker['state'] == 'closed':
+                return 0
+            if breaker['state'] == 'half_open':
+                return CIRCUIT_COOLDOWN_SECONDS
+            return max(0, breaker['opened_at'] + CIRCUIT_COOLDOWN_SECONDS - time.time())
+
+    def acquire_circuit(self, model):
+        """Raise ModelUnavailableError while the breaker is open; after the cooldown one trial call is let through."""
+        with self.circuit_breakers_lock:
+            breaker = self.circuit_breakers.setdefault(model, {'state': 'closed', 'failures': 0, 'opened_at': 0.0})
+            if breaker['state'] == 'closed':
+                return
+            remaining = breaker['opened_at'] + CIRCUIT_COOLDOWN_SECONDS - time.time()
+            if breaker['state'] == 'open' and remaining <= 0:
+                breaker['state'] = 'half_open'
+                return
+        raise ModelUnavailableError(model, max(remaining, 0) if breaker['state'] == 'open' else CIRCUIT_COOLDOWN_SECONDS)
+
+    def record_circuit_result(self, model, transient_failure):
+        """Any answer that is not a transient failure (including 4xx errors) proves the model is reachable."""
+        with self.circuit_breakers_lock:
+            breaker = self.circuit_breakers.setdefault(model, {'state': 'closed', 'failures': 0, 'opened_at': 0.0})
+            if not transient_failure:
+                breaker.update(state='closed', failures=0)
+                return
+            breaker['failures'] += 1
+            if breaker['state'] == 'half_open' or breaker['failures'] >= CIRCUIT_FAILURE_THRESHOLD:
+                if breaker['state'] != 'open':
+                    self.increment_counter('llm_circuit_opened_total', model=model)
+                    self.log(f"Circuit for {model} opened after {breaker['failures']} transient failures.")
+                breaker.update(state='open', opened_at=time.time())
+
+    # Metrics
+
+    def record_call(self, feature, model, reasoning_effort, elapsed, response=None, error=None):
+        labels = {'route': self.current_route(), 'feature': feature or 'unspecified', 'model': model,
+                  'effort': reasoning_effort}
+        self.observe_histogram('llm_request_duration_seconds', elapsed, **labels)
+        self.increment_counter('llm_requests_total', error=type(error).__name__ if error else 'none', **labels)
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return
+        details = getattr(usage, 'input_tokens_details', None)
+        self.increment_counter('llm_input_tokens_total', getattr(usage, 'input_tokens', 0) or 0, **labels)
+        self.increment_counter('llm_output_tokens_total', getattr(usage, 'output_tokens', 0) or 0, **labels)
+        self.increment_counter('llm_cached_tokens_total', getattr(details, 'cached_tokens', 0) or 0, **labels)
+
+    def record_prompt_cache_usage(self, cache_key, response, elapsed):
+        """Accumulate usage.input_tokens_details.cached_tokens so prefix-cache hit rates are visible."""
+        usage = getattr(response, 'usage', None)
+        input_tokens = getattr(usage, 'input_tokens', None) or 0
+        details = getattr(usage, 'input_tokens_details', None)
+        cached_tokens = getattr(details, 'cached_tokens', None) or 0
+        with self.prompt_cache_stats_lock:
+            stats = self.prompt_cache_stats.setdefault(cache_key, {
+                'calls': 0, 'input_tokens': 0, 'cached_tokens': 0,
+                'hit_calls': 0, 'hit_seconds': 0.0, 'miss_calls': 0, 'miss_seconds': 0.0,
+            })
+            stats['calls'] += 1
+            stats['input_tokens'] += input_tokens
+            stats['cached_tokens'] += cached_tokens
+            outcome = 'hit' if cached_tokens else 'miss'
+            stats[f'{outcome}_calls'] += 1
+            stats[f'{outcome}_seconds'] += elapsed
+
+    def gauges(self):
+        """Prompt-cache, routing, route worker and circuit breaker gauges in the apps' /metrics format."""
+        gauges = {}
+        with self.route_workers_lock:
+            gauges[('llm_route_workers', (('state', 'busy'),))] = self.route_workers_busy
+            gauges[('llm_route_workers', (('state', 'max'),))] = self.route_workers
+        with self.prompt_cache_stats_lock:
+            for cache_key, stats in self.prompt_cache_stats.items():
+                for outcome in ('hit', 'miss'):
+                    labels = (('key', cache_key), ('outcome', outcome))
+                    gauges[('llm_prompt_cache_calls', labels)] = stats[f'{outcome}_calls']
+                    gauges[('llm_prompt_cache_seconds', labels)] = round(stats[f'{outcome}_seconds'], 6)
+                for kind in ('input', 'cached'):
+                    gauges[('llm_prompt_cache_tokens', (('key', cache_key), ('kind', kind)))] = stats[f'{kind}_tokens']
+        for task, route in self.routes.items():
+            for model, effort in route['options']:
+                predicted = self.predicted_route_latency(task, model, effort)
+                if predicted is not None:
+                    labels = (('effort', effort), ('feature', task), ('model', model))
+                    gauges[('llm_route_predicted_p90_seconds', labels)] = round(predicted, 6)
+        with self.circuit_breakers_lock:
+            for model, breaker in self.circuit_breakers.items():
+                for state in ('closed', 'open', 'half_open'):
+                    gauges[('llm_circuit_state', (('model', model), ('state', state)))] = int(breaker['state'] == state)
+        return gauges
+
+    # Calls
+
+    def create(self, messages, model="gpt-5-nano", reasoning_effort="minimal", max_tokens=2000, verbosity=None,
+               text_format=None, previous_response_id=None, prompt_cache_key=None, feature=None, on_text_delta=None):
+        """Call the Responses API and return the raw response so callers can read usage and id.
+        text_format is a structured-output format such as {'type': 'json_schema', ...}. With on_text_delta
+        the response is streamed and each output_text delta is passed to it as it arrives.
+        """
+        create_args = {
+            "model": model,
+            "input": messages,
+            "reasoning": {"effort": reasoning_effort},
+        }
+        if previous_response_id:
+            create_args["previous_response_id"] = previous_response_id
+        if max_tokens is not None:
+            create_args["max_output_tokens"] = max_tokens
+        if verbosity is not None:
+            create_args["text"] = {"verbosity": verbosity}
+        if text_format is not None:
+            create_args.setdefault("text", {})["format"] = text_format
+        if prompt_cache_key:
+            create_args["extra_body"] = {"prompt_cache_key": prompt_cache_key}
+        if on_text_delta is not None:
+            # A stream has a single consumer, so streamed calls are not coalesced
+            return self._call(create_args, feature, prompt_cache_key, on_text_delta)
+        return self.single_flight(llm_request_key(create_args), feature,
+                                  lambda: self._call(create_args, feature, prompt_cache_key))
+
+    def complete(self, messages, task=None, **options):
+        """Output text of a call; routed by MODEL_ROUTES-style routes when task is given, else direct."""
+        if task is not None:
+            return response_output_text(self.create_routed(messages, task, **options))
+        return response_output_text(self.create(messages, **options))
+
+    def _stream(self, client, create_args, on_text_delta):
+        """Stream a Responses API call, passing output_text deltas to on_text_delta; returns the final response."""
+        response = None
+        for event in client.responses.create(stream=True, **create_args):
+            if event.type == 'response.output_text.delta':
+                on_text_delta(event.delta)
+            elif event.type in ('response.completed', 'response.incomplete'):
+                response = event.response
+            elif event.type == 'response.failed':
+                error = getattr(event.response, 'error', None)
+                raise RuntimeError(f"Response failed: {getattr(error, 'message', None) or 'unknown error'}")
+            elif event.type == 'error':
+                raise RuntimeError(f"Response stream error: {event.message}")
+        if response is None:
+            raise RuntimeError("Response stream ended before the response completed")
+        return response
+
+    def _call(self, create_args, feature, prompt_cache_key, on_text_delta=None):
+        model = create_args['model']
+        reasoning_effort = create_args['reasoning']['effort']
+        timeout = self.timeouts.get(feature, LLM_DEFAULT_TIMEOUT_SECONDS)
+        client = self.client().with_options(timeout=timeout)
+        self.acquire_circuit(model)
+        start_time = time.time()
+        attempt = 0
+        delivered = []
+
+        def deliver(delta):
+            delivered.append(True)
+            on_text_delta(delta)
+
+        while True:
+            try:
+                with self.trace_span(f"openai {feature or 'call'} ({model})", 'openai'):
+                    if on_text_delta is None:
+                        response = client.responses.create(**create_args)
+                    else:
+                        response = self._stream(client, create_args, deliver)
+                break
+            except Exception as exc:
+                transient = is_transient_llm_error(exc)
+                self.record_circuit_result(model, transient)
+                # A stream that has already delivered text cannot be retried without repeating it
+                if not transient or delivered or attempt >= LLM_MAX_RETRIES or self.circuit_retry_after(model):
+                    self.record_call(feature, model, reasoning_effort, time.time() - start_time, error=exc)
+                    raise
+                delay = llm_retry_delay(attempt, exc)
+                self.increment_counter('llm_retries_total', feature=feature or 'unspecified', model=model,
+                                       reason=type(exc).__name__)
+                self.log(f"Transient {type(exc).__name__} from {model} ({feature}); retry {attempt + 1} in {delay:.1f}s.")
+                time.sleep(delay)
+                attempt += 1
+        self.record_circuit_result(model, False)
+        elapsed = time.time() - start_time
+        self.record_call(feature, model, reasoning_effort, elapsed, response=response)
+        self.record_prompt_cache_usage(prompt_cache_key or model, response, elapsed)
+        return response
+
+    def single_flight(self, key, feature, call):
+        """Run call() once per key at a time; concurrent callers with the same key wait and share its outcome."""
+        with self.inflight_requests_lock:
+            flight = self.inflight_requests.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight_requests[key] = {'event': Event(), 'response': None, 'error': None}
+        if not leader:
+            self.increment_counter('llm_coalesced_requests_total', route=self.current_route(),
+                                   feature=feature or 'unspecified')
+            with self.trace_span(f"openai {feature or 'call'} (coalesced)", 'openai'):
+                flight['event'].wait()
+            if flight['error'] is not None:
+                raise flight['error']
+            return flight['response']
+        try:
+            flight['response'] = call()
+        except Exception as exc:
+            flight['error'] = exc
+            raise
+        finally:
+            with self.inflight_requests_lock:
+                self.inflight_requests.pop(key, None)
+            flight['event'].set()
+        return flight['response']
+
+    # Routing
+
+    def predicted_route_latency(self, task, model, reasoning_effort):
+        """p90 of the recent latencies for this option, or None while there are too few samples."""
+        cutoff = time.time() - ROUTE_SAMPLE_MAX_AGE_SECONDS
+        with self.route_latencies_lock:
+            samples = sorted(elapsed for finished_at, elapsed in self.route_latencies.get((task, model, reasoning_effort), ())
+                             if finished_at >= cutoff)
+        if len(samples) < ROUTE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.9))]
+
+    def record_route_latency(self, task, model, reasoning_effort, elapsed):
+        with self.route_latencies_lock:
+            window = self.route_latencies.setdefault((task, model, reasoning_effort), deque(maxlen=ROUTE_LATENCY_WINDOW))
+            window.append((time.time(), elapsed))
+
+    def choose_route_option(self, task):
+        """Index of the first option predicted to meet the task's budget, else the fastest predicted one."""
+        route = self.routes[task]
+        if self.routing == 'static':
+            return 0, 'static'
+        available = [index for index, (model, _) in enumerate(route['options']) if not self.circuit_retry_after(model)]
+        if not available:
+            # Every option's circuit is open: let create() fail fast with the preferred model
+            return 0, 'circuit_open'
+        predictions = {index: self.predicted_route_latency(task, *route['options'][index]) for index in available}
+        for index in available:
+            predicted = predictions[index]
+            if predicted is None or predicted <= route['budget_seconds']:
+                return index, 'unmeasured' if predicted is None else 'within_budget'
+        return min(available, key=lambda index: predictions[index]), 'fastest'
+
+    def _routed_call(self, task, model, reasoning_effort, messages, options):
+        start_time = time.time()
+        response = self.create(messages, model=model, reasoning_effort=reasoning_effort, feature=task, **options)
+        self.record_route_latency(task, model, reasoning_effort, time.time() - start_time)
+        return response
+
+    def _submit_routed_call(self, task, option, messages, options):
+        """Start the call on a free route_executor thread; returns None, starting nothing, if all are busy."""
+        with self.route_workers_lock:
+            available = self.route_workers_busy < self.route_workers
+            if available:
+                self.route_workers_busy += 1
+        if not available:
+            self.increment_counter('llm_hedge_skipped_total', feature=task, reason='workers_busy')
+            return None
+        # Each submission runs in a copy of the caller's context so spans and metrics keep the route
+        future = self.route_executor.submit(copy_context().run, self._routed_call, task, *option, messages, options)
+        future.add_done_callback(self._release_route_worker)
+        return future
+
+    def _release_route_worker(self, future):
+        with self.route_workers_lock:
+            self.route_workers_busy -= 1
+
+    def create_routed(self, messages, task, **options):
+        """Call the Responses API with the model and effort chosen by the task's route, hedging slow calls."""
+        route = self.routes[task]
+        route_options = route['options']
+        index, reason = self.choose_route_option(task)
+        model, reasoning_effort = route_options[index]
+        self.increment_counter('llm_route_decisions_total', feature=task, model=model, effort=reasoning_effort,
+                               reason=reason)
+        hedge_after = route.get('hedge_after_seconds')
+        hedge_options = [option for option in route_options[index + 1:] if not self.circuit_retry_after(option[0])]
+        # A streamed call is not hedged: two streams would both feed the caller's on_text_delta
+        if self.routing == 'static' or not hedge_after or not hedge_options or options.get('on_text_delta'):
+            return self._routed_call(task, model, reasoning_effort, messages, options)
+
+        primary = self._submit_routed_call(task, route_options[index], messages, options)
+        if primary is None:
+            return self._routed_call(task, model, reasoning_effort, messages, options)
+        done, _ = wait([primary], timeout=hedge_after)
+        if done:
+            return primary.result()
+        hedge_model, hedge_effort = hedge_options[0]
+        self.log(f"Hedging {task}: {model}/{reasoning_effort} still running after {hedge_after}s, "
+                 f"racing {hedge_model}/{hedge_effort}.")
+        hedge = self._submit_routed_call(task, hedge_options[0], messages, options)
+        if hedge is None:
+            return primary.result()
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self.increment_counter('llm_hedged_requests_total', feature=task,
+                                           winner='primary' if future is primary else 'hedge')
+                    return future.result()
+        self.increment_counter('llm_hedged_requests_total', feature=task, winner='none')
+        return primary.result()
@@ -0,0 +1,291 @@
+"""Server-side sessions shared by the Japanese and German apps.
+
+The cookie carries only a random session id, signed with the app's secret key. Session data lives in
+memory and, when a database path is given, in SQLite, which is then the source of truth shared by every
+worker process: each load checks the row's version and reuses the in-memory copy only while it is current.
+A request writes only if the session's contents changed (compared by their pickled bytes), and writes are
+compare-and-set on the version it loaded; when another request wrote in between, the keys this request
+changed are merged into the newer session and the write is retried. Expiry refreshes are batched by a
+background sweeper that also removes expired sessions. A secret key is required: without one sessions are
+unavailable, as with Flask's default cookie sessions.
+
+    from session_store import ServerSideSessionInterface, SessionStore
+    app.session_interface = ServerSideSessionInterface(SessionStore('sessions.db', ttl_seconds=7 * 24 * 3600))
+"""
+import pickle
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+
+SAVE_ATTEMPTS = 5
+
+
+class SessionConflictError(Exception):
+    """Raised by SessionStore.save when the stored session changed since the version the request loaded."""
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict with a server-side id (session.sid); loaded_payload/loaded_version identify what it was loaded from."""
+
+    def __init__(self, sid, data=None, new=False, loaded_payload=None, loaded_version=None):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(data or {}, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.loaded_payload = loaded_payload
+        self.loaded_version = loaded_version
+
+
+class SessionStore:
+    """Versioned, pickled session payloads by session id, in memory and written through to SQLite if db_path is set."""
+
+    def __init__(self, db_path=None, ttl_seconds=7 * 24 * 3600, sweep_interval_seconds=60):
+        self.db_path = db_path or None
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self.lock = threading.Lock()
+        # { sid: [payload bytes, expires_at, version] }; with db_path a cache of rows, trusted only at the row's version
+        self.entries = {}
+        # Sessions whose expiry moved since the last sweep; their new expiry is persisted in one batch
+        self.touched = set()
+        self.counts = {'loads': 0, 'writes': 0, 'unchanged': 0, 'conflicts': 0, 'dropped': 0, 'deletes': 0, 'expired': 0}
+        self.local = threading.local()
+        self.sweeper = None
+        # The database is opened and its schema created on first use, so importing an app creates no file
+        self.schema_ready = False
+        self.schema_lock = threading.Lock()
+
+    def _db(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        if not self.schema_ready:
+            with self.schema_lock:
+                if not self.schema_ready:
+                    self._init_schema(connection)
+                    self.schema_ready = True
+        return connection
+
+    def _init_schema(self, connection):
+        with connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    sid TEXT PRIMARY KEY,
+                    payload BLOB NOT NULL,
+                    expires_at REAL NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 1
+                ) WITHOUT ROWID""")
+            if 'version' not in {row[1] for row in connection.execute('PRAGMA table_info(sessions)')}:
+                connection.execute('ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)")
+
+    def load(self, sid):
+        """(payload, version) for sid, or None if it is unknown or expired. Extends the expiry without writing."""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(sid)
+        if self.db_path:
+            # The payload is only transferred when another worker wrote a newer version than the cached one
+            row = self._db().execute(
+                "SELECT CASE WHEN version = ? THEN NULL ELSE payload END, expires_at, version FROM sessions WHERE sid = ?",
+                (entry[2] if entry else None, sid)).fetchone()
+            if row is None:
+                with self.lock:
+                    self.entries.pop(sid, None)
+                return None
+            payload, expires_at, version = row
+            if payload is None:
+                # Expiry extensions by this worker that the sweeper has not persisted yet still count
+                payload, expires_at = entry[0], max(expires_at, entry[1])
+            entry = [payload, expires_at, version]
+            with self.lock:
+                self.entries[sid] = entry
+        if entry is None or entry[1] < now:
+            return None
+        with self.lock:
+            entry[1] = now + self.ttl_seconds
+            self.touched.add(sid)
+            self.counts['loads'] += 1
+        return entry[0], entry[2]
+
+    def save(self, sid, payload, loaded_payload=None, loaded_version=None):
+        """Store payload unless it equals the payload the request loaded; returns whether it was written.
+
+        The write only succeeds if the stored version is still loaded_version (None: no stored session);
+        otherwise SessionConflictError is raised and nothing is written.
+        """
+        if payload == loaded_payload:
+            with self.lock:
+                self.counts['unchanged'] += 1
+            return False
+        expires_at = time.time() + self.ttl_seconds
+        version = (loaded_version or 0) + 1
+        if self.db_path:
+            with self._db() as connection:
+                if loaded_version is None:
+                    written = connection.execute(
+                        "INSERT INTO sessions (sid, payload, expires_at, version) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(sid) DO NOTHING", (sid, payload, expires_at, version)).rowcount
+                else:
+                    written = connection.execute(
+                        "UPDATE sessions SET payload = ?, expires_at = ?, version = ? WHERE sid = ? AND version = ?",
+                        (payload, expires_at, version, sid, loaded_version)).rowcount
+            with self.lock:
+                if not written:
+                    self.counts['conflicts'] += 1
+                    raise SessionConflictError(sid)
+                self.entries[sid] = [payload, expires_at, version]
+                self.touched.discard(sid)
+                self.counts['writes'] += 1
+            return True
+        with self.lock:
+            entry = self.entries.get(sid)
+            if (entry[2] if entry else None) != loaded_version:
+                self.counts['conflicts'] += 1
+                raise SessionConflictError(sid)
+            self.entries[sid] = [payload, expires_at, version]
+            self.touched.discard(sid)
+            self.counts['writes'] += 1
+        return True
+
+    def record_dropped(self):
+        """Count a session write given up after SAVE_ATTEMPTS conflicts (shown as stat="dropped")."""
+        with self.lock:
+            self.counts['dropped'] += 1
+
+    def delete(self, sid):
+        with self.lock:
+            self.entries.pop(sid, None)
+            self.touched.discard(sid)
+            self.counts['deletes'] += 1
+        if self.db_path:
+            with self._db() as connection:
+                connection.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def sweep(self, now=None):
+        """Drop expired sessions and persist the expiry of sessions used since the last sweep."""
+        now = now or time.time()
+        with self.lock:
+            expired = [sid for sid, (_, expires_at, _) in self.entries.items() if expires_at < now]
+            for sid in expired:
+                del self.entries[sid]
+            touched = [(self.entries[sid][1], sid) for sid in self.touched if sid in self.entries]
+            self.touched.clear()
+        removed = len(expired)
+        if self.db_path:
+            with self._db() as connection:
+                connection.executemany("UPDATE sessions SET expires_at = MAX(expires_at, ?) WHERE sid = ?", touched)
+                removed = max(removed, connection.execute("DELETE FROM sessions WHERE expires_at < ?", (now,)).rowcount)
+        with self.lock:
+            self.counts['expired'] += removed
+        return removed
+
+    def start_sweeper(self):
+        with self.lock:
+            if self.sweeper is not None:
+                return
+            self.sweeper = threading.Thread(target=self._sweep_forever, name='session-sweeper', daemon=True)
+        self.sweeper.start()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval_seconds)
+            try:
+                self.sweep()
+            except Exception as exc:
+                print(f"Session sweep failed: {exc}")
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, sessions=len(self.entries))
+
+    def gauges(self):
+        """Store counts in the apps' /metrics format."""
+        return {('app_session_store', (('stat', name),)): value for name, value in self.stats().items()}
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface backed by a SessionStore; the cookie holds only the (signed) session id."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='server-side-session')
+
+    def _session_id(self, app, cookie):
+        try:
+            return self._signer(app).unsign(cookie).decode('ascii')
+        except (BadSignature, UnicodeDecodeError):
+            return None
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            # Flask then uses a NullSession, which refuses writes with an error explaining the missing key
+            return None
+        self.store.start_sweeper()
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        sid = self._session_id(app, cookie) if cookie else None
+        loaded = self.store.load(sid) if sid else None
+        if loaded is not None:
+            payload, version = loaded
+            try:
+                return ServerSideSession(sid, pickle.loads(payload), loaded_payload=payload, loaded_version=version)
+            except Exception as exc:
+                print(f"Discarding unreadable session {sid}: {exc}")
+        return ServerSideSession(secrets.token_urlsafe(32), new=True)
+
+    def _store(self, app, session):
+        """Save the session, merging its changed keys into any newer version another request wrote meanwhile."""
+        base = pickle.loads(session.loaded_payload) if session.loaded_payload is not None else {}
+        ours = dict(session)
+        changed = {key: value for key, value in ours.items() if key not in base or base[key] != value}
+        removed = [key for key in base if key not in ours]
+        payload = pickle.dumps(ours, protocol=pickle.HIGHEST_PROTOCOL)
+        loaded_payload, loaded_version = session.loaded_payload, session.loaded_version
+        for _ in range(SAVE_ATTEMPTS):
+            try:
+                self.store.save(session.sid, payload, loaded_payload, loaded_version)
+                return
+            except SessionConflictError:
+                current = self.store.load(session.sid)
+                loaded_payload, loaded_version = current if current is not None else (None, None)
+                merged = pickle.loads(loaded_payload) if loaded_payload is not None else {}
+                merged.update(changed)
+                for key in removed:
+                    merged.pop(key, None)
+                payload = pickle.dumps(merged, protocol=pickle.HIGHEST_PROTOCOL)
+        self.store.record_dropped()
+        app.logger.error("Session %s not saved: it changed concurrently %d times in a row; this request's changes "
+                         "to it are lost.", session.sid, SAVE_ATTEMPTS)
+
+    def save_session(self, app, session, response):
+        if self.is_null_session(session):
+            return
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            # Requests that never stored anything (e.g. /ready, /metrics) create no session
+            if not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        self._store(app, session)
+        if session.new or (session.permanent and app.config['SESSION_REFRESH_EACH_REQUEST']):
+            response.set_cookie(name, self._signer(app).sign(session.sid).decode('ascii'),
+                                expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
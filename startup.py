@@ -0,0 +1,108 @@
+"""Startup warm-up and readiness shared by the Japanese and German apps.
+
+Module import should stay under budget with the lazily imported modules unloaded; a warm-up thread then runs
+the app's phases (loading local caches, opening pooled connections) before /ready answers 200. The time of
+each phase and any phase that failed go into the startup report, shown by /ready and in /metrics:
+
+    startup = Startup(STARTUP_STARTED_AT, 'app.py', [('templates', warm_templates), ('openai', llm.warm)])
+    startup.init_app(app)
+
+    if __name__ == '__main__':
+        startup.begin()
+        app.run()
+
+Importing the app only records how long the import took. Warm-up starts when the server entry point calls
+begin(), or with the first request under servers that import the app themselves, so CLI commands (flask
+pregenerate) and tooling that import the app make no network calls. STARTUP_WARMUP=0 skips the phases and
+reports ready straight away.
+"""
+import os
+import sys
+import time
+from threading import Event, Lock, Thread
+
+from flask import jsonify
+
+STARTUP_IMPORT_BUDGET_SECONDS = float(os.environ.get('STARTUP_IMPORT_BUDGET_SECONDS', '0.5'))
+STARTUP_WARMUP = os.environ.get('STARTUP_WARMUP', '1') != '0'
+LAZY_IMPORTED_MODULES = ('openai',)
+
+
+class Startup:
+    """Import timing, warm-up phases and the ready flag of one app process."""
+
+    def __init__(self, started_at, script, phases, import_budget_seconds=STARTUP_IMPORT_BUDGET_SECONDS,
+                 warmup=STARTUP_WARMUP, lazy_modules=LAZY_IMPORTED_MODULES):
+        self.started_at = started_at
+        self.script = script
+        self.phases = phases
+        self.import_budget_seconds = import_budget_seconds
+        self.warmup = warmup
+        self.lazy_modules = lazy_modules
+        # { 'phases': {name: seconds}, 'errors': {name: message}, 'eager_imports': [module], 'total_seconds': float }
+        self.report = {'phases': {}, 'errors': {}, 'eager_imports': [], 'total_seconds': None}
+        self.ready = Event()
+        self.begun_at = None
+        self.lock = Lock()
+        self.record_import()
+
+    def init_app(self, app):
+        app.add_url_rule('/ready', 'ready', self.ready_response)
+        app.before_request(self.begin)
+
+    def ready_response(self):
+        if not self.ready.is_set():
+            return jsonify({'status': 'warming', 'startup': self.report}), 503
+        return jsonify({'status': 'ready', 'startup': self.report})
+
+    def run_phase(self, name, step):
+        start_time = time.perf_counter()
+        try:
+            step()
+        except Exception as exc:
+            self.report['errors'][name] = f"{type(exc).__name__}: {exc}"
+        self.report['phases'][name] = round(time.perf_counter() - start_time, 4)
+
+    def warm_up(self):
+        """Run each warm-up phase, then mark the process ready and print the report."""
+        for name, step in self.phases:
+            self.run_phase(name, step)
+        self.finish()
+
+    def finish(self):
+        # Import plus warm-up, leaving out any wait between the import and begin()
+        self.report['total_seconds'] = round(self.report['phases']['import'] + time.perf_counter() - self.begun_at, 4)
+        self.ready.set()
+        phases = ', '.join(f"{name}={seconds:.3f}s" for name, seconds in self.report['phases'].items())
+        print(f"Startup ready in {self.report['total_seconds']:.3f}s ({phases})")
+        for name, error in self.report['errors'].items():
+            print(f"Startup warm-up step {name} failed: {error}")
+
+    def record_import(self):
+        import_seconds = time.perf_counter() - self.started_at
+        self.report['phases']['import'] = round(import_seconds, 4)
+        self.report['eager_imports'] = [module for module in self.lazy_modules if module in sys.modules]
+        if import_seconds > self.import_budget_seconds or self.report['eager_imports']:
+            print(f"Import took {import_seconds:.3f}s (budget {self.import_budget_seconds:.3f}s); "
+                  f"eagerly imported: {', '.join(self.report['eager_imports']) or 'none'}. "
+                  f"Profile with: python -X importtime {self.script}")
+
+    def begin(self):
+        """Start warm-up, once per process; later calls (one per request) return straight away."""
+        if self.begun_at is not None:
+            return
+        with self.lock:
+            if self.begun_at is not None:
+                return
+            self.begun_at = time.perf_counter()
+        if self.warmup:
+            Thread(target=self.warm_up, name='warm-up', daemon=True).start()
+        else:
+            self.finish()
+
+    def gauges(self):
+        """Ready flag and phase timings in the apps' /metrics format."""
+        gauges = {('app_ready', ()): int(self.ready.is_set())}
+        for phase, seconds in list(self.report['phases'].items()):
+            gauges[('app_startup_seconds', (('phase', phase),))] = seconds
+        return gauges
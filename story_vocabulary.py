@@ -0,0 +1,116 @@
+"""Bounded story vocabulary shared by the Japanese and German apps.
+
+Story prompts use a subset of the burned words instead of the whole list: a rotating list that is the same
+for every story on a given day (so the prompt prefix stays cacheable), followed by up to scenario_limit
+scenario-relevant words after the cacheable prefix. Each app subclasses StoryVocabulary with how its words
+are matched against a scenario:
+
+    story_vocabulary = GermanStoryVocabulary(VOCABULARY_CATEGORIES)
+    daily_words, scenario_words = story_vocabulary.select(get_burned_words(wortlist_file), scenario_text)
+
+The words passed in are the app's cached sorted, de-duplicated tuple, used as they are: nothing here copies
+or sorts the whole list, and the index built from it is kept until a different tuple comes in.
+"""
+import hashlib
+import re
+from datetime import datetime
+from threading import Lock
+
+VOCABULARY_SUBSET_SIZE = 200
+VOCABULARY_SCENARIO_SIZE = 100
+
+
+class StoryVocabulary:
+    """Daily and scenario-relevant word selection from a cached word tuple.
+
+    categories: {category: (scenario keywords, markers)}; a scenario naming one of the keywords brings in the
+    words that in_category() puts in that category. Subclasses define lexical_keys, scenario_keys,
+    mentions_word and in_category; mentions_keyword and tokens have defaults for space-separated text.
+    """
+
+    def __init__(self, categories, limit=VOCABULARY_SUBSET_SIZE, scenario_limit=VOCABULARY_SCENARIO_SIZE):
+        self.categories = categories
+        self.limit = limit
+        self.scenario_limit = scenario_limit
+        # Index of the last word tuple seen, keyed on its identity: a changed list is always published as a new tuple
+        self.cached = {'words': None, 'index': None}
+        self.lock = Lock()
+
+    # Language-specific matching
+
+    def lexical_keys(self, word):
+        """Keys under which the word is indexed for finding it in a scenario."""
+        raise NotImplementedError
+
+    def scenario_keys(self, scenario, tokens):
+        """Keys of the scenario to look up in the lexical index."""
+        raise NotImplementedError
+
+    def mentions_word(self, word, scenario, tokens):
+        raise NotImplementedError
+
+    def in_category(self, word, markers):
+        raise NotImplementedError
+
+    def tokens(self, scenario):
+        return set(re.findall(r"\w+", scenario))
+
+    def mentions_keyword(self, keyword, scenario, tokens):
+        # Keywords match whole words or simple plurals
+        return keyword in tokens or f"{keyword}s" in tokens
+
+    # Selection
+
+    def build_index(self, words):
+        """Precompute the lexical (key -> words) and category (category -> words) indexes and the rotation
+        order (a fixed pseudo-random order, the same in every process)."""
+        by_key = {}
+        by_category = {category: [] for category in self.categories}
+        for word in words:
+            for key in self.lexical_keys(word):
+                by_key.setdefault(key, []).append(word)
+            for category, (_, markers) in self.categories.items():
+                if self.in_category(word, markers):
+                    by_category[category].append(word)
+        rotation = sorted(words, key=lambda word: hashlib.sha1(word.encode('utf-8')).hexdigest())
+        return {'by_key': by_key, 'by_category': by_category, 'rotation': rotation}
+
+    def index(self, words):
+        with self.lock:
+            if self.cached['words'] is not words:
+                self.cached['index'] = self.build_index(words)
+                self.cached['words'] = words
+            return self.cached['index']
+
+    def select(self, words, scenario_text, day=None):
+        """Return (daily_words, scenario_words). daily_words are `limit` consecutive words of the rotation
+        order, starting at an offset that advances by `limit` each day, so identical for every story that day
+        and every burned word comes back around. scenario_words are up to `scenario_limit` other words named
+        in the scenario, then words from the scenario's categories."""
+        if len(words) <= self.limit:
+            return words, []
+
+        index = self.index(words)
+        scenario = (scenario_text or '').lower()
+        tokens = self.tokens(scenario)
+        mentioned = {
+            word
+            for key in self.scenario_keys(scenario, tokens)
+            for word in index['by_key'].get(key, [])
+            if self.mentions_word(word, scenario, tokens)
+        }
+        category_words = set()
+        for category, (keywords, _) in self.categories.items():
+            if any(self.mentions_keyword(keyword, scenario, tokens) for keyword in keywords):
+                category_words.update(index['by_category'][category])
+
+        day = datetime.now().toordinal() if day is None else day
+        rotation = index['rotation']
+        start = day * self.limit % len(rotation)
+        daily_words = [rotation[(start + offset) % len(rotation)] for offset in range(self.limit)]
+        daily = set(daily_words)
+        # Category words vary from day to day too, but are fixed within a day so identical requests match
+        category_order = sorted(category_words - mentioned - daily,
+                                key=lambda word: hashlib.sha1(f"{day}:{word}".encode('utf-8')).hexdigest())
+        scenario_words = (sorted(mentioned - daily) + category_order)[:self.scenario_limit]
+        return daily_words, scenario_words
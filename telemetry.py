@@ -0,0 +1,450 @@
+"""Metrics, request tracing and the usage event store shared by the Japanese and German apps.
+
+Counters and histograms are kept in process and rendered in the Prometheus text format at /metrics;
+init_tracing(app) gives every request a trace whose spans are shown at /debug/traces; usage events are
+recorded in SQLite (USAGE_DB_PATH) and summarised at /debug/usage:
+
+    from telemetry import increment_counter, init_tracing, observe_histogram, trace_span, traced
+    init_tracing(app)
+    increment_counter('wanikani_requests_total', route='anki', error='none')
+    with trace_span('wanikani assignments', 'wanikani'):
+        ...
+    record_usage_event('story', {'words': 3})
+
+The debug endpoints expose prompts, usage and cost data, so they are wrapped in debug_access_required:
+clients send DEBUG_ACCESS_TOKEN as a bearer token (Authorization: Bearer <token>). Without a configured
+token they answer 403, unless DEBUG_ALLOW_LOCAL=1 lets requests from the local machine in.
+"""
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+from threading import Lock, Thread
+
+from flask import abort, before_render_template, g, has_request_context, request, template_rendered
+
+DEBUG_ACCESS_TOKEN = os.environ.get('DEBUG_ACCESS_TOKEN', '')
+# Opt-in only: a proxy on the same host that does not set X-Forwarded-For makes every request look local
+DEBUG_ALLOW_LOCAL = os.environ.get('DEBUG_ALLOW_LOCAL', '0') != '0'
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+# Prometheus-style metrics: counters and histograms keyed by (name, sorted label items)
+metric_counters = {}
+metric_histograms = {}
+metrics_lock = Lock()
+LATENCY_BUCKETS_SECONDS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+
+# Lightweight request tracing: each request gets a trace id and a tree of spans (external calls, file I/O,
+# template rendering, background jobs it spawned). Recent traces are kept for /debug/traces.
+TRACE_HISTORY_SIZE = 50
+recent_traces = deque(maxlen=TRACE_HISTORY_SIZE)
+traces_lock = Lock()
+current_span = ContextVar('current_span', default=None)
+# Endpoints that serve telemetry or health checks are not kept in recent_traces
+UNTRACED_ENDPOINTS = ('debug_traces', 'debug_usage', 'metrics', 'ready', 'static')
+
+# Usage events (one row per story, anki session or conversation start) live in SQLite, indexed by time and
+# feature. last_run keeps the latest timestamp per feature ('*' for any) so the "Last run" lookup is a
+# primary-key read.
+USAGE_DB_PATH = os.environ.get('USAGE_DB_PATH', 'usage_events.db')
+USAGE_RETENTION_DAYS = int(os.environ.get('USAGE_RETENTION_DAYS', '365'))
+LEGACY_DATETIME_LOG_PATH = 'datetime_log.txt'
+ALL_FEATURES = '*'
+usage_db_local = threading.local()
+usage_db_lock = Lock()
+usage_db_state = {'ready': False, 'last_pruned': 0.0}
+
+
+def _metric_key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def increment_counter(name, amount=1, **labels):
+    key = _metric_key(name, labels)
+    with metrics_lock:
+        metric_counters[key] = metric_counters.get(key, 0) + amount
+
+
+def observe_histogram(name, value, **labels):
+    key = _metric_key(name, labels)
+    with metrics_lock:
+        histogram = metric_histograms.get(key)
+        if histogram is None:
+            histogram = metric_histograms[key] = {'buckets': [0] * len(LATENCY_BUCKETS_SECONDS), 'sum': 0.0, 'count': 0}
+        for position, bound in enumerate(LATENCY_BUCKETS_SECONDS):
+            if value <= bound:
+                histogram['buckets'][position] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def job_gauges(job_states):
+    """Per-state counts and queue depth of background jobs from their (queue, state) pairs, and the thread count."""
+    states = {}
+    for queue, state in job_states:
+        key = (queue, state or 'unknown')
+        states[key] = states.get(key, 0) + 1
+    gauges = {('app_jobs', (('queue', queue), ('state', state))): value for (queue, state), value in states.items()}
+    for queue in {queue for queue, _ in states}:
+        depth = states.get((queue, 'in_progress'), 0) + states.get((queue, 'pending'), 0)
+        gauges[('app_job_queue_depth', (('queue', queue),))] = depth
+    gauges[('app_threads', ())] = threading.active_count()
+    return gauges
+
+
+def render_metrics(gauges):
+    """Render counters, histograms and the given {(name, labels_dict): value} gauges in Prometheus text format."""
+    lines = []
+    with metrics_lock:
+        counters = sorted(metric_counters.items())
+        histograms = sorted(metric_histograms.items())
+    for name in sorted({name for (name, _), _ in counters}):
+        lines.append(f"# TYPE {name} counter")
+        lines.extend(f"{name}{_format_labels(labels)} {value}" for (metric, labels), value in counters if metric == name)
+    for name in sorted({name for (name, _), _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), histogram in histograms:
+            if metric != name:
+                continue
+            for bound, count in zip(LATENCY_BUCKETS_SECONDS, histogram['buckets']):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+    for name in sorted({name for (name, _) in gauges}):
+        lines.append(f"# TYPE {name} gauge")
+        for (metric, labels), value in gauges.items():
+            if metric == name:
+                lines.append(f"{name}{_format_labels(tuple(sorted(labels)))} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def current_route():
+    if has_request_context():
+        return request.endpoint or 'unknown'
+    span = current_span.get()
+    return f"{span['trace']['route']}:background" if span else 'background'
+
+
+def begin_span(name, kind='internal', background=False):
+    """Open a child span of the current span; returns None (and records nothing) outside a trace."""
+    parent = current_span.get()
+    if parent is None:
+        return None
+    span = {
+        'id': uuid.uuid4().hex[:8],
+        'parent_id': parent['id'],
+        'trace': parent['trace'],
+        'name': name,
+        'kind': kind,
+        'background': background or parent['background'],
+        'start': time.time(),
+        'end': None,
+    }
+    with traces_lock:
+        parent['trace']['spans'].append(span)
+    span['token'] = current_span.set(span)
+    return span
+
+
+def end_span(span):
+    if span is None:
+        return
+    span['end'] = time.time()
+    current_span.reset(span.pop('token'))
+
+
+@contextmanager
+def trace_span(name, kind='internal'):
+    span = begin_span(name, kind)
+    try:
+        yield span
+    finally:
+        end_span(span)
+
+
+def traced(kind, name=None):
+    """Decorator recording each call of the function as a span of the given kind."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with trace_span(name or function.__name__, kind):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_background_thread(target, args=(), daemon=True):
+    """Start a thread whose work is recorded as a background span of the current request's trace."""
+    parent = current_span.get()
+
+    def run():
+        if parent is None:
+            target(*args)
+            return
+        token = current_span.set(parent)
+        try:
+            span = begin_span(target.__name__, 'job', background=True)
+            try:
+                target(*args)
+            finally:
+                end_span(span)
+        finally:
+            current_span.reset(token)
+
+    Thread(target=run, daemon=daemon).start()
+
+
+def start_request_trace():
+    trace = {
+        'id': uuid.uuid4().hex[:16],
+        'route': request.endpoint or 'unknown',
+        'method': request.method,
+        'path': request.path,
+        'status': None,
+        'spans': [],
+    }
+    root = {'id': 'root', 'parent_id': None, 'trace': trace, 'name': f"{request.method} {request.path}",
+            'kind': 'request', 'background': False, 'start': time.time(), 'end': None}
+    trace['spans'].append(root)
+    g.trace_root = root
+    g.trace_token = current_span.set(root)
+
+
+def finish_request_trace(response):
+    root = g.pop('trace_root', None)
+    if root is None:
+        return response
+    root['end'] = time.time()
+    trace = root['trace']
+    trace['status'] = response.status_code
+    if request.endpoint not in UNTRACED_ENDPOINTS:
+        with traces_lock:
+            recent_traces.append(trace)
+
+    durations = {}
+    with traces_lock:
+        spans = list(trace['spans'])
+    for span in spans:
+        if span['kind'] != 'request' and not span['background'] and span['end'] is not None:
+            durations[span['kind']] = durations.get(span['kind'], 0.0) + (span['end'] - span['start'])
+    timings = [f"{kind};dur={seconds * 1000:.1f}" for kind, seconds in sorted(durations.items())]
+    timings.append(f"total;dur={(root['end'] - root['start']) * 1000:.1f}")
+    response.headers['Server-Timing'] = ', '.join(timings)
+    response.headers['X-Trace-Id'] = trace['id']
+    return response
+
+
+def reset_request_trace(exc):
+    token = g.pop('trace_token', None)
+    if token is not None:
+        current_span.reset(token)
+
+
+def _begin_template_span(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault('template_spans', []).append(begin_span(f"render {template.name}", 'template'))
+
+
+def _end_template_span(sender, template, context, **extra):
+    if has_request_context() and g.get('template_spans'):
+        end_span(g.template_spans.pop())
+
+
+def init_tracing(app):
+    """Trace every request of the app and every template it renders."""
+    app.before_request(start_request_trace)
+    app.after_request(finish_request_trace)
+    app.teardown_request(reset_request_trace)
+    before_render_template.connect(_begin_template_span, app)
+    template_rendered.connect(_end_template_span, app)
+
+
+def trace_waterfall(trace):
+    """Flatten a trace into rows with depth and offsets (ms) relative to the request start."""
+    with traces_lock:
+        spans = list(trace['spans'])
+    root = spans[0]
+    trace_end = max((span['end'] or time.time()) for span in spans)
+    total_ms = max((trace_end - root['start']) * 1000, 0.001)
+    depths = {}
+    rows = []
+    for span in spans:
+        depth = depths.get(span['parent_id'], -1) + 1
+        depths[span['id']] = depth
+        offset_ms = (span['start'] - root['start']) * 1000
+        duration_ms = ((span['end'] or time.time()) - span['start']) * 1000
+        rows.append({
+            'name': span['name'],
+            'kind': span['kind'],
+            'depth': depth,
+            'background': span['background'],
+            'running': span['end'] is None,
+            'offset_ms': offset_ms,
+            'duration_ms': duration_ms,
+            'left_pct': offset_ms / total_ms * 100,
+            'width_pct': max(duration_ms / total_ms * 100, 0.3),
+        })
+    return {
+        'id': trace['id'],
+        'route': trace['route'],
+        'method': trace['method'],
+        'path': trace['path'],
+        'status': trace['status'],
+        'started': datetime.fromtimestamp(root['start']).strftime("%Y-%m-%d %H:%M:%S"),
+        'total_ms': total_ms,
+        'rows': rows,
+    }
+
+
+def usage_db():
+    """Per-thread SQLite connection to the usage event store, creating the schema on first use."""
+    connection = getattr(usage_db_local, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(USAGE_DB_PATH, timeout=5)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        usage_db_local.connection = connection
+    if not usage_db_state['ready']:
+        with usage_db_lock:
+            if not usage_db_state['ready']:
+                init_usage_db(connection)
+                usage_db_state['ready'] = True
+    return connection
+
+
+def init_usage_db(connection):
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS usage_events (
+            id INTEGER PRIMARY KEY,
+            ts REAL NOT NULL,
+            feature TEXT NOT NULL,
+            detail TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_usage_events_ts ON usage_events (ts);
+        CREATE INDEX IF NOT EXISTS idx_usage_events_feature_ts ON usage_events (feature, ts);
+        CREATE TABLE IF NOT EXISTS last_run (feature TEXT PRIMARY KEY, ts REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS usage_meta (key TEXT PRIMARY KEY, value TEXT);
+    """)
+    import_legacy_datetime_log(connection)
+
+
+def import_legacy_datetime_log(connection, path=LEGACY_DATETIME_LOG_PATH):
+    """One-time import of datetime_log.txt timestamps as 'legacy' events; the file is left in place."""
+    if connection.execute("SELECT 1 FROM usage_meta WHERE key = 'legacy_log_imported'").fetchone():
+        return
+    timestamps = []
+    try:
+        with open(path, 'r') as log_file:
+            for line in log_file:
+                try:
+                    timestamps.append(datetime.strptime(line.strip(), "%Y-%m-%d %H:%M:%S").timestamp())
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    with connection:
+        connection.executemany("INSERT INTO usage_events (ts, feature) VALUES (?, 'legacy')",
+                               [(ts,) for ts in timestamps])
+        if timestamps:
+            connection.execute("INSERT INTO last_run (feature, ts) VALUES (?, ?) "
+                               "ON CONFLICT(feature) DO UPDATE SET ts = max(ts, excluded.ts)",
+                               (ALL_FEATURES, max(timestamps)))
+        connection.execute("INSERT INTO usage_meta (key, value) VALUES ('legacy_log_imported', ?)", (str(len(timestamps)),))
+
+
+@traced('db')
+def record_usage_event(feature, detail=None):
+    now = time.time()
+    connection = usage_db()
+    with connection:
+        connection.execute('INSERT INTO usage_events (ts, feature, detail) VALUES (?, ?, ?)',
+                           (now, feature, json.dumps(detail, ensure_ascii=False) if detail else None))
+        connection.executemany('INSERT INTO last_run (feature, ts) VALUES (?, ?) '
+                               'ON CONFLICT(feature) DO UPDATE SET ts = excluded.ts',
+                               [(feature, now), (ALL_FEATURES, now)])
+    if now - usage_db_state['last_pruned'] > 24 * 60 * 60:
+        usage_db_state['last_pruned'] = now
+        prune_usage_events(now)
+
+
+def prune_usage_events(now=None):
+    """Retention policy: drop events older than USAGE_RETENTION_DAYS (last_run is kept)."""
+    cutoff = (now or time.time()) - USAGE_RETENTION_DAYS * 24 * 60 * 60
+    connection = usage_db()
+    with connection:
+        deleted = connection.execute('DELETE FROM usage_events WHERE ts < ?', (cutoff,)).rowcount
+    if deleted:
+        print(f"Pruned {deleted} usage events older than {USAGE_RETENTION_DAYS} days.")
+
+
+@traced('db')
+def get_last_run_datetime(feature=ALL_FEATURES):
+    row = usage_db().execute('SELECT ts FROM last_run WHERE feature = ?', (feature,)).fetchone()
+    if row is None:
+        return "No run history available."
+    return datetime.fromtimestamp(row[0]).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def summarise_usage(days=30):
+    """Per-feature totals and per-day counts for the last `days` days."""
+    since = time.time() - days * 24 * 60 * 60
+    connection = usage_db()
+    features = [
+        {'feature': feature, 'count': count,
+         'first': datetime.fromtimestamp(first).strftime("%Y-%m-%d %H:%M:%S"),
+         'last': datetime.fromtimestamp(last).strftime("%Y-%m-%d %H:%M:%S")}
+        for feature, count, first, last in connection.execute(
+            'SELECT feature, COUNT(*), MIN(ts), MAX(ts) FROM usage_events WHERE ts >= ? '
+            'GROUP BY feature ORDER BY feature', (since,))
+    ]
+    daily = {}
+    for day, feature, count in connection.execute(
+            "SELECT date(ts, 'unixepoch', 'localtime') AS day, feature, COUNT(*) FROM usage_events "
+            "WHERE ts >= ? GROUP BY day, feature ORDER BY day", (since,)):
+        daily.setdefault(day, {})[feature] = count
+    return {'days': days, 'features': features, 'daily': daily}
+
+
+def is_local_request():
+    """True if both the connecting peer and the client address ProxyFix took from X-Forwarded-For are loopback."""
+    peer = request.environ.get('werkzeug.proxy_fix.orig', {}).get('REMOTE_ADDR', request.environ.get('REMOTE_ADDR'))
+    return peer in LOCAL_ADDRESSES and request.remote_addr in LOCAL_ADDRESSES
+
+
+def has_debug_access():
+    """DEBUG_ACCESS_TOKEN as a bearer token, or a local request when DEBUG_ALLOW_LOCAL is set."""
+    if DEBUG_ALLOW_LOCAL and is_local_request():
+        return True
+    header = request.headers.get('Authorization', '')
+    if not DEBUG_ACCESS_TOKEN or not header.startswith('Bearer '):
+        return False
+    return hmac.compare_digest(header[len('Bearer '):].encode('utf-8'), DEBUG_ACCESS_TOKEN.encode('utf-8'))
+
+
+def debug_access_required(view):
+    """Answer 403 for views exposing internal data unless has_debug_access()."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not has_debug_access():
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapper